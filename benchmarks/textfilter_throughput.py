@@ -0,0 +1,42 @@
+"""
+Measures the throughput of textfilter.py on a chat log with one message per
+line, or a made up one if no path is given.
+
+python benchmarks/textfilter_throughput.py [chat_log.txt] [repeat]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "speekaboo"))
+
+from textfilter import filter_text # pylint: disable=wrong-import-position
+
+def main(path: str|None = None, repeat: int = 10):
+    if path is not None:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    else:
+        lines = [
+            "hello chat how is everyone doing today",
+            "check out https://example.com/some/long/path?with=query&and=more lol",
+            "Kappa Kappa Kappa Kappa Kappa Kappa Kappa Kappa Kappa Kappa",
+            "LETS GOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOO",
+            "\U0001f602\U0001f602\U0001f602\U0001f602\U0001f602\U0001f525\U0001f525\U0001f525\U0001f525",
+            "z\u0301\u0302\u0303\u0304\u0305\u0306a\u0307\u0308\u0309\u030a\u030b\u030cl\u030d\u030e\u030f\u0310go",
+            "www.example.org is where i found it",
+        ] * 1000
+
+    chars = sum(len(line) for line in lines)
+    removed = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        removed = sum(filter_text(line)[1] for line in lines)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    print(f"{len(lines)} messages, {chars} characters: {elapsed * 1000:.1f} ms "
+          f"({len(lines) / elapsed:.0f} messages/s), removed {removed} characters ({removed / max(chars, 1):.0%})")
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None, *[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,57 @@
+"""
+Sends speak commands to a local UDPIngest as fast as possible and reports how
+many made it through on the loopback interface. The commands aren't queued.
+
+python benchmarks/udp_flood.py [seconds] [senders]
+"""
+
+import sys
+import json
+import time
+import socket
+from pathlib import Path
+from threading import Thread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "speekaboo"))
+
+from udp_ingest import UDPIngest # pylint: disable=wrong-import-position
+
+def main(seconds: float = 5.0, senders: int = 2):
+    ingest = UDPIngest("127.0.0.1", 0, lambda _json_data, _addr: None)
+    ingest.bind()
+    receiver = Thread(target=ingest.serve_forever, daemon=True)
+    receiver.start()
+
+    payload = json.dumps({
+        "command": "speak",
+        "voice": "EventVoice",
+        "message": "Thanks for the follow, welcome to the stream!",
+        "sender": "flood"
+    }).encode("utf-8")
+    sent = [0] * senders
+
+    def send(index: int, deadline: float):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            while time.perf_counter() < deadline:
+                for _ in range(100):
+                    sock.sendto(payload, ("127.0.0.1", ingest.port))
+                sent[index] += 100
+
+    deadline = time.perf_counter() + seconds
+    threads = [Thread(target=send, args=(i, deadline)) for i in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Let the worker catch up
+    time.sleep(0.5)
+    ingest.close()
+
+    stats = ingest.stats()
+    total = sum(sent)
+    print(f"sent {total} ({total / seconds:.0f}/s), received {stats['received']} ({stats['received'] / seconds:.0f}/s), "
+          f"handled {stats['handled']}, dropped {stats['dropped']} in the queue, "
+          f"{total - stats['received']} lost before the socket")
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:2]], *[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,59 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+Speeds up speech when the queue falls behind.
+
+When adaptive_rate_enabled is set, the length_scale of each message is
+multiplied by a factor picked from the estimated backlog when it is synthesized:
+ - Up to adaptive_rate_start seconds of backlog, the factor is 1 (normal speed).
+ - From there to adaptive_rate_full seconds, it goes down linearly.
+ - Past adaptive_rate_full seconds, it stays at adaptive_rate_min_scale.
+
+A shorter length_scale means faster speech, so this cuts both the synthesis time
+and the playback time. As the backlog drains, the factor goes back up to 1.
+"""
+
+import config
+
+def length_factor(backlog: float) -> float:
+    """
+    Returns the length_scale multiplier for the given backlog in seconds.
+    """
+    if not config.config["adaptive_rate_enabled"]:
+        return 1.0
+
+    start = config.config["adaptive_rate_start"]
+    full = config.config["adaptive_rate_full"]
+    min_scale = max(0.1, min(config.config["adaptive_rate_min_scale"], 1.0))
+
+    if backlog <= start:
+        return 1.0
+    if full <= start or backlog >= full:
+        return min_scale
+    return 1.0 - (1.0 - min_scale) * (backlog - start) / (full - start)
+
+def rate(factor: float) -> float:
+    """
+    Converts a length_scale multiplier to the value for the rate field of the
+    texttospeech events: 0 is normal speed, 0.25 is 25% faster, and so on.
+    """
+    return round(1.0 / factor - 1.0, 3)
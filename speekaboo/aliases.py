@@ -0,0 +1,127 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+Compiled voice aliases.
+
+config.config["voices"] can be changed by the GUI while a message is being
+synthesized, and an alias can be removed while messages using it are queued. So
+instead of looking up the config dicts over and over, tts.add captures a
+CompiledAlias, which is read only and has everything already worked out. When
+an alias changes, a whole new table is compiled and swapped in, and messages
+that were already queued keep the alias they were queued with.
+"""
+
+import math
+import logging
+from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
+
+import config
+import event
+
+class CompiledAlias:
+    """
+    Read only snapshot of a voice alias.
+    """
+    __slots__ = (
+        "name", "model_name", "model_path", "speaker_id", "length_scale", "noise_scale",
+        "noise_w", "volume", "gain", "priority", "payload"
+    )
+
+    name: str
+    model_name: str
+    model_path: Path|None       # None if the model isn't installed
+    speaker_id: int
+    length_scale: float
+    noise_scale: float
+    noise_w: float
+    volume: float
+    gain: float                 # Volume on a more natural curve, for audio_float_to_int16
+    priority: int
+    payload: Mapping[str, Any]  # Alias part of the texttospeech event payloads
+
+    def __init__(self, name: str, info: dict, model_path: Path|None):
+        volume = float(info.get("volume", 1.0))
+        model_name = info.get("model_name", "")
+        values = {
+            "name": name,
+            "model_name": model_name,
+            "model_path": model_path,
+            "speaker_id": int(info.get("speaker_id", 0) or 0),
+            "length_scale": float(info.get("length_scale", 1.0)),
+            "noise_scale": float(info.get("noise_scale", 0.667)),
+            "noise_w": float(info.get("noise_w", 0.8)),
+            "volume": volume,
+            # Normalize the volume for a more natural curve
+            # https://stackoverflow.com/a/1165188
+            # 32 seems to feel good.
+            "gain": max(0.001, min((math.pow(32.0, volume) - 1) / (32.0 - 1), 1.0)),
+            "priority": int(info.get("priority", config.config["default_priority"])),
+            "payload": MappingProxyType({
+                "engineName": "Speekaboo Piper",
+                "voiceName": model_name,
+                "pitch": 0.0,
+                "volume": 1.0
+            })
+        }
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("CompiledAlias is read only")
+
+    def __delattr__(self, key):
+        raise AttributeError("CompiledAlias is read only")
+
+    def __repr__(self):
+        return f"CompiledAlias({self.name!r}, {self.model_name!r})"
+
+class AliasTable(event.Observer):
+    """
+    The current compiled aliases. Recompiled when the aliases or installed voices change.
+    """
+    def __init__(self, resolve_path: Callable[[str], Path|None]):
+        super().__init__()
+        self.resolve_path = resolve_path
+        self.lock = Lock()
+        self.table: Mapping[str, CompiledAlias] = MappingProxyType({})
+        self.observe("voices_changed", lambda _voice, _installed: self.rebuild())
+
+    def rebuild(self):
+        """
+        Compiles all the aliases and swaps in the new table.
+        """
+        with self.lock:
+            table = {}
+            for name, info in list(config.config["voices"].items()):
+                try:
+                    model_name = info.get("model_name", "")
+                    table[name] = CompiledAlias(name, info, self.resolve_path(model_name) if model_name else None)
+                except (TypeError, ValueError) as e:
+                    logging.error("Invalid voice alias %s: %s", name, e)
+            # Replacing the reference is atomic, readers see either the old or the new table.
+            self.table = MappingProxyType(table)
+
+    def get(self, name: str) -> CompiledAlias|None:
+        return self.table.get(name)
@@ -18,7 +18,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from collections import deque
 import os
 import sys
 import time
@@ -31,6 +30,10 @@ import miniaudio
 import config
 import tts
 import event
+import sinks
+import dedup
+import shedding
+from lanes import LaneQueue
 
 class AudioThread(threading.Thread):
     """
@@ -43,16 +46,10 @@ class AudioThread(threading.Thread):
     busy = False
 
     def pop(self) -> tts.MessageInfo|None:
-        if len(self.queue) > 0:
-            return self.queue.popleft()
-        else:
-            return None
+        return self.queue.pop()
 
-    def peek(self, idx: int = 0) -> tts.MessageInfo | None:
-        if len(self.queue) > idx:
-            return self.queue[idx]
-        else:
-            return None
+    def peek(self) -> tts.MessageInfo | None:
+        return self.queue.peek()
 
     def num_items(self) -> int:
         return len(self.queue)
@@ -63,29 +60,30 @@ class AudioThread(threading.Thread):
 
 
     def toggle_skip(self, message: tts.MessageInfo):
-        try:
-            idx = self.queue.index(message)
-            self.queue[idx].skip = not self.queue[idx].skip
-        except ValueError:
-            pass
+        if any(queued is message for queued in self.queue):
+            message.skip = not message.skip
 
     def clear(self):
-        self.queue.clear()
+        for message in self.queue.clear():
+            if message.deduplicated:
+                dedup.index.finished(message, False)
 
     def push(self, message: tts.MessageInfo):
-        self.queue.append(message)
+        self.queue.put(message, message.priority)
 
     def __init__(self):
         """
         Constructor
         """
         super().__init__(name="Audio Thread")
-        self.queue = deque()
+        self.queue = LaneQueue(cost=shedding.estimate_seconds)
         self.condition = threading.Condition()
         self.playing = False
         self.running = False
         self.device = None
         self.playback_devices = None
+        self.current: tts.MessageInfo|None = None
+        self.started_at = 0.0
 
     def initialize(self):
 
@@ -94,9 +92,24 @@ class AudioThread(threading.Thread):
             self.device.close()
             self.device = None
 
+        # Headless output, e.g. for servers or load testing
+        sink = config.config["output_sink"]
+        if sink != "device":
+            try:
+                self.device = sinks.create_sink(
+                    sink,
+                    path=config.config["output_sink_path"],
+                    sample_rate=config.config["output_sink_sample_rate"],
+                    realtime=config.config["output_sink_realtime"]
+                )
+                event.info(f"Using {sink} audio output")
+            except ValueError as e:
+                event.warn(f"Audio error: {e.args[0]}")
+            return
+
         self.get_devices()
         if not self.playback_devices:
-            event.warn("Unable to find any audio devices")
+            event.warn("Unable to find any audio devices. Set output_sink to \"null\" to run without sound hardware.")
 
         wanted_device = config.config["output_device"]
 
@@ -159,6 +172,15 @@ class AudioThread(threading.Thread):
 
 
 
+    def remaining_seconds(self) -> float:
+        """
+        Returns roughly how much of the current message is left to play.
+        """
+        current = self.current
+        if current is None or not self.playing:
+            return 0.0
+        return max(0.0, current.duration / 1000 - (time.time() - self.started_at))
+
     def stop_playback(self):
         """
         Stops the active speaking voice
@@ -178,6 +200,8 @@ class AudioThread(threading.Thread):
     def play_message(self, message: tts.MessageInfo):
         # https://github.com/irmen/pyminiaudio/blob/master/examples/playcallbacks.py
         start_time = time.time()
+        self.current = message
+        self.started_at = start_time
         stream = self.stream_pcm(message.parsed_data)
         next(stream)
         callbacks_stream = miniaudio.stream_with_callbacks(stream, end_callback=self.stream_end_callback)
@@ -206,37 +230,39 @@ class AudioThread(threading.Thread):
         self.running = True
         while self.running:
 
-            # todo: make this a condition variable
-            while self.running and (len(self.queue) == 0 or self.playing):
+            if config.paused:
                 time.sleep(0.5)
-
-            while self.running and len(self.queue) > 0 and not config.paused:
-
-                message = self.peek()
-                if message is None or message.parsed_data is None:
-                    break
-
-                self.pop()
-                if self.device is None:
-                    message.tts_event("error", "No audio devices")
-                    continue
-
-                
-                message.tts_event("playing")
+                continue
+
+            # Only take messages whose queue_delay has passed. The rest are
+            # synthesized in the meantime and wait here until they are due.
+            message = self.queue.get(timeout=0.1, ready=tts.MessageInfo.is_playable)
+            if message is None:
+                continue
+
+            if message.skip:
+                message.tts_event("deleted")
+                continue
+
+            if self.device is None:
+                message.tts_event("error", "No audio devices")
+                continue
+
+            message.tts_event("playing")
+            try:
+                self.play_message(message)
+            except Exception:
+                event.warn("Error playing audio, trying again...")
+                self.initialize()
+
+                # try again
                 try:
                     self.play_message(message)
-                except Exception:
-                    event.warn("Error playing audio, trying again...")
-                    self.initialize()
-
-                    # try again
-                    try:
-                        self.play_message(message)
-                    except Exception as e2:
-                        message.tts_event("error", e2.args[0])
-                        continue
-
-                message.tts_event("finished")
+                except Exception as e2:
+                    message.tts_event("error", e2.args[0])
+                    continue
+
+            message.tts_event("finished")
 
         logging.debug("Closing audio thread")
 
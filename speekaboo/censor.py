@@ -0,0 +1,275 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+Bad word filter for Speak requests with badWordFilter set.
+
+Words are loaded from censor_wordlist (one per line, # for comments). A word
+ending in * also matches anything starting with it, e.g. "heck*" matches "hecking".
+Otherwise only whole words match.
+
+All the words are compiled into one Aho-Corasick automaton, so a message is
+scanned once no matter how many words are in the list. Matching ignores case
+and common leetspeak ("h3ck", "h@ck"). Compiling a large list takes a while, so
+the compiled automaton is cached in censor_cache.json next to the config file,
+and only rebuilt when the hash of the word list changes.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import deque
+from pathlib import Path
+from threading import Lock
+
+import config
+
+CACHE_VERSION = 1
+
+# How often to check whether the word list changed, in seconds
+CHECK_INTERVAL = 1.0
+
+LEETSPEAK = {
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "8": "b",
+    "@": "a",
+    "$": "s",
+}
+
+def _normalize_char(char: str) -> str:
+    """
+    Normalizes one character, always to one character so positions line up with the original text.
+    """
+    folded = char.casefold()
+    if len(folded) != 1:
+        folded = char.lower()[:1] or char
+    return LEETSPEAK.get(folded, folded)
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char in LEETSPEAK
+
+class Automaton:
+    """
+    Aho-Corasick automaton over normalized characters.
+
+    State 0 is the root. For each state:
+     - goto: transitions by character
+     - fail: the longest proper suffix that is also a state
+     - out:  the words ending here, as (length, is_prefix)
+     - dict_link: the nearest state through fail links that has output, or -1
+    """
+    def __init__(self, goto: list[dict[str, int]], fail: list[int], out: list[list[list]], dict_link: list[int]):
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+        self.dict_link = dict_link
+
+    @staticmethod
+    def build(words: list[str]) -> "Automaton":
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[list]] = [[]]
+        for word in words:
+            is_prefix = word.endswith("*")
+            word = "".join(_normalize_char(char) for char in word.rstrip("*"))
+            if not word:
+                continue
+            state = 0
+            for char in word:
+                if char not in goto[state]:
+                    goto.append({})
+                    out.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            if [len(word), is_prefix] not in out[state]:
+                out[state].append([len(word), is_prefix])
+
+        # Breadth first, so the fail links of shorter states are done first
+        fail = [0] * len(goto)
+        dict_link = [-1] * len(goto)
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in goto[state].items():
+                link = fail[state]
+                while link != 0 and char not in goto[link]:
+                    link = fail[link]
+                fail[child] = goto[link].get(char, 0)
+                dict_link[child] = fail[child] if out[fail[child]] else dict_link[fail[child]]
+                pending.append(child)
+
+        return Automaton(goto, fail, out, dict_link)
+
+    def to_json(self) -> dict:
+        return {"goto": self.goto, "fail": self.fail, "out": self.out, "dict_link": self.dict_link}
+
+    @staticmethod
+    def from_json(data: dict) -> "Automaton":
+        return Automaton(data["goto"], data["fail"], data["out"], data["dict_link"])
+
+    def find(self, text: str) -> list[tuple[int, int]]:
+        """
+        Returns the (start, end) spans of the words found in text, merged and in order.
+        """
+        spans: list[tuple[int, int]] = []
+        goto = self.goto
+        fail = self.fail
+        state = 0
+        for i, char in enumerate(text):
+            char = _normalize_char(char)
+            while state != 0 and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            match = state if self.out[state] else self.dict_link[state]
+            while match > 0:
+                for length, is_prefix in self.out[match]:
+                    start = i + 1 - length
+                    if start > 0 and _is_word_char(text[start - 1]):
+                        continue
+                    end = i + 1
+                    if is_prefix:
+                        # Take the rest of the word too
+                        while end < len(text) and _is_word_char(text[end]):
+                            end += 1
+                    elif end < len(text) and _is_word_char(text[end]):
+                        continue
+                    spans.append((start, end))
+                match = self.dict_link[match]
+
+        spans.sort()
+        merged: list[tuple[int, int]] = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+class Censor:
+    def __init__(self):
+        self.automaton: Automaton|None = None
+        self.stat: tuple|None = None
+        self.checked: float|None = None # time.monotonic() of the last check
+        self.lock = Lock()
+
+    @staticmethod
+    def wordlist_path() -> Path|None:
+        if config.config["censor_wordlist"]:
+            return Path(config.config["censor_wordlist"])
+        if config.config_folder is not None:
+            return config.config_folder / "wordlist.txt"
+        return None
+
+    def _load(self) -> Automaton|None:
+        """
+        Loads the word list if it changed, from the cache if possible.
+
+        The word list is checked at most every CHECK_INTERVAL seconds, so busy
+        chats don't stat it for every message.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is not None and now - self.checked < CHECK_INTERVAL:
+                return self.automaton
+            self.checked = now
+
+            path = self.wordlist_path()
+            try:
+                st = os.stat(path) if path is not None else None
+            except OSError:
+                st = None
+            stat = (str(path), st.st_size, st.st_mtime_ns) if st is not None else None
+
+            if stat == self.stat:
+                return self.automaton
+            self.stat = stat
+            self.automaton = None
+            if stat is None:
+                return None
+
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                logging.error("Error reading word list %s: %s", path, e)
+                return None
+
+            digest = hashlib.sha256(data).hexdigest()
+            cache_path = config.config_folder / "censor_cache.json" if config.config_folder is not None else None
+
+            if cache_path is not None and cache_path.is_file():
+                try:
+                    with open(cache_path, "r", encoding="utf-8") as f:
+                        cached = json.load(f)
+                    if cached.get("version") == CACHE_VERSION and cached.get("hash") == digest:
+                        self.automaton = Automaton.from_json(cached)
+                        return self.automaton
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning("Ignoring bad censor cache: %s", e)
+
+            words = [line.strip() for line in data.decode("utf-8", errors="replace").splitlines()]
+            words = [word for word in words if word and not word.startswith("#")]
+            self.automaton = Automaton.build(words)
+            logging.debug("Compiled %d censored words into %d states", len(words), len(self.automaton.goto))
+
+            if cache_path is not None:
+                try:
+                    tmp_path = cache_path.with_suffix(".tmp")
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({"version": CACHE_VERSION, "hash": digest} | self.automaton.to_json(), f)
+                    os.replace(tmp_path, cache_path)
+                except OSError as e:
+                    logging.warning("Could not save censor cache: %s", e)
+
+            return self.automaton
+
+    def censor(self, text: str) -> tuple[str, int]:
+        """
+        Replaces bad words with text_replacement.
+
+        Returns the new text and the number of replacements.
+        """
+        automaton = self._load()
+        if automaton is None:
+            return text, 0
+
+        spans = automaton.find(text)
+        if not spans:
+            return text, 0
+
+        replacement = config.config["text_replacement"]
+        parts = []
+        last = 0
+        for start, end in spans:
+            parts.append(text[last:start])
+            parts.append(replacement)
+            last = end
+        parts.append(text[last:])
+        return "".join(parts), len(spans)
+
+censor = Censor()
@@ -140,9 +140,12 @@ def load_config():
         "ws_server_addr": "127.0.0.1",                    # Address of the Websocket server
         "ws_server_port": 7580,                           # Port for the Websocket server. The documentation erroneously
                                                           #     lists the default port as 7680, but it's really 7580.
+        "ws_send_queue_size": 256,                        # Events that can wait to be sent to one WebSocket client
+        "ws_send_queue_overflow": "drop_oldest",          # What to do when a client falls behind: "drop_oldest" or "disconnect"
         "udp_server_enabled": True,                       # Whether to enable the UDP server
         "udp_server_addr": "0.0.0.0",                     # Address for the UDP server. Not configurable in Speaker.bot.
         "udp_server_port": 6669,                          # Port for the UDP server.
+        "udp_queue_size": 4096,                           # UDP messages that can wait to be handled before new ones are dropped
         "voice_language": "en_US",                        # Voice language
         "voices": {
 
@@ -150,11 +153,55 @@ def load_config():
         "additional_voices": {},                          # Map of additional voices {"voice_name": "path/to/file.onnx"}
         "use_cuda": False,                                # Whether to use Cuda (currently disabled)
         "output_device": None,                            # Audio output device (null = default)
+        "output_sink": "device",                          # Where to play audio: "device", or for headless use
+                                                          #     "null" (discard), "file" (.wav or raw), "pipe" (raw)
+        "output_sink_path": "",                           # Output path for the file/pipe sinks ("-" = stdout for pipe)
+        "output_sink_sample_rate": 22050,                 # Sample rate for the file/pipe/null sinks
+        "output_sink_realtime": True,                     # Whether the sinks consume audio at the playback rate
         "volume": 1.0,                                    # Output volume
-        "queue_delay": 0.0,                               # Delay before playing voices (to allow time for moderation)
+        "queue_delay": 0.0,                               # Delay (seconds) before playing voices, to allow time for moderation.
+                                                          #     Messages are synthesized during the delay and can be cancelled.
+        "priority_weights": [8, 4, 2, 1],                 # Scheduling weight of each priority lane, from 0 (highest) down
+        "default_priority": 2,                            # Priority for aliases/requests that don't set one
+        "priority_max_wait": 30.0,                        # Messages waiting longer than this (seconds) go first (0 = off)
+        "shed_enabled": False,                            # Whether to drop messages when the queue falls behind
+        "shed_target_delay": 60.0,                        # Try to keep the queue within this many seconds of live
+        "shed_strategies": ["max_age", "collapse_similar", "drop_low_priority", "drop_oldest"],
+                                                          # Strategies to use, in order. See shedding.py.
+        "shed_max_age": 120.0,                            # Messages queued longer than this (in seconds) are dropped
+        "shed_protected_priority": 0,                     # Messages with this priority or higher are never dropped
+        "adaptive_rate_enabled": False,                   # Whether to speed up speech when the queue falls behind
+        "adaptive_rate_start": 30.0,                      # Backlog (in seconds) where speeding up starts
+        "adaptive_rate_full": 120.0,                      # Backlog (in seconds) where adaptive_rate_min_scale is reached
+        "adaptive_rate_min_scale": 0.75,                  # Smallest length_scale multiplier (0.75 = 33% faster)
+        "rate_limit_enabled": False,                      # Whether to rate limit Speak requests per connection/address/sender
+        "rate_limit_messages": 20.0,                      # Messages per minute
+        "rate_limit_message_burst": 5.0,                  # Messages that can be sent at once
+        "rate_limit_speech_seconds": 60.0,                # Estimated seconds of speech per minute
+        "rate_limit_speech_burst": 30.0,                  # Estimated seconds of speech that can be sent at once
+        "dedup_action": "off",                            # What to do with duplicate messages: "off", "drop", "merge" or "reuse"
+        "dedup_window": 60.0,                             # How long (in seconds) played messages count as duplicates
+        "dedup_recent_count": 32,                         # How many played messages to remember
+        "text_filter_enabled": False,                     # Whether to clean up URLs, spam and zalgo text. See textfilter.py.
+        "text_filter_url_token": "link",                  # What URLs are replaced with
+        "text_filter_max_repeat": 3,                      # Longest run of the same character
+        "text_filter_max_combining": 2,                   # Most combining marks on one character
+        "text_filter_max_emote_run": 3,                   # Longest run of the same word or of emoji
         "max_words": 100,                                 # Maximum number of words
+        "max_total_phonemes": 0,                          # Maximum number of phonemes in a message (0 = no limit)
+        "max_speech_seconds": 0.0,                        # Maximum predicted length of a message in seconds (0 = no limit)
+        "length_limit_action": "reject",                  # What to do with messages over the limits: "reject" or "truncate"
+        "trim_silence": False,                            # Whether to trim quiet audio around each sentence
+        "trim_silence_threshold": -40.0,                  # Audio quieter than this (in dBFS) is considered silent
+        "trim_silence_padding": 0.05,                     # Seconds of audio to keep around trimmed sentences
+        "voice_mirror_url": "https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/",
+                                                          # Where to download voices from
+        "max_concurrent_downloads": 2,                    # How many voices to download at once
+        "download_connections": 4,                        # How many connections to download each large voice file over
+        "force_verify_voices": False,                     # Whether to hash voice files again even if they haven't changed
         "max_memory_usage": min(512, system_mem // 32),   # Cache size. Default to 512 MiB or 1/32 system memory.
-        "text_replacement": "filtered",                   # neuro-sama reference :)
+        "text_replacement": "filtered",                   # What bad words are replaced with. neuro-sama reference :)
+        "censor_wordlist": "",                            # Bad word list for badWordFilter (default: wordlist.txt in the config folder)
         "num_threads": preferred_threads,                 # Number of threads for CPU inference
         "onnx_memory_limit": 1024,                        # Memory limit for ONNX
     }
@@ -0,0 +1,112 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Detects duplicate messages (copy-paste spam).
+
+Messages are indexed by a hash of their alias and text (ignoring case and
+extra whitespace), so looking up a duplicate is a single dict lookup no matter
+how long the queue is. The index covers queued messages and the last
+dedup_recent_count played messages from the past dedup_window seconds.
+
+dedup_action:
+ - "off":   Duplicates are queued normally.
+ - "drop":  Duplicates are not queued.
+ - "merge": Duplicates of a queued message are not queued, and instead increase
+            its repeatCount. Duplicates of messages that are already playing or
+            were played are queued normally.
+ - "reuse": Duplicates are queued, but reuse the audio of the original instead
+            of being synthesized again, if it's available.
+
+Played messages are only kept in the index (audio included) for "reuse". The
+other actions only need to know the text was played recently, and with "off"
+nothing is indexed at all.
+"""
+
+import time
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+import config
+
+def message_key(voice: str, text: str) -> bytes:
+    normalized = " ".join(text.casefold().split())
+    return hashlib.blake2b(f"{voice}\0{normalized}".encode("utf-8"), digest_size=16).digest()
+
+class DuplicateIndex:
+    def __init__(self):
+        self.pending: dict[bytes, Any] = {}
+        # The message is only kept for "reuse", otherwise it's None
+        self.recent: OrderedDict[bytes, tuple[float, Any]] = OrderedDict()
+        self.lock = Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        window = config.config["dedup_window"]
+        while self.recent:
+            finished_at, _message = next(iter(self.recent.values()))
+            if now - finished_at <= window and len(self.recent) <= config.config["dedup_recent_count"]:
+                break
+            self.recent.popitem(last=False)
+
+    def find(self, voice: str, text: str) -> tuple[Any, str|None]:
+        """
+        Finds a queued or recently played message with the same alias and text.
+
+        Returns (message, "pending") or (message, "recent"), or (None, None) if
+        there is no duplicate. Recent messages are only returned for "reuse",
+        otherwise the message is None.
+        """
+        key = message_key(voice, text)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key], "pending"
+            self._expire()
+            if key in self.recent:
+                return self.recent[key][1], "recent"
+        return None, None
+
+    def add(self, message):
+        """
+        Indexes a newly queued message. It replaces any queued duplicate, so
+        duplicates are merged into the newest one.
+        """
+        with self.lock:
+            self.pending[message_key(message.voice, message.message)] = message
+
+    def finished(self, message, played: bool):
+        """
+        Removes a message that left the queue. Played messages are kept in the
+        recent list so their audio can be reused.
+        """
+        key = message_key(message.voice, message.message)
+        with self.lock:
+            if self.pending.get(key) is message:
+                del self.pending[key]
+            if played:
+                # Don't hold on to the audio unless it will be reused
+                keep = message if config.config["dedup_action"] == "reuse" and message.parsed_data is not None else None
+                self.recent.pop(key, None)
+                self.recent[key] = (time.monotonic(), keep)
+                self._expire()
+
+index = DuplicateIndex()
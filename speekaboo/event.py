@@ -92,5 +92,17 @@ def loaded_voice(voice_name: str, size: float):
         }
     )
 
+def download_progress(voice: str, file: str, done: int, total: int):
+    ws_event(
+        "internal_event",
+        "download_progress",
+        {
+            "voice": voice,
+            "file": file,
+            "done": done,
+            "total": total
+        }
+    )
+
 def voices_changed(voice: str|None, installed: bool):
     Event("voices_changed", voice, installed)
@@ -55,6 +55,7 @@ import event
 
 from server import ws_thread, udp_thread
 from voice_manager import vm
+from piper.config import PiperConfig
 import audio
 import tts
 
@@ -200,6 +201,8 @@ class MainTab(ttk.Frame, event.Observer):
         self.queue_box.pack(expand=True, fill=tk.BOTH)
 
         self.queue_box.configure(yscrollcommand=queue_v_scrollbar.set)
+        # Delete cancels the selected message, e.g. during the queue_delay window
+        self.queue_box.bind("<Delete>", self.cancel_selected)
 
         scrollable_wrapper.add(queue_frame, weight=1)
 
@@ -259,6 +262,10 @@ class MainTab(ttk.Frame, event.Observer):
 
         config.enabled = not config.enabled
 
+    def cancel_selected(self, _event=None):
+        for speech_id in self.queue_box.selection():
+            tts.cancel(speech_id)
+
     def clear(self):
         queued = audio.audio.to_list()
         audio.audio.clear()
@@ -331,6 +338,10 @@ class MainTab(ttk.Frame, event.Observer):
                     self.write_to_log(f"Playing: {data['text']}")
                     if self.queue_box.exists(data["id"]):
                         self.queue_box.delete(data["id"])
+                case "deleted":
+                    self.write_to_log(f"Deleted: {data['text']}")
+                    if self.queue_box.exists(data["id"]):
+                        self.queue_box.delete(data["id"])
                 case "error":
                     self.write_to_log(f"Error: {data['text']}: {data.get('speekaboo_exception', 'Unknown')}")
                     if self.queue_box.exists(data["id"]):
@@ -362,7 +373,7 @@ class VoiceAliasesTab(ttk.Frame):
             event.Observer.__init__(self)
             self.observe("voices_changed", self.update_voices)
 
-            self.voice_config= {}
+            self.voice_config: PiperConfig|None = None
             self.name_var = tk.StringVar()
             self.voice_var = tk.StringVar()
             self.voice_var.trace_add('write', self.voice_id_callback)
@@ -373,6 +384,7 @@ class VoiceAliasesTab(ttk.Frame):
             self.volume_var = tk.DoubleVar()
             # self.pitch_var = tk.DoubleVar()
             self.length_variation_var = tk.DoubleVar()
+            self.priority_var = tk.IntVar()
             self.voices = []
 
             row = 0
@@ -408,6 +420,12 @@ class VoiceAliasesTab(ttk.Frame):
             noise_w.grid(row=row, column=1, padx=5, pady=5, sticky=tk.NSEW)
             ToolTip(noise_w, text="How much variance to put into the length of each phoneme. Piper arg: noise_w")
 
+            row += 1
+
+            priority = LabeledWidget(self, "Priority", ttk.Spinbox, from_=0, to=len(config.config["priority_weights"]) - 1, increment=1, textvariable=self.priority_var)
+            priority.grid(row=row, column=0, padx=5, pady=5, sticky=tk.NSEW)
+            ToolTip(priority, text="Messages with a lower number get played sooner when the queue is busy. 0 is the highest priority.")
+
             row += 1
             save_button = ttk.Button(self, text="Save changes", command=self.save_changes)
             save_button.grid(row=row, column=0, padx=5, pady=5, sticky=tk.NSEW)
@@ -431,6 +449,7 @@ class VoiceAliasesTab(ttk.Frame):
             self.speed_var.set(config.config["voices"][voice].get("length_scale", 1.0))
             self.volume_var.set(config.config["voices"][voice].get("volume", 1.0) * 100.0)
             self.speaker_id.set(config.config["voices"][voice].get("speaker_id", 0))
+            self.priority_var.set(config.config["voices"][voice].get("priority", config.config["default_priority"]))
 
         def save_voice(self, voice: str):
             """
@@ -452,7 +471,8 @@ class VoiceAliasesTab(ttk.Frame):
                 length_scale=self.speed_var.get(),
                 noise_scale=self.variation_var.get(),
                 noise_w=self.length_variation_var.get(),
-                volume=self.volume_var.get() / 100.0
+                volume=self.volume_var.get() / 100.0,
+                priority=self.priority_var.get()
             )
             logging.debug("Saving voice '%s': %s", voice, config.config["voices"][voice])
 
@@ -477,8 +497,8 @@ class VoiceAliasesTab(ttk.Frame):
             
             logging.debug("setting %s to %s", self.name_var.get(), voice)
 
-            self.voice_config = vm.get_voice_config(voice) or {"num_speakers": 1}
-            num_speaker = self.voice_config["num_speakers"]
+            self.voice_config = vm.get_voice_config(voice)
+            num_speaker = self.voice_config.num_speakers if self.voice_config is not None else 1
             if self.speaker_id_var.get() > num_speaker - 1:
                 self.speaker_id_var.set(0)
 
@@ -545,7 +565,7 @@ class VoiceAliasesTab(ttk.Frame):
         if not result:
             return
 
-        del config.config["voices"][alias]
+        vm.remove_alias(alias)
 
         self.aliases.delete(alias)
         event.Event("aliases_list_updated")
@@ -580,8 +600,7 @@ class VoiceAliasesTab(ttk.Frame):
             messagebox.showerror(message="The name cannot be blank.")
             return
 
-        config.config["voices"][result] = config.config["voices"][alias]
-        del config.config["voices"][alias]
+        vm.rename_alias(alias, result)
 
         idx = self.aliases.index(alias)
 
@@ -681,6 +700,21 @@ class DownloadVoicesTab(ttk.Frame, event.Observer):
 
             self.voices_list.item(voice, values=item["values"])
 
+    def show_progress(self, event_source: str, event_type: str = '', data: dict|None = None):
+        """
+        Observer callback for download progress events.
+        """
+        if window is None or data is None or event_source != "internal_event" or event_type != "download_progress":
+            return
+
+        voice = data["voice"]
+        if not self.voices_list.exists(voice):
+            return
+        item = self.voices_list.item(voice)
+        if isinstance(item["values"], list) and data["total"] > 0:
+            item["values"][1] = f"{data['done'] * 100 // data['total']}%"
+            self.voices_list.item(voice, values=item["values"])
+
     def check_for_alias(self, name: str):
         """
         Checks if a voice is used in an alias, and displays an error if it does
@@ -759,6 +793,7 @@ class DownloadVoicesTab(ttk.Frame, event.Observer):
         event.Observer.__init__(self)
 
         self.observe("voices_changed", self.set_installed)
+        self.observe("WebsocketEvent", self.show_progress)
         treeview_container = ttk.Frame(self)
         treeview_container.grid(row=0, column=0, columnspan=3, sticky=tk.NSEW)
         treeview_container.grid_columnconfigure(0, weight=1)
@@ -816,29 +851,22 @@ class DownloadVoicesTab(ttk.Frame, event.Observer):
                 self.voices_list.insert("/additional_voices", tk.END, iid=key, text=key)
 
 
-        downloadable_voices = vm.get_downloadable_voices()
-
-        # First pass: gather all the available languages
-        categorized: dict[str, dict] = {}
-        language_ids = set()
-        for voice, value in downloadable_voices.items():
-            code = value["language"]["code"]
-            if not code in language_ids:
-                categorized[code] = {}
-
-                # example: English (United States)
-                friendly_name = f"{value['language']['name_english']} ({value['language']['country_english']})"
-                self.voices_list.insert("", "end", iid="/" + code, text=friendly_name)
-                language_ids.add(code)
-            is_installed = "Yes" if vm.is_voice_installed(voice) else "No"
-            friendly_size = self.convert_size(vm.get_voice_size(voice))
-            if not self.voices_list.exists(value["key"]):
-                self.voices_list.insert("/" + code, "end", text=value["name"], iid=value["key"],
-                                        values=(
-                                            value["quality"],
-                                            is_installed,
-                                            friendly_size,
-                                            value["num_speakers"]))
+        catalog = vm.get_voice_catalog()
+
+        for code, voices in catalog.by_language.items():
+            # example: English (United States)
+            self.voices_list.insert("", "end", iid="/" + code, text=catalog.language_name(code))
+            for voice in voices:
+                value = catalog.voices[voice]
+                is_installed = "Yes" if vm.is_voice_installed(voice) else "No"
+                friendly_size = self.convert_size(catalog.sizes[voice])
+                if not self.voices_list.exists(value["key"]):
+                    self.voices_list.insert("/" + code, "end", text=value["name"], iid=value["key"],
+                                            values=(
+                                                value["quality"],
+                                                is_installed,
+                                                friendly_size,
+                                                value["num_speakers"]))
 
 download_voices_tab = DownloadVoicesTab(window)
 notebook.add(download_voices_tab, text="Manage Voices")
@@ -0,0 +1,246 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Priority lanes for the speech queues.
+
+Each priority class (0 = highest) gets its own FIFO lane. Lanes are picked with
+stride scheduling: every lane has a "pass" value that goes up by 1/weight each
+time it is served, and the non-empty lane with the lowest pass goes next. So with
+weights [8, 4, 2, 1], lane 0 gets 8 turns for every turn lane 3 gets, but lane 3
+still moves. On top of that, if the oldest message in any lane has waited longer
+than priority_max_wait, it goes first.
+
+If a cost function is given, the queue keeps a running total of the cost of its
+items (e.g. the seconds of speech, see shedding.py), so it doesn't have to be
+added up again every time it's needed.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Iterator
+
+import config
+
+def num_lanes() -> int:
+    return max(1, len(config.config["priority_weights"]))
+
+def clamp_priority(priority: int) -> int:
+    return max(0, min(int(priority), num_lanes() - 1))
+
+class LaneQueue:
+    """
+    Thread safe weighted fair queue with one FIFO lane per priority class.
+    """
+    def __init__(self, cost: Callable[[Any], float]|None = None):
+        self.condition = threading.Condition()
+        # (time queued, item, cost)
+        self.lanes: list[deque[tuple[float, Any, float]]] = []
+        self.cost = cost
+        self.total = 0.0
+        self.passes: list[float] = []
+        self.served: list[int] = []
+        self.avg_wait: list[float] = []
+        self.vtime = 0.0
+        self._resize()
+
+    def _resize(self):
+        """
+        Makes sure there is a lane for every configured priority class.
+        """
+        while len(self.lanes) < num_lanes():
+            self.lanes.append(deque())
+            self.passes.append(self.vtime)
+            self.served.append(0)
+            self.avg_wait.append(0.0)
+
+    def _weight(self, lane: int) -> float:
+        weights = config.config["priority_weights"]
+        if lane < len(weights):
+            return max(float(weights[lane]), 0.001)
+        return 0.001
+
+    def _pick(self, ready: Callable[[Any], bool]|None = None) -> int|None:
+        """
+        Picks the lane to serve next. Must be called with the lock held.
+
+        If ready is given, lanes whose first item isn't ready are skipped.
+        """
+        now = time.monotonic()
+        max_wait = config.config["priority_max_wait"]
+
+        best = None
+        oldest = None
+        for lane, items in enumerate(self.lanes):
+            if not items or (ready is not None and not ready(items[0][1])):
+                continue
+            # Starvation protection
+            queued_at = items[0][0]
+            if max_wait > 0 and now - queued_at > max_wait and (oldest is None or queued_at < self.lanes[oldest][0][0]):
+                oldest = lane
+            if best is None or self.passes[lane] < self.passes[best]:
+                best = lane
+
+        return oldest if oldest is not None else best
+
+    def _discount(self, cost: float):
+        self.total -= cost
+        if not any(self.lanes):
+            # Don't let rounding errors pile up
+            self.total = 0.0
+
+    def _take(self, lane: int) -> Any:
+        queued_at, item, cost = self.lanes[lane].popleft()
+        self._discount(cost)
+        self.vtime = self.passes[lane]
+        self.passes[lane] += 1.0 / self._weight(lane)
+
+        self.served[lane] += 1
+        # Exponential moving average of the time spent waiting
+        self.avg_wait[lane] += (time.monotonic() - queued_at - self.avg_wait[lane]) * 0.1
+        return item
+
+    def put(self, item: Any, priority: int):
+        with self.condition:
+            self._resize()
+            lane = clamp_priority(priority)
+            if not self.lanes[lane]:
+                # Don't let a lane that was idle build up credit
+                self.passes[lane] = max(self.passes[lane], self.vtime)
+            cost = self.cost(item) if self.cost is not None else 0.0
+            self.total += cost
+            self.lanes[lane].append((time.monotonic(), item, cost))
+            self.condition.notify()
+
+    def pop(self, ready: Callable[[Any], bool]|None = None) -> Any:
+        """
+        Removes and returns the next item, or None if the queue is empty
+        (or nothing is ready).
+        """
+        with self.condition:
+            lane = self._pick(ready)
+            if lane is None:
+                return None
+            return self._take(lane)
+
+    def get(self, timeout: float|None = None, ready: Callable[[Any], bool]|None = None) -> Any:
+        """
+        Like pop(), but waits up to timeout seconds for an item.
+        """
+        with self.condition:
+            if self._pick(ready) is None:
+                self.condition.wait(timeout)
+            return self.pop(ready)
+
+    def peek(self, ready: Callable[[Any], bool]|None = None) -> Any:
+        """
+        Returns the item that pop() would return, without removing it.
+        """
+        with self.condition:
+            lane = self._pick(ready)
+            if lane is None:
+                return None
+            return self.lanes[lane][0][1]
+
+    def find(self, predicate: Callable[[Any], bool]) -> Any:
+        """
+        Returns the first item matching predicate, or None.
+        """
+        with self.condition:
+            for lane in self.lanes:
+                for entry in lane:
+                    if predicate(entry[1]):
+                        return entry[1]
+        return None
+
+    def remove(self, item: Any) -> bool:
+        with self.condition:
+            for lane in self.lanes:
+                for entry in lane:
+                    if entry[1] is item:
+                        lane.remove(entry)
+                        self._discount(entry[2])
+                        return True
+        return False
+
+    def remove_front(self, is_old: Callable[[Any], bool], can_remove: Callable[[Any], bool]) -> list:
+        """
+        Removes the items at the front of each lane while is_old() is true for
+        them, and returns them. Items that can_remove() rejects are skipped over
+        and kept. Only looks past the front of a lane as far as it has to, so it
+        is cheap to call often.
+        """
+        removed = []
+        with self.condition:
+            cost = 0.0
+            for lane in self.lanes:
+                kept = []
+                while lane and is_old(lane[0][1]):
+                    entry = lane.popleft()
+                    if can_remove(entry[1]):
+                        removed.append(entry[1])
+                        cost += entry[2]
+                    else:
+                        kept.append(entry)
+                lane.extendleft(reversed(kept))
+            if removed:
+                self._discount(cost)
+        return removed
+
+    def clear(self) -> list:
+        """
+        Removes all items, returning them.
+        """
+        with self.condition:
+            removed = list(self)
+            for lane in self.lanes:
+                lane.clear()
+            self.total = 0.0
+            return removed
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def __iter__(self) -> Iterator[Any]:
+        """
+        Iterates over a snapshot of the items, in priority order.
+        """
+        with self.condition:
+            items = [entry[1] for lane in self.lanes for entry in lane]
+        return iter(items)
+
+    def stats(self) -> list[dict]:
+        """
+        Returns the depth and wait times of each lane.
+        """
+        now = time.monotonic()
+        with self.condition:
+            return [
+                {
+                    "priority": i,
+                    "weight": self._weight(i),
+                    "depth": len(lane),
+                    "oldestWait": round(now - lane[0][0], 3) if lane else 0.0,
+                    "averageWait": round(self.avg_wait[i], 3),
+                    "served": self.served[i]
+                }
+                for i, lane in enumerate(self.lanes)
+            ]
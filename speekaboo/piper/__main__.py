@@ -4,10 +4,9 @@ import sys
 import time
 import wave
 from pathlib import Path
-from typing import Any, Dict
 
 from . import PiperVoice
-from .download import ensure_voice_exists, find_voice, get_voices
+from .download import ensure_voice_exists, find_voice, get_voice_catalog
 
 _FILE = Path(__file__)
 _DIR = _FILE.parent
@@ -57,6 +56,20 @@ def main() -> None:
         default=0.0,
         help="Seconds of silence after each sentence",
     )
+    parser.add_argument(
+        "--trim-silence",
+        "--trim_silence",
+        type=float,
+        metavar="DBFS",
+        help="Trim audio quieter than DBFS (e.g. -40) from the start and end of each sentence",
+    )
+    parser.add_argument(
+        "--trim-padding",
+        "--trim_padding",
+        type=float,
+        default=0.05,
+        help="Seconds of audio to keep around trimmed sentences (default: 0.05)",
+    )
     #
     parser.add_argument(
         "--data-dir",
@@ -92,15 +105,8 @@ def main() -> None:
     model_path = Path(args.model)
     if not model_path.exists():
         # Load voice info
-        voices_info = get_voices(args.download_dir, update_voices=args.update_voices)
-
-        # Resolve aliases for backwards compatibility with old voice names
-        aliases_info: Dict[str, Any] = {}
-        for voice_info in voices_info.values():
-            for voice_alias in voice_info.get("aliases", []):
-                aliases_info[voice_alias] = {"_is_alias": True, **voice_info}
-
-        voices_info.update(aliases_info)
+        # Resolves aliases for backwards compatibility with old voice names
+        voices_info = get_voice_catalog(args.download_dir, update_voices=args.update_voices)
         ensure_voice_exists(args.model, args.data_dir, args.download_dir, voices_info)
         args.model, args.config = find_voice(args.model, args.data_dir)
 
@@ -112,6 +118,8 @@ def main() -> None:
         "noise_scale": args.noise_scale,
         "noise_w": args.noise_w,
         "sentence_silence": args.sentence_silence,
+        "trim_threshold": args.trim_silence,
+        "trim_padding": args.trim_padding,
     }
 
     if args.output_raw:
@@ -1,7 +1,15 @@
 """Piper configuration"""
+import json
+import os
+import threading
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, Mapping, Sequence
+from pathlib import Path
+from typing import Any, Dict, Mapping, Sequence, Tuple, Union
+
+# path -> (mtime_ns, size, config)
+_cache: Dict[str, Tuple[int, int, "PiperConfig"]] = {}
+_cache_lock = threading.Lock()
 
 
 class PhonemeType(str, Enum):
@@ -51,3 +59,23 @@ class PiperConfig:
             phoneme_id_map=config["phoneme_id_map"],
             phoneme_type=PhonemeType(config.get("phoneme_type", PhonemeType.ESPEAK)),
         )
+
+    @staticmethod
+    def from_file(config_path: Union[str, Path]) -> "PiperConfig":
+        """Loads a config file, reusing the last result until the file changes.
+
+        The returned config is shared, so don't modify it.
+        """
+        path = os.path.abspath(config_path)
+        stat = os.stat(path)
+        with _cache_lock:
+            cached = _cache.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                return cached[2]
+
+        with open(path, "r", encoding="utf-8") as config_file:
+            config = PiperConfig.from_dict(json.load(config_file))
+
+        with _cache_lock:
+            _cache[path] = (stat.st_mtime_ns, stat.st_size, config)
+        return config
@@ -1,12 +1,18 @@
 """Utility for downloading Piper voices."""
+import gzip
+import hashlib
 import json
 import logging
-import shutil
+import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable, Set, Tuple, Union
-from urllib.request import urlopen
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
-from .file_hash import get_file_hash
+from .file_hash import get_cached_file_hash, get_file_hash, record_file_hash
 
 URL_FORMAT = "https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/{file}"
 
@@ -15,42 +21,399 @@ _LOGGER = logging.getLogger(__name__)
 
 _SKIP_FILES = {"MODEL_CARD"}
 
+_CHUNK_SIZE = 1024 * 1024
+
+# Files smaller than this are always downloaded over one connection
+_MIN_RANGED_SIZE = 8 * 1024 * 1024
+
+# (bytes done, total bytes or 0 if unknown)
+ProgressCallback = Callable[[int, int], None]
+
 
 class VoiceNotFoundError(Exception):
     pass
 
 
-def get_voices(
-    download_dir: Union[str, Path], update_voices: bool = False
-) -> Dict[str, Any]:
-    """Loads available voices from downloaded or embedded JSON file."""
+class _RangesNotSupported(Exception):
+    pass
+
+
+def _download_ranges(
+    url: str,
+    part_path: Path,
+    size: int,
+    connections: int,
+    progress: Optional[ProgressCallback],
+    timeout: float,
+) -> None:
+    """Downloads url into part_path over several connections at once.
+
+    The file is split into one byte range per connection, and each range is
+    written at its offset in part_path. How far each range got is saved in
+    part_path + ".ranges", so an interrupted download resumes every range where
+    it stopped.
+
+    Raises _RangesNotSupported if the server ignores the Range header.
+    """
+    ranges_path = part_path.with_name(part_path.name + ".ranges")
+
+    # [start, done, end] for each range
+    ranges: List[List[int]] = []
+    if ranges_path.exists() and part_path.exists():
+        try:
+            with open(ranges_path, "r", encoding="utf-8") as ranges_file:
+                saved = json.load(ranges_file)
+            if saved.get("size") == size:
+                ranges = saved["ranges"]
+        except (OSError, ValueError, KeyError) as err:
+            _LOGGER.warning("Ignoring %s: %s", ranges_path, err)
+
+    if not ranges:
+        step = -(-size // connections)
+        ranges = [[start, start, min(start + step, size)] for start in range(0, size, step)]
+        with open(part_path, "wb") as part_file:
+            part_file.truncate(size)
+
+    lock = threading.Lock()
+
+    def save_ranges():
+        tmp_path = ranges_path.with_name(ranges_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as ranges_file:
+            json.dump({"size": size, "ranges": ranges}, ranges_file)
+        os.replace(tmp_path, ranges_path)
+
+    def fetch(byte_range: List[int]):
+        _start, done, end = byte_range
+        if done >= end:
+            return
+        request = Request(url, headers={"Range": f"bytes={done}-{end - 1}"})
+        with urlopen(request, timeout=timeout) as response, open(part_path, "r+b") as part_file:
+            if response.status != 206:
+                raise _RangesNotSupported(url)
+            part_file.seek(done)
+            while done < end and (chunk := response.read(min(_CHUNK_SIZE, end - done))):
+                part_file.write(chunk)
+                done += len(chunk)
+                with lock:
+                    byte_range[1] = done
+                    save_ranges()
+                    if progress is not None:
+                        progress(sum(r[1] - r[0] for r in ranges), size)
+        if done < end:
+            raise IOError(f"Connection closed early while downloading {url}")
+
+    with lock:
+        save_ranges()
+
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="Download Range") as executor:
+        # Let every range finish or fail before raising, so .ranges is up to date
+        futures = [executor.submit(fetch, byte_range) for byte_range in ranges]
+    for future in futures:
+        future.result()
+
+    ranges_path.unlink()
+
+
+def download_file(
+    url: str,
+    path: Union[str, Path],
+    expected_size: Optional[int] = None,
+    expected_md5: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+    timeout: float = 30.0,
+    connections: int = 1,
+) -> None:
+    """Downloads url to path.
+
+    The data goes to path + ".part" first, and is only renamed to path once it is
+    complete and matches expected_size/expected_md5. If the .part file is already
+    there from an interrupted download, it is resumed with an HTTP Range request.
+    The MD5 is calculated while downloading, so the file is not read again.
+
+    Files with a known size of at least 8 MiB are downloaded in up to connections
+    byte ranges at once. Those are hashed once the download is complete, and
+    fall back to one connection if the server doesn't support ranges.
+    """
+    path = Path(path)
+    part_path = path.with_name(path.name + ".part")
+    ranges_path = part_path.with_name(part_path.name + ".ranges")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if (
+        connections > 1
+        and expected_size is not None
+        and expected_size >= _MIN_RANGED_SIZE
+        and (ranges_path.exists() or not part_path.exists())
+    ):
+        try:
+            _download_ranges(url, part_path, expected_size, connections, progress, timeout)
+            _finish_download(path, part_path, expected_size, expected_md5, get_file_hash(part_path))
+            return
+        except _RangesNotSupported:
+            _LOGGER.debug("Server does not support ranges for %s", url)
+            ranges_path.unlink(missing_ok=True)
+            part_path.unlink(missing_ok=True)
+
+    md5 = hashlib.md5()
+    offset = 0
+    if part_path.exists():
+        # Hash what we already have so the digest covers the whole file
+        with open(part_path, "rb") as part_file:
+            while chunk := part_file.read(_CHUNK_SIZE):
+                md5.update(chunk)
+                offset += len(chunk)
+
+    request = Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as err:
+        if err.code != 416 or offset == 0:
+            raise
+        # Range not satisfiable: the .part file is probably complete already
+        response = None
+
+    if response is not None:
+        with response:
+            if offset > 0 and response.status != 206:
+                # Server ignored the Range header, start over
+                _LOGGER.debug("Server does not support resuming %s", url)
+                md5 = hashlib.md5()
+                offset = 0
+
+            length = int(response.headers.get("Content-Length", 0) or 0)
+            total = offset + length if length else (expected_size or 0)
+            done = offset
+
+            if offset > 0:
+                _LOGGER.debug("Resuming %s at %s bytes", url, offset)
+
+            with open(part_path, "ab" if offset > 0 else "wb") as part_file:
+                while chunk := response.read(_CHUNK_SIZE):
+                    part_file.write(chunk)
+                    md5.update(chunk)
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(done, total)
+
+    _finish_download(path, part_path, expected_size, expected_md5, md5.hexdigest())
+
+
+def _finish_download(
+    path: Path,
+    part_path: Path,
+    expected_size: Optional[int],
+    expected_md5: Optional[str],
+    actual_md5: str,
+) -> None:
+    """Checks the downloaded .part file and moves it into place."""
+    actual_size = part_path.stat().st_size
+    if expected_size is not None and actual_size != expected_size:
+        if actual_size > expected_size:
+            part_path.unlink()
+        raise IOError(
+            f"Wrong size for {path.name} (expected={expected_size}, actual={actual_size})"
+        )
+
+    if expected_md5 is not None and actual_md5 != expected_md5:
+        part_path.unlink()
+        raise IOError(
+            f"Wrong hash for {path.name} (expected={expected_md5}, actual={actual_md5})"
+        )
+
+    os.replace(part_path, path)
+    record_file_hash(path, actual_md5)
+
+
+class VoiceCatalog(Mapping):
+    """Parsed voices.json with lookup indexes.
+
+    Works like the voices dict, except old voice names in "aliases" resolve to
+    the voice they were renamed to.
+    """
+
+    def __init__(self, voices: Dict[str, Any], digest: str = ""):
+        self.voices = voices
+        self.digest = digest
+
+        # language code -> voice keys, in file order
+        self.by_language: Dict[str, List[str]] = {}
+        # voice key -> total size of its files in bytes
+        self.sizes: Dict[str, int] = {}
+        # old voice name -> voice key
+        self.aliases: Dict[str, str] = {}
+
+        for key, voice_info in voices.items():
+            self.by_language.setdefault(voice_info["language"]["code"], []).append(key)
+            self.sizes[key] = sum(
+                file_info["size_bytes"] for file_info in voice_info["files"].values()
+            )
+            for voice_alias in voice_info.get("aliases", []):
+                self.aliases[voice_alias] = key
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Returns the voice key for a name or alias."""
+        if name in self.voices:
+            return name
+        return self.aliases.get(name)
+
+    def language_name(self, code: str) -> str:
+        """Example: English (United States)"""
+        language = self.voices[self.by_language[code][0]]["language"]
+        return f"{language['name_english']} ({language['country_english']})"
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        key = self.resolve(name)
+        if key is None:
+            raise KeyError(name)
+        return self.voices[key]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self.resolve(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.voices)
+
+    def __len__(self) -> int:
+        return len(self.voices)
+
+
+# (path, mtime_ns, size) -> catalog of the last loaded voices.json
+_catalog_lock = threading.Lock()
+_catalog_key: Optional[Tuple[str, int, int]] = None
+_catalog: Optional[VoiceCatalog] = None
+
+
+def _load_catalog(voices_path: Path) -> VoiceCatalog:
+    """Loads voices.json, reusing the last catalog if the file didn't change."""
+    global _catalog_key, _catalog  # pylint: disable=global-statement
+
+    stat = voices_path.stat()
+    key = (str(voices_path), stat.st_mtime_ns, stat.st_size)
+    with _catalog_lock:
+        if _catalog is not None and key == _catalog_key:
+            return _catalog
+
+        _LOGGER.debug("Loading %s", voices_path)
+        data = voices_path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        # Same contents under a new mtime (e.g. downloaded again)
+        if _catalog is None or _catalog.digest != digest:
+            _catalog = VoiceCatalog(json.loads(data), digest)
+
+        _catalog_key = key
+        return _catalog
+
+
+def update_voices_json(url: str, path: Path, timeout: float = 30.0) -> bool:
+    """Downloads voices.json if it changed.
+
+    The ETag and Last-Modified of the last download are kept in voices.json.meta
+    and sent back, so if nothing changed the server only answers 304 Not Modified.
+    The new file is downloaded gzipped if the server supports it, and replaces
+    the old one atomically.
+
+    Returns True if the file changed.
+    """
+    meta_path = path.with_name(path.name + ".meta")
+    meta: Dict[str, str] = {}
+    if path.exists() and meta_path.exists():
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            meta = {}
+
+    request = Request(url, headers={"Accept-Encoding": "gzip"})
+    if meta.get("etag"):
+        request.add_header("If-None-Match", meta["etag"])
+    if meta.get("last_modified"):
+        request.add_header("If-Modified-Since", meta["last_modified"])
+
+    _LOGGER.debug("Downloading %s to %s", url, path)
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            if response.headers.get("Content-Encoding", "").lower() == "gzip":
+                data = gzip.decompress(data)
+            headers = response.headers
+    except HTTPError as err:
+        if err.code == 304:
+            _LOGGER.debug("%s not modified", url)
+            return False
+        raise
+
+    # Make sure it's valid before replacing the old one
+    json.loads(data)
+
+    changed = not path.exists() or path.read_bytes() != data
+    if changed:
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    meta = {
+        "etag": headers.get("ETag", ""),
+        "last_modified": headers.get("Last-Modified", ""),
+    }
+    with open(meta_path, "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file)
+
+    return changed
+
+
+def get_voice_catalog(
+    download_dir: Union[str, Path],
+    update_voices: bool = False,
+    url_format: str = URL_FORMAT,
+) -> VoiceCatalog:
+    """Loads available voices from downloaded or embedded JSON file.
+
+    The file is only parsed again when it changes.
+    """
     download_dir = Path(download_dir)
     voices_download = download_dir / "voices.json"
 
     if update_voices:
         # Download latest voices.json
-        voices_url = URL_FORMAT.format(file="voices.json")
-        _LOGGER.debug("Downloading %s to %s", voices_url, voices_download)
-        with urlopen(voices_url) as response, open(
-            voices_download, "wb"
-        ) as download_file:
-            shutil.copyfileobj(response, download_file)
+        update_voices_json(url_format.format(file="voices.json"), voices_download)
 
     # Prefer downloaded file to embedded
     voices_embedded = _DIR / "voices.json"
     voices_path = voices_download if voices_download.exists() else voices_embedded
 
-    _LOGGER.debug("Loading %s", voices_path)
-    with open(voices_path, "r", encoding="utf-8") as voices_file:
-        return json.load(voices_file)
+    return _load_catalog(voices_path)
+
+
+def get_voices(
+    download_dir: Union[str, Path],
+    update_voices: bool = False,
+    url_format: str = URL_FORMAT,
+) -> Dict[str, Any]:
+    """Loads available voices from downloaded or embedded JSON file."""
+    return get_voice_catalog(download_dir, update_voices, url_format).voices
 
 
 def ensure_voice_exists(
     name: str,
     data_dirs: Iterable[Union[str, Path]],
     download_dir: Union[str, Path],
-    voices_info: Dict[str, Any],
+    voices_info: Mapping,
+    url_format: str = URL_FORMAT,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    force_verify: bool = False,
+    connections: int = 1,
 ):
+    """Checks the voice files, and downloads the ones that are missing or wrong.
+
+    Files that were already verified and haven't changed since aren't hashed
+    again, unless force_verify is set. Large files are downloaded over up to
+    connections connections (see download_file).
+
+    progress is called with (file name, bytes done, total bytes) while downloading.
+    """
     assert data_dirs, "No data dirs"
     if name not in voices_info:
         raise VoiceNotFoundError(name)
@@ -92,7 +455,7 @@ def ensure_voice_exists(
                 continue
 
             expected_hash = file_info["md5_digest"]
-            actual_hash = get_file_hash(data_file_path)
+            actual_hash = get_cached_file_hash(data_file_path, force=force_verify)
             if expected_hash != actual_hash:
                 _LOGGER.warning(
                     "Wrong hash (expected=%s, actual=%s) for %s",
@@ -114,15 +477,23 @@ def ensure_voice_exists(
         if file_name in _SKIP_FILES:
             continue
 
-        file_url = URL_FORMAT.format(file=file_path)
+        file_url = url_format.format(file=file_path)
         download_file_path = download_dir / file_name
-        download_file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_info = voice_files[file_path]
 
         _LOGGER.debug("Downloading %s to %s", file_url, download_file_path)
-        with urlopen(file_url) as response, open(
-            download_file_path, "wb"
-        ) as download_file:
-            shutil.copyfileobj(response, download_file)
+        download_file(
+            file_url,
+            download_file_path,
+            expected_size=file_info.get("size_bytes"),
+            expected_md5=file_info.get("md5_digest"),
+            progress=(
+                (lambda done, total, name=file_name: progress(name, done, total))
+                if progress is not None
+                else None
+            ),
+            connections=connections,
+        )
 
         _LOGGER.info("Downloaded %s (%s)", download_file_path, file_url)
 
@@ -1,45 +1,219 @@
 import argparse
 import hashlib
 import json
+import logging
+import os
 import sys
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Union
+from typing import Any, Dict, Optional, Tuple, Union
 
+_LOGGER = logging.getLogger(__name__)
 
-def get_file_hash(path: Union[str, Path], bytes_per_chunk: int = 8192) -> str:
-    """Hash a file in chunks using md5."""
-    path_hash = hashlib.md5()
+# Name of the per-directory cache of verified hashes
+CACHE_NAME = ".file_hashes.json"
+
+_cache_lock = threading.Lock()
+
+# Algorithms for --algorithm. The shake_* ones need a digest length, so they're left out.
+ALGORITHMS = sorted(
+    algorithm
+    for algorithm in hashlib.algorithms_guaranteed
+    if not algorithm.startswith("shake_")
+)
+
+
+def get_file_hash(
+    path: Union[str, Path], bytes_per_chunk: int = 1024 * 1024, algorithm: str = "md5"
+) -> str:
+    """Hash a file in chunks using md5 (or another hashlib algorithm)."""
     with open(path, "rb") as path_file:
-        chunk = path_file.read(bytes_per_chunk)
-        while chunk:
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+, reads straight into a buffer without copying
+            return hashlib.file_digest(path_file, algorithm).hexdigest()
+
+        path_hash = hashlib.new(algorithm)
+        while chunk := path_file.read(bytes_per_chunk):
             path_hash.update(chunk)
-            chunk = path_file.read(bytes_per_chunk)
 
     return path_hash.hexdigest()
 
 
+def _file_key(stat: os.stat_result) -> list:
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _load_cache(cache_path: Path) -> Dict[str, list]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path: Path, cache: Dict[str, list]):
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        _LOGGER.warning("Could not save %s: %s", cache_path, err)
+
+
+def record_file_hash(path: Union[str, Path], md5: str):
+    """Saves an already known hash (e.g. calculated while downloading) in the cache."""
+    path = Path(path)
+    cache_path = path.parent / CACHE_NAME
+    with _cache_lock:
+        cache = _load_cache(cache_path)
+        cache[path.name] = [*_file_key(path.stat()), md5]
+        _save_cache(cache_path, cache)
+
+
+def get_cached_file_hash(path: Union[str, Path], force: bool = False) -> str:
+    """Like get_file_hash, but remembers the hash of each file.
+
+    The hashes are kept in a .file_hashes.json file in the same directory, along
+    with the size, mtime and inode of the file. If none of those changed, the file
+    isn't read again. Set force to hash it anyway.
+    """
+    path = Path(path)
+    cache_path = path.parent / CACHE_NAME
+    key = _file_key(path.stat())
+
+    if not force:
+        with _cache_lock:
+            entry: Optional[list] = _load_cache(cache_path).get(path.name)
+        if entry is not None and entry[:3] == key:
+            return entry[3]
+
+    path_hash = get_file_hash(path)
+    record_file_hash(path, path_hash)
+    return path_hash
+
+
 # -----------------------------------------------------------------------------
 
 
+def _hash_job(path_str: str, algorithm: str) -> Tuple[str, int, int, str]:
+    stat = os.stat(path_str)
+    return path_str, stat.st_size, stat.st_mtime_ns, get_file_hash(path_str, algorithm=algorithm)
+
+
+def _load_manifest(manifest_path: Optional[Path], algorithm: str) -> Dict[str, Any]:
+    """Loads the entries of a previous manifest that used the same algorithm."""
+    if manifest_path is None or not manifest_path.is_file():
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as err:
+        _LOGGER.warning("Ignoring manifest %s: %s", manifest_path, err)
+        return {}
+    return {
+        path: entry
+        for path, entry in manifest.items()
+        if isinstance(entry, dict) and entry.get("algorithm") == algorithm
+    }
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("file", nargs="+")
     parser.add_argument("--dir", help="Parent directory")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of files to hash at once (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Hash in separate processes instead of threads",
+    )
+    parser.add_argument(
+        "-a",
+        "--algorithm",
+        default="md5",
+        choices=ALGORITHMS,
+        help="Digest algorithm (default: md5)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print one JSON object per line as each file finishes",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Manifest with sizes and mtimes. Unchanged files in it aren't hashed again, "
+        "and it is updated afterwards.",
+    )
     args = parser.parse_args()
 
     if args.dir:
         args.dir = Path(args.dir)
 
-    hashes = {}
-    for path_str in args.file:
+    manifest_path = Path(args.manifest) if args.manifest else None
+    previous = _load_manifest(manifest_path, args.algorithm)
+    manifest: Dict[str, Any] = {}
+    hashes: Dict[str, str] = {}
+
+    def display_path(path_str: str) -> str:
         path = Path(path_str)
-        path_hash = get_file_hash(path)
         if args.dir:
             path = path.relative_to(args.dir)
+        return str(path)
+
+    def finish(path_str: str, size: int, mtime_ns: int, path_hash: str):
+        path = display_path(path_str)
+        hashes[path] = path_hash
+        manifest[path_str] = {
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "algorithm": args.algorithm,
+            "hash": path_hash,
+        }
+        if args.stream:
+            print(json.dumps({"path": path, "hash": path_hash}), flush=True)
+
+    # Reuse the hashes of files that didn't change
+    to_hash = []
+    for path_str in args.file:
+        entry = previous.get(path_str)
+        if entry is not None:
+            stat = os.stat(path_str)
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                finish(path_str, stat.st_size, stat.st_mtime_ns, entry["hash"])
+                continue
+        to_hash.append(path_str)
+
+    executor: Executor
+    if args.processes:
+        executor = ProcessPoolExecutor(max_workers=max(1, args.jobs))
+    else:
+        # hashlib releases the GIL while hashing, so threads scale too
+        executor = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+
+    with executor:
+        jobs = [executor.submit(_hash_job, path_str, args.algorithm) for path_str in to_hash]
+        for job in as_completed(jobs):
+            finish(*job.result())
 
-        hashes[str(path)] = path_hash
+    if manifest_path is not None:
+        tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
 
-    json.dump(hashes, sys.stdout)
+    if not args.stream:
+        # Same order as the arguments
+        paths = (display_path(path_str) for path_str in args.file)
+        json.dump({path: hashes[path] for path in paths}, sys.stdout)
 
 
 if __name__ == "__main__":
@@ -10,3 +10,41 @@ def audio_float_to_int16(
     audio_norm = np.clip(audio_norm, -max_wav_value, max_wav_value)
     audio_norm = audio_norm.astype("int16")
     return audio_norm
+
+
+def trim_silence(
+    audio: np.ndarray,
+    sample_rate: int,
+    threshold_db: float = -40.0,
+    padding: float = 0.05,
+    frame_length: float = 0.01,
+) -> np.ndarray:
+    """Trim near-silent audio from the start and end of int16 audio.
+
+    The audio is split into frames of frame_length seconds, and frames with an RMS
+    energy under threshold_db (dBFS) are considered silent. padding seconds of
+    audio are kept around the first and last loud frames.
+    """
+    frame_samples = max(1, int(sample_rate * frame_length))
+    num_frames = len(audio) // frame_samples
+    if num_frames == 0:
+        return audio
+
+    frames = audio[: num_frames * frame_samples].astype(np.float32)
+    frames = frames.reshape(num_frames, frame_samples)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+
+    threshold = 32768.0 * (10.0 ** (threshold_db / 20.0))
+    loud = np.flatnonzero(rms > threshold)
+    if len(loud) == 0:
+        return audio[:0]
+
+    pad_samples = int(sample_rate * padding)
+    start = max(0, loud[0] * frame_samples - pad_samples)
+    if loud[-1] == num_frames - 1:
+        # Keep the leftover samples that didn't fit in a frame
+        end = len(audio)
+    else:
+        end = min(len(audio), (loud[-1] + 1) * frame_samples + pad_samples)
+
+    return audio[start:end]
@@ -1,5 +1,5 @@
-import json
 import logging
+import re
 import wave
 from dataclasses import dataclass
 from pathlib import Path
@@ -11,10 +11,13 @@ from piper_phonemize import phonemize_codepoints, phonemize_espeak, tashkeel_run
 
 from .config import PhonemeType, PiperConfig
 from .const import BOS, EOS, PAD
-from .util import audio_float_to_int16
+from .util import audio_float_to_int16, trim_silence
 
 _LOGGER = logging.getLogger(__name__)
 
+# Where to split text before phonemizing it, so long messages can be cut off early
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
 
 @dataclass
 class PiperVoice:
@@ -35,9 +38,6 @@ class PiperVoice:
         if config_path is None:
             config_path = f"{model_path}.json"
 
-        with open(config_path, "r", encoding="utf-8") as config_file:
-            config_dict = json.load(config_file)
-
         providers: List[Union[str, Tuple[str, Dict[str, Any]]]]
         if use_cuda:
             providers = [
@@ -63,7 +63,7 @@ class PiperVoice:
         # Forcibly enable memory shrinkage so ONNX doesn't leak memory
         runopts.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu:0")
         return PiperVoice(
-            config=PiperConfig.from_dict(config_dict),
+            config=PiperConfig.from_file(config_path),
             session=onnxruntime.InferenceSession(
                 str(model_path),
                 sess_options=options,
@@ -89,6 +89,15 @@ class PiperVoice:
 
         raise ValueError(f"Unexpected phoneme type: {self.config.phoneme_type}")
 
+    def phonemize_sentences(self, text: str) -> Generator[List[str], Any, None]:
+        """
+        Like phonemize, but phonemizes the text one sentence at a time as the
+        result is consumed, so stopping early skips the rest of the text.
+        """
+        for chunk in _SENTENCE_END.split(text):
+            if chunk and not chunk.isspace():
+                yield from self.phonemize(chunk)
+
     def phonemes_to_ids(self, phonemes: List[str]) -> List[int]:
         """Phonemes to ids."""
         id_map = self.config.phoneme_id_map
@@ -144,30 +153,79 @@ class PiperVoice:
         yield text[last_start:]
 
 
-    def phonemize_with_limit(self, text: str, max_words: int) -> Optional[List[Tuple[List[str], bool]]]:
+    def phonemize_with_limit(
+        self,
+        text: str,
+        max_words: int,
+        max_phonemes: int = 0,
+        truncate: bool = False,
+    ) -> Optional[List[Tuple[List[str], bool]]]:
         """
         Like phonemize_impl, but splits up long sentences. Long sentences can consume
         gigabytes of RAM when inferencing.
+
+        See limit_phonemes for the limits.
         """
-        phonemes = self.phonemize(text)
+        return self.limit_phonemes(self.phonemize_sentences(text), max_words, max_phonemes, truncate)[0]
 
+    def limit_phonemes(
+        self,
+        phonemes: Iterable[List[str]],
+        max_words: int,
+        max_phonemes: int = 0,
+        truncate: bool = False,
+    ) -> Tuple[Optional[List[Tuple[List[str], bool]]], bool]:
+        """
+        Checks the phonemized sentences against the word limit and the total phoneme
+        limit (0 = no limit) sentence by sentence, and splits up long sentences.
+        Nothing after the sentence that reaches a limit is read from phonemes.
+
+        If a limit is reached, returns (None, False), or if truncate is set, the
+        sentences that fit, with the last one cut off at a word boundary and True.
+        """
         num_words = 0
+        num_phonemes = 0
 
         out: List[Tuple[List[str], bool]] = []
         for sentence in phonemes:
-            num_words += 1 + sentence.count(' ')
-
-            if max_words > 0 and num_words > max_words:
-                return None
-
-            if len(sentence) > self.max_phonemes:
-                for fragment in self.split_at_commas(sentence):
-                    if fragment:
-                        out.append((fragment, False))
-                out.append(([], True))
-            else:
-                out.append((sentence, True))
-        return out
+            words = 1 + sentence.count(" ")
+            over_words = max_words > 0 and num_words + words > max_words
+            over_phonemes = max_phonemes > 0 and num_phonemes + len(sentence) > max_phonemes
+
+            if over_words or over_phonemes:
+                if not truncate:
+                    return None, False
+
+                # Keep the words that fit
+                end = len(sentence)
+                if over_phonemes:
+                    end = max_phonemes - num_phonemes
+                if over_words:
+                    spaces = [i for i, phoneme in enumerate(sentence) if phoneme == " "]
+                    end = min(end, spaces[max_words - num_words - 1] if max_words > num_words else 0)
+                if end < len(sentence) and " " in sentence[:end + 1]:
+                    end = max(i for i in range(end + 1) if sentence[i] == " ")
+                else:
+                    end = 0
+                sentence = sentence[:end]
+                if sentence:
+                    self._append_sentence(out, sentence)
+                return (out, True) if out else (None, False)
+
+            num_words += words
+            num_phonemes += len(sentence)
+            self._append_sentence(out, sentence)
+
+        return out, False
+
+    def _append_sentence(self, out: List[Tuple[List[str], bool]], sentence: List[str]):
+        if len(sentence) > self.max_phonemes:
+            for fragment in self.split_at_commas(sentence):
+                if fragment:
+                    out.append((fragment, False))
+            out.append(([], True))
+        else:
+            out.append((sentence, True))
 
 
     def synthesize(
@@ -179,6 +237,8 @@ class PiperVoice:
         noise_scale: Optional[float] = None,
         noise_w: Optional[float] = None,
         sentence_silence: float = 0.0,
+        trim_threshold: Optional[float] = None,
+        trim_padding: float = 0.05,
     ):
         """Synthesize WAV audio from text."""
         wav_file.setframerate(self.config.sample_rate)
@@ -192,6 +252,8 @@ class PiperVoice:
             noise_scale=noise_scale,
             noise_w=noise_w,
             sentence_silence=sentence_silence,
+            trim_threshold=trim_threshold,
+            trim_padding=trim_padding,
         ):
             wav_file.writeframes(audio_bytes)
 
@@ -203,18 +265,48 @@ class PiperVoice:
         noise_scale: Optional[float] = None,
         noise_w: Optional[float] = None,
         sentence_silence: float = 0.0,
-        max_words: int = 0
+        max_words: int = 0,
+        trim_threshold: Optional[float] = None,
+        trim_padding: float = 0.05,
     ) -> Iterable[bytes]:
-        """Synthesize raw audio per sentence from text."""
+        """Synthesize raw audio per sentence from text.
+
+        If trim_threshold (dBFS) is set, quiet audio at the start and end of each
+        sentence is trimmed before sentence_silence is added, keeping trim_padding
+        seconds around the speech.
+        """
         sentence_phonemes = self.phonemize_with_limit(text, max_words)
 
         if sentence_phonemes is None:
             raise OverflowError("Text is longer than word limit")
 
+        return self.synthesize_phonemes_raw(
+            sentence_phonemes,
+            speaker_id=speaker_id,
+            length_scale=length_scale,
+            noise_scale=noise_scale,
+            noise_w=noise_w,
+            sentence_silence=sentence_silence,
+            trim_threshold=trim_threshold,
+            trim_padding=trim_padding,
+        )
+
+    def synthesize_phonemes_raw(
+        self,
+        sentence_phonemes: List[Tuple[List[str], bool]],
+        speaker_id: Optional[int] = None,
+        length_scale: Optional[float] = None,
+        noise_scale: Optional[float] = None,
+        noise_w: Optional[float] = None,
+        sentence_silence: float = 0.0,
+        trim_threshold: Optional[float] = None,
+        trim_padding: float = 0.05,
+    ) -> Iterable[bytes]:
+        """Synthesize raw audio per sentence from the output of phonemize_with_limit."""
         # 16-bit mono
         num_silence_samples = int(sentence_silence * self.config.sample_rate)
-        silence_bytes = np.zeros(num_silence_samples * 2, dtype=np.float32)
-    
+        silence_bytes = bytes(num_silence_samples * 2)
+
         for phonemes, pause in sentence_phonemes:
             if len(phonemes) == 0:
                 if pause and len(silence_bytes):
@@ -229,8 +321,18 @@ class PiperVoice:
                 noise_scale=noise_scale,
                 noise_w=noise_w,
             )
+            # Only trim whole sentences, the fragments of a long sentence keep
+            # the pauses between them
+            if trim_threshold is not None and pause:
+                synthesized = trim_silence(
+                    np.frombuffer(synthesized, dtype=np.int16),
+                    self.config.sample_rate,
+                    threshold_db=trim_threshold,
+                    padding=trim_padding,
+                ).tobytes()
+
             if pause:
-                synthesized = np.append(synthesized, silence_bytes)
+                synthesized += silence_bytes
 
             yield synthesized
 
@@ -0,0 +1,99 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Predicts how long a message will take to synthesize and play.
+
+Phonemizing at queue time would cost as much as an espeak call per message, so
+the prediction goes text length -> phonemes -> seconds:
+
+    phonemes       = characters * phonemes_per_char
+    duration       = phonemes * seconds_per_phoneme * length_scale
+    synthesis time = phonemes * synthesis_per_phoneme
+
+Each ratio is learned per voice model from the messages that actually get
+synthesized, using an exponential moving average.
+"""
+
+from dataclasses import dataclass
+from threading import Lock
+
+# How quickly new observations replace the old ones
+SMOOTHING = 0.2
+
+@dataclass
+class VoiceStats:
+    phonemes_per_char: float = 1.0
+    seconds_per_phoneme: float = 0.07   # at length_scale 1.0
+    synthesis_per_phoneme: float = 0.005
+    samples: int = 0
+
+    def update(self, attr: str, value: float):
+        # Use a plain average for the first few samples so the defaults get replaced quickly.
+        alpha = max(SMOOTHING, 1.0 / (self.samples + 1))
+        setattr(self, attr, getattr(self, attr) + (value - getattr(self, attr)) * alpha)
+
+@dataclass
+class Estimate:
+    phonemes: int
+    duration: float          # seconds
+    synthesis_time: float    # seconds
+
+class Predictor:
+    def __init__(self):
+        self.voices: dict[str, VoiceStats] = {}
+        self.lock = Lock()
+
+    def _stats(self, model_name: str) -> VoiceStats:
+        if model_name not in self.voices:
+            self.voices[model_name] = VoiceStats()
+        return self.voices[model_name]
+
+    def estimate(self, model_name: str, text: str, length_scale: float = 1.0, phonemes: int|None = None) -> Estimate:
+        """
+        Estimates the cost of a message. If the phoneme count is already known, it is used
+        instead of the text length.
+        """
+        with self.lock:
+            stats = self._stats(model_name)
+            if phonemes is None:
+                phonemes = round(len(text) * stats.phonemes_per_char)
+            return Estimate(
+                phonemes=phonemes,
+                duration=phonemes * stats.seconds_per_phoneme * length_scale,
+                synthesis_time=phonemes * stats.synthesis_per_phoneme
+            )
+
+    def observe(self, model_name: str, text: str, phonemes: int, length_scale: float,
+                duration: float, synthesis_time: float):
+        """
+        Refines the estimates for a voice from a synthesized message.
+        """
+        if len(text) == 0 or phonemes == 0 or length_scale <= 0:
+            return
+
+        with self.lock:
+            stats = self._stats(model_name)
+            stats.update("phonemes_per_char", phonemes / len(text))
+            stats.update("seconds_per_phoneme", duration / phonemes / length_scale)
+            stats.update("synthesis_per_phoneme", synthesis_time / phonemes)
+            stats.samples += 1
+
+predictor = Predictor()
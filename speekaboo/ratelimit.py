@@ -0,0 +1,155 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Admission control for Speak requests.
+
+Every source of messages (a WebSocket connection, a UDP address, or a sender
+name) gets two token buckets: one counting messages, and one counting the
+estimated seconds of speech. A request has to fit in the buckets of every key
+it belongs to, otherwise it is rejected before it gets queued.
+"""
+
+import time
+import logging
+from threading import Lock
+
+import config
+
+# Forget about idle keys once there are this many.
+MAX_KEYS = 1024
+
+class RateLimitError(ValueError):
+    """
+    Raised when a request goes over a rate limit.
+    """
+    def __init__(self, message: str, key: str, retry_after: float):
+        super().__init__(message)
+        self.key = key
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float, now: float):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.last) * self.rate)
+        self.last = max(self.last, now)
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount tokens are available, or 0 if they are available now.
+
+        Requests bigger than the bucket are let through once it is full. They are
+        still charged in full, so the bucket goes negative and later requests wait
+        until the deficit is paid back.
+        """
+        needed = min(amount, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+class KeyLimits:
+    def __init__(self, now: float):
+        self.messages = TokenBucket(config.config["rate_limit_messages"], config.config["rate_limit_message_burst"], now)
+        self.speech = TokenBucket(config.config["rate_limit_speech_seconds"], config.config["rate_limit_speech_burst"], now)
+        self.accepted = 0
+        self.rejected = 0
+
+class AdmissionController:
+    def __init__(self):
+        self.limits: dict[str, KeyLimits] = {}
+        self.lock = Lock()
+
+    def _get(self, key: str, now: float) -> KeyLimits:
+        if key not in self.limits:
+            if len(self.limits) >= MAX_KEYS:
+                self._prune(now)
+            self.limits[key] = KeyLimits(now)
+        limits = self.limits[key]
+        limits.messages.refill(now)
+        limits.speech.refill(now)
+        return limits
+
+    def _prune(self, now: float):
+        """
+        Removes keys whose buckets have filled back up, since they would behave like new keys.
+        """
+        for key, limits in list(self.limits.items()):
+            limits.messages.refill(now)
+            limits.speech.refill(now)
+            if limits.messages.tokens >= limits.messages.burst and limits.speech.tokens >= limits.speech.burst:
+                del self.limits[key]
+
+    def admit(self, keys: list[str], speech_seconds: float, messages: int = 1):
+        """
+        Takes messages and speech_seconds of speech from the buckets of each key.
+
+        Raises RateLimitError without taking anything if any of them is empty.
+        """
+        self.admit_each({key: (messages, speech_seconds) for key in keys})
+
+    def admit_each(self, charges: dict[str, tuple[int, float]]):
+        """
+        Like admit(), but with a different (messages, speech_seconds) for each key,
+        e.g. for a batch where each sender is only charged for its own messages.
+        """
+        if not config.config["rate_limit_enabled"] or len(charges) == 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            all_limits = [(key, self._get(key, now), charge) for key, charge in charges.items()]
+            for key, limits, (messages, speech_seconds) in all_limits:
+                wait = max(limits.messages.wait_time(messages), limits.speech.wait_time(speech_seconds))
+                if wait > 0:
+                    limits.rejected += messages
+                    logging.warning("Rate limited %s", key)
+                    raise RateLimitError(f"Rate limit exceeded for {key}", key, round(wait, 2))
+
+            for key, limits, (messages, speech_seconds) in all_limits:
+                limits.messages.take(messages)
+                limits.speech.take(speech_seconds)
+                limits.accepted += messages
+
+    def counters(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            result = {}
+            for key, limits in self.limits.items():
+                limits.messages.refill(now)
+                limits.speech.refill(now)
+                result[key] = {
+                    "accepted": limits.accepted,
+                    "rejected": limits.rejected,
+                    "messageTokens": round(limits.messages.tokens, 2),
+                    "speechTokens": round(limits.speech.tokens, 2)
+                }
+            return result
+
+admission = AdmissionController()
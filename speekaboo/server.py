@@ -18,22 +18,32 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 import os
-import socketserver
-from threading import Thread, Lock
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, get_ident
 import datetime
 import logging
 import json
 import errno
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from collections import deque
 
-from websockets import CloseCode
-from websockets.sync.server import serve, ServerConnection
+from websockets import CloseCode, ConnectionClosed
+from websockets.asyncio.server import serve, Server, ServerConnection
 
 
 import config
 import tts
 import audio
 import event
+from ratelimit import admission, RateLimitError
+from udp_ingest import UDPIngest
+
+# Most messages in one SpeakBatch request
+MAX_BATCH_SIZE = 100
+
+# Threads for running WebSocket requests off the event loop
+WS_REQUEST_THREADS = 4
 
 # e.g. 2025-01-28T19:16:09.449827-05:00
 def get_isoformat(time: datetime.datetime = datetime.datetime.now()):
@@ -44,27 +54,48 @@ class SpeekabooHandler:
     Base class for UDP and WebSocket handling
     """
 
-    def cmd_speak(self, json_data: dict):
+    def cmd_speak(self, json_data: dict, source: str|None = None):
         """
         Speak
         Speak the given message with the provided voice alias.
+
+        source identifies the connection or address the request came from, for rate limiting.
         Websockets:
         {
             "id": "<id>",
             "request": "Speak",
             "voice": "EventVoice"
             "message": "This is a test message",
-            "badWordFilter": true
+            "badWordFilter": true,
+            "priority": 0, // Speekaboo extension, optional. 0 is the highest priority.
+            "sender": "<name>" // Speekaboo extension, optional. Used for rate limiting.
         }
         UDP:
         {
             "command": "speak",
             "id": "<id>",
             "voice": "<voice alias>",
-            "message": "<message>"
+            "message": "<message>",
+            "badWordFilter": true, // optional
+            "priority": 0, // optional
+            "sender": "<name>" // optional
         }
         """
 
+        item = self.parse_speak(json_data)
+
+        keys = [source] if source else []
+        if item["sender"]:
+            keys.append(f"sender:{item['sender']}")
+        admission.admit(keys, tts.estimate(item["message"], item["voice"]).duration)
+
+        speech_id = tts.add(**item)
+        return {"speechId": speech_id, "text": item["message"], "voiceName": item["voice"], "pitch": 1.0, "volume": 1.0, "rate": 0.0}
+
+    def parse_speak(self, json_data: dict) -> dict:
+        """
+        Validates the fields of a Speak request, returning the arguments for tts.add().
+        """
         if "message" not in json_data:
             raise ValueError("No message was provided")
         message = str(json_data["message"]).strip()
@@ -78,8 +109,77 @@ class SpeekabooHandler:
         if voice == "" or voice not in config.config["voices"]:
             raise ValueError("Voice alias not found")
 
-        speech_id = tts.add(message, voice=voice)
-        return {"speechId": speech_id, "text": message, "voiceName": voice, "pitch": 1.0, "volume": 1.0, "rate": 0.0}
+        priority = json_data.get("priority")
+        if priority is not None and (not isinstance(priority, int) or isinstance(priority, bool)):
+            raise ValueError("Priority must be an integer")
+
+        sender = json_data.get("sender")
+        if sender is not None:
+            sender = str(sender)
+
+        censor = bool(json_data.get("badWordFilter", False))
+
+        return {"message": message, "voice": voice, "censor": censor, "priority": priority, "sender": sender}
+
+    def cmd_speakbatch(self, json_data: dict, source: str|None = None):
+        """
+        Speekaboo extension.
+        Speaks several messages in order. All of them are checked before any are
+        queued, so either all of them are queued or none are. The fields of each
+        item default to the ones of the request.
+
+        Websockets:
+        {
+            "id": "<id>",
+            "request": "SpeakBatch",
+            "voice": "EventVoice",     // optional
+            "badWordFilter": true,     // optional
+            "priority": 0,             // optional
+            "sender": "<name>",        // optional
+            "items": [
+                { "voice": "EventVoice", "message": "Part one", "priority": 0 },
+                { "message": "Part two" },
+                ...
+            ]
+        }
+        UDP:
+        {
+            "command": "speakbatch",
+            "items": [ ... ] // same as above
+        }
+
+        Returns the speech ids in the same order. Items whose text is removed
+        entirely by the text filter, or that are dropped as duplicates, get a null id.
+        """
+        items = json_data.get("items")
+        if not isinstance(items, list) or len(items) == 0:
+            raise ValueError("No items were provided")
+        if len(items) > MAX_BATCH_SIZE:
+            raise ValueError(f"Too many items (the maximum is {MAX_BATCH_SIZE})")
+
+        defaults = {key: json_data[key] for key in ("voice", "badWordFilter", "priority", "sender") if key in json_data}
+        parsed = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"Item {i}: Malformed json")
+            try:
+                parsed.append(self.parse_speak(defaults | item))
+            except ValueError as e:
+                raise ValueError(f"Item {i}: {e}") from e
+
+        # The connection is charged for the whole batch, and each sender for its own items
+        charges: dict[str, tuple[int, float]] = {}
+        for item in parsed:
+            duration = tts.estimate(item["message"], item["voice"]).duration
+            keys = [source] if source else []
+            if item["sender"]:
+                keys.append(f"sender:{item['sender']}")
+            for key in keys:
+                messages, seconds = charges.get(key, (0, 0.0))
+                charges[key] = (messages + 1, seconds + duration)
+        admission.admit_each(charges)
+
+        return {"speechIds": tts.add_batch(parsed)}
 
     def cmd_stop(self, _json_data: dict):
         """
@@ -198,6 +298,30 @@ class SpeekabooHandler:
         return {}
 
 
+    def cmd_cancel(self, json_data: dict):
+        """
+        Speekaboo extension.
+        Cancels a queued message before it starts playing, e.g. during the
+        queue_delay moderation window. Sends a deleted event.
+
+        Websockets:
+        {
+            "id": "<id>",
+            "request": "Cancel",
+            "speechId": "<speechId from Speak>"
+        }
+
+        UDP:
+        {
+            "command": "cancel",
+            "speechId": "<speechId>"
+        }
+        """
+        if "speechId" not in json_data:
+            raise ValueError("No speechId was provided")
+        speech_id = str(json_data["speechId"])
+        return {"speechId": speech_id, "cancelled": tts.cancel(speech_id)}
+
     def cmd_getinfo(self, _json_data: dict):
         """
         Returns version information, required by Streamer.bot.
@@ -226,7 +350,7 @@ class SpeekabooHandler:
             "engineprocessed", # implemented
             "playing",         # implemented
             "finished",        # implemented
-            "deleted",         # not implemented
+            "deleted",         # implemented
             "error"            # implemented
         ],
         "voicegate":[
@@ -257,6 +381,64 @@ class SpeekabooHandler:
             voices.append({"id": config.config["voices"][voice]["id"], "name": voice,  "voiceCount": 1})
         return { "aliases": voices }
 
+    def cmd_getqueuestats(self, _json_data: dict):
+        """
+        Speekaboo extension.
+        Returns the depth and wait times of each priority lane, for both the
+        synthesis queue and the playback queue, and the UDP counters.
+
+        Websockets:
+        {
+            "id": "<id>",
+            "request": "GetQueueStats"
+        }
+        """
+        return {
+            "synthesis": tts._parsing_queue.stats(), # pylint:disable=protected-access
+            "playback": audio.audio.queue.stats(),
+            "udp": udp_thread.stats()
+        }
+
+    def cmd_getqueueeta(self, json_data: dict):
+        """
+        Speekaboo extension.
+        Estimates how long until a new message would start playing, in seconds. If a
+        voice alias and message are given, the estimated cost of that message is
+        included as well.
+
+        Websockets:
+        {
+            "id": "<id>",
+            "request": "GetQueueEta",
+            "voice": "<voice alias>", // optional
+            "message": "<message>"    // optional
+        }
+        """
+        response = tts.queue_eta()
+
+        if "voice" in json_data and "message" in json_data:
+            voice = str(json_data["voice"])
+            if voice not in config.config["voices"]:
+                raise ValueError("Voice alias not found")
+            cost = tts.estimate(str(json_data["message"]).strip(), voice)
+            response["estimatedDuration"] = round(cost.duration * 1000, 2)
+            response["estimatedSynthesisTime"] = round(cost.synthesis_time * 1000, 2)
+
+        return response
+
+    def cmd_getratelimits(self, _json_data: dict):
+        """
+        Speekaboo extension.
+        Returns the rate limit counters for each connection, UDP address and sender.
+
+        Websockets:
+        {
+            "id": "<id>",
+            "request": "GetRateLimits"
+        }
+        """
+        return { "limits": admission.counters() }
+
     def cmd_nop(self, _json_data: dict):
         """
         A no-op
@@ -274,10 +456,12 @@ class SpeekabooHandler:
 
     commands_websocket = {
         "Speak": cmd_speak,
+        "SpeakBatch": cmd_speakbatch,
         "Pause": cmd_pause,
         "Resume": cmd_resume,
         "Clear": cmd_clear,
         "Stop": cmd_stop,
+        "Cancel": cmd_cancel,
         "Off": cmd_disable,
         "Disable": cmd_disable,
         "On": cmd_enable,
@@ -292,11 +476,15 @@ class SpeekabooHandler:
         "GetState": cmd_stub,
         "GetVoiceGateProfiles": cmd_stub,
         "ActivateVoiceGateProfile": cmd_stub,
-        "Commands": cmd_commands
+        "Commands": cmd_commands,
+        "GetQueueStats": cmd_getqueuestats,
+        "GetQueueEta": cmd_getqueueeta,
+        "GetRateLimits": cmd_getratelimits
     }
 
     commands_udp = {
         "speak": cmd_speak,
+        "speakbatch": cmd_speakbatch,
         "stop": cmd_stop,
         "enable": cmd_enable,
         "on": cmd_enable,
@@ -306,6 +494,7 @@ class SpeekabooHandler:
         "pause": cmd_pause,
         "resume": cmd_resume,
         "clear": cmd_clear,
+        "cancel": cmd_cancel,
         "events": cmd_stub,
         "reg": cmd_stub,
         "set": cmd_stub,
@@ -326,19 +515,155 @@ class SpeekabooHandler:
         event.warn(message)
 
 
-@dataclass
+# Seconds to wait for a client to close. Keep this below the 5 seconds that
+# join_or_die waits for.
+CLOSE_TIMEOUT = 2
+
+@dataclass(eq=False)
 class ConnectionInfo:
     """
     Info for an active connection
+
+    Everything sent to the client goes through a queue that is drained by
+    write_loop(), so a slow client only holds up its own messages. Responses
+    are always queued, but only ws_send_queue_size events can be waiting at
+    once. Past that, the oldest event is dropped or the client is disconnected,
+    depending on ws_send_queue_overflow.
+
+    Must only be used from the event loop.
     """
     websocket: ServerConnection
-    subscribed_events: dict
+    subscribed_events: dict[str, set[str]] = field(default_factory=dict)
+    outbox: deque[tuple[str, bool]] = field(default_factory=deque) # (message, is_event)
+    pending_events: int = 0
+    dropped_events: int = 0
+    closing: bool = False
+    ready: asyncio.Event = field(default_factory=asyncio.Event) # Set when something is queued
+    sent: asyncio.Event = field(default_factory=asyncio.Event)  # Set when something is sent
+
+    def send(self, message: str, is_event: bool = False):
+        """
+        Queues a message for write_loop().
+        """
+        if self.closing:
+            return
+
+        if is_event and self.pending_events >= max(1, config.config["ws_send_queue_size"]):
+            if config.config["ws_send_queue_overflow"] == "disconnect":
+                logging.warning("Disconnecting %s, too many events waiting to be sent", self.websocket.remote_address)
+                self.closing = True
+                self.outbox.clear()
+                self.pending_events = 0
+                asyncio.ensure_future(self.disconnect(CloseCode.TRY_AGAIN_LATER, "Too many pending events"))
+                return
+
+            # drop_oldest
+            for i, (_old_message, old_is_event) in enumerate(self.outbox):
+                if old_is_event:
+                    del self.outbox[i]
+                    break
+            self.pending_events -= 1
+            if self.dropped_events == 0:
+                logging.warning("Dropping events for %s, it isn't keeping up", self.websocket.remote_address)
+            self.dropped_events += 1
+
+        self.outbox.append((message, is_event))
+        if is_event:
+            self.pending_events += 1
+        self.ready.set()
+
+    async def write_loop(self):
+        """
+        Sends the queued messages until the connection closes.
+        """
+        try:
+            while not self.closing:
+                if not self.outbox:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+
+                message, is_event = self.outbox.popleft()
+                if is_event:
+                    self.pending_events -= 1
+                # Waits while the client's socket buffer is full
+                await self.websocket.send(message)
+                self.sent.set()
+        except ConnectionClosed:
+            pass
+        finally:
+            self.closing = True
+            self.sent.set()
+
+    async def wait_for_responses(self):
+        """
+        Waits while too many responses are queued, so a client that sends
+        requests without reading the responses can't use up all our memory.
+        """
+        while not self.closing and len(self.outbox) - self.pending_events >= max(1, config.config["ws_send_queue_size"]):
+            self.sent.clear()
+            await self.sent.wait()
+
+    async def disconnect(self, code: CloseCode, reason: str = ""):
+        """
+        Closes the connection. websockets only times out waiting for the client's
+        close frame, not sending ours, so a client that stopped reading is
+        dropped here instead.
+        """
+        self.closing = True
+        try:
+            await asyncio.wait_for(self.websocket.close(code, reason), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.websocket.transport.abort()
+
+    def subscription_keys(self) -> set[tuple[str, str]]:
+        return {(group, name) for group, names in self.subscribed_events.items() for name in names}
 
 class WSServer(Thread, SpeekabooHandler, event.Observer):
     """
     Websocket server thread handling Speaker.bot requests.
+
+    The server runs on an asyncio event loop in this thread, so connections
+    don't need a thread each. Requests can block (compiling the censor word
+    list, shedding the queues, etc), so they run on a small thread pool, except
+    for Subscribe and Unsubscribe. Those are handled on the loop, since only the
+    loop thread touches active_connections and subscribers. Events fired by the
+    other threads are handed over to the loop with call_soon_threadsafe.
+
+    subscribers maps each (source, type) pair to the connections subscribed
+    to it, so sending an event doesn't have to look at every connection.
     """
 
+    def index_subscriptions(self, conn_id: str, old: set[tuple[str, str]], new: set[tuple[str, str]]):
+        """
+        Updates subscribers after the subscriptions of a connection change.
+        """
+        for key in old - new:
+            conn_ids = self.subscribers.get(key)
+            if conn_ids is not None:
+                conn_ids.discard(conn_id)
+                if not conn_ids:
+                    del self.subscribers[key]
+        for key in new - old:
+            self.subscribers.setdefault(key, set()).add(conn_id)
+
+    def parse_events(self, json_data: dict) -> dict[str, list[str]]:
+        """
+        Validates and lowercases the "events" of a Subscribe/Unsubscribe request.
+        """
+        if "events" not in json_data:
+            raise ValueError("No events provided")
+
+        events = json_data["events"]
+        if not isinstance(events, dict):
+            raise ValueError("Malformed json")
+
+        parsed = {}
+        for group, names in events.items():
+            if not isinstance(names, list):
+                raise ValueError("Malformed json")
+            parsed[str(group).lower()] = [str(name).lower() for name in names]
+        return parsed
 
     def do_subscribe(self, json_data: dict, conn_id: str):
         """
@@ -360,40 +685,20 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
             }
         }
         """
-        if "events" not in json_data:
-            raise ValueError("No events provided")
-        
-        # sorry i'm lazy
-        events = json.loads(json.dumps(json_data["events"]).lower())
+        events = self.parse_events(json_data)
+        conn_data = self.active_connections[conn_id]
+        subscribed = conn_data.subscribed_events
+        before = conn_data.subscription_keys()
 
-        if not isinstance(events, dict):
-            raise ValueError("Malformed json")
-
-        subscribed = {}
-        if conn_id in self.active_connections:
-            subscribed = self.active_connections[conn_id].subscribed_events
+        for group, known in self.subscribable_events.items():
+            # If "*" is supplied, it subscribes to all events
+            if "*" in events or "*" in events.get(group, []):
+                subscribed.setdefault(group, set()).update(known)
+            # Speaker.bot doesn't check the group or event names, unknown ones are ignored
+            elif group in events:
+                subscribed.setdefault(group, set()).update(name for name in events[group] if name in known)
 
-        # If "*" is supplied, it subscribes to all events
-        if "*" in events:
-            subscribed = subscribed | self.subscribable_events
-        
-        else:
-            for group in events:
-                # Speaker.bot doesn't actually check this 
-                # if not group in subscribable_events:
-                #     raise ValueError("Unknown group name {}".format(group))
-
-                if group in self.subscribable_events:
-                    for event in events[group]:
-                        if event == "*":
-                            subscribed[group] |= self.subscribable_events[group]
-                        else:
-                            subscribed[group] |= events[group]
-
-
-        # Add to the dictionary of subscriptions
-
-        self.active_connections[conn_id].subscribed_events = subscribed
+        self.index_subscriptions(conn_id, before, conn_data.subscription_keys())
 
         logging.debug("Subscribed %s, current events: %s", conn_id, subscribed)
         return {"events": events}
@@ -419,46 +724,31 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
             }
         }
         """
-        if "events" not in json_data:
-            raise ValueError("No events provided")
-        
-        events = json_data["events"]
+        events = self.parse_events(json_data)
+        conn_data = self.active_connections[conn_id]
+        subscribed = conn_data.subscribed_events
+        before = conn_data.subscription_keys()
 
-        if not isinstance(events, dict):
-            raise ValueError("Malformed json")
+        for group in list(subscribed):
+            if "*" in events or "*" in events.get(group, []):
+                subscribed[group].clear()
+            elif group in events:
+                subscribed[group].difference_update(events[group])
+            if not subscribed[group]:
+                del subscribed[group]
 
-        subscribed = {}
-
-        if conn_id in self.active_connections:
-            subscribed = self.active_connections[conn_id].subscribed_events
-        if "*" in events:
-            subscribed = {}
-
-        else:
-            for group in events:
-                # Speaker.bot doesn't actually check this
-                # if not group in subscribable_events:
-                #     raise ValueError("Unknown group name {}".format(group))
-
-                if group in self.subscribable_events:
-                    for i in range(events[group]):
-                        if events[group][i] == "*":
-                            subscribed[group] =[]
-                        elif events[group][i] in subscribed[group]:
-                            for j in range(subscribed[group]):
-                                if subscribed[group][j] == events[group][i]:
-                                    del subscribed[group][j]
-                                    break
+        self.index_subscriptions(conn_id, before, conn_data.subscription_keys())
 
         logging.debug("Unsubscribed %s, current events: %s", conn_id, subscribed)
-
-        self.active_connections[conn_id].subscribed_events = subscribed
-        return {"events":events}
+        return {"events": events}
 
     def handle_event(self, event_source: str, event_type: str, data: dict):
         """
         Handles a subscribable event, triggered by a event.Event
-        
+
+        This is called from whichever thread fired the event, so the message is
+        serialized here and sent from the event loop.
+
         Format:
         {
             "timeStamp": "iso timestamp in local time",
@@ -469,6 +759,10 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
         if event_source == "internal_event":
             return
 
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+
         response = {}
 
         response["timeStamp"] = datetime.datetime.now().astimezone().isoformat()
@@ -481,13 +775,23 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
         stringified = json.dumps(response)
         logging.debug("Sending event %s", stringified)
 
-        for conn_data in self.active_connections.values():
-            if event_source.lower() not in conn_data.subscribed_events:
-                continue
-            if event_type not in conn_data.subscribed_events[event_source]:
-                continue
-            conn_data.websocket.send(stringified)
+        if get_ident() == self.ident:
+            # Fired by a request handled on the loop. Queue it right away so it
+            # goes out before the response.
+            self.send_event(event_source.lower(), event_type, stringified)
+            return
+        try:
+            loop.call_soon_threadsafe(self.send_event, event_source.lower(), event_type, stringified)
+        except RuntimeError:
+            # The loop was closed in the meantime
+            pass
 
+    def send_event(self, event_source: str, event_type: str, stringified: str):
+        """
+        Sends an event to the subscribed connections. Must run on the event loop.
+        """
+        for conn_id in self.subscribers.get((event_source, event_type), ()):
+            self.active_connections[conn_id].send(stringified, is_event=True)
 
     def event_text_queued(self, _message: tts.MessageInfo):
         """
@@ -495,11 +799,14 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
         """
         raise NotImplementedError()
 
-    def parse_speaker_bot_websocket(self, message: str, conn_id: str) -> str:
+    # Requests that touch the connection state, and must be handled on the event loop
+    loop_requests = ("Subscribe", "UnSubscribe", "Unsubscribe")
+
+    def parse_request(self, message: str) -> dict|str:
         """
-        Parses a websocket request.
+        Parses and validates a websocket request.
 
-        Returns the response as a string.
+        Returns the request, or the error response as a string.
         """
         if len(message) > 10000:
             logging.error("Ignoring overly long message of %i bytes", len(message))
@@ -511,7 +818,7 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
             logging.error("Failed to parse Websocket message.")
             return '{"error":"malformed command"}'
 
-        if "request" not in json_data or "id" not in json_data:
+        if not isinstance(json_data, dict) or "request" not in json_data or "id" not in json_data:
             logging.error("Missing id or request in command")
             return '{"error":"malformed command"}'
 
@@ -519,6 +826,14 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
             logging.error("Invalid json type for request/id")
             return '{"error":"malformed json"}'
 
+        return json_data
+
+    def run_request(self, json_data: dict, conn_id: str) -> str:
+        """
+        Runs a request from parse_request.
+
+        Returns the response as a string.
+        """
         response = {}
         request = json_data["request"]
         try:
@@ -526,6 +841,10 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
                 response = self.do_subscribe(json_data, conn_id)
             elif request in ("UnSubscribe", "Unsubscribe"):
                 response = self.do_unsubscribe(json_data, conn_id)
+            elif request == "Speak":
+                response = self.cmd_speak(json_data, source=f"ws:{conn_id}")
+            elif request == "SpeakBatch":
+                response = self.cmd_speakbatch(json_data, source=f"ws:{conn_id}")
             else:
                 response = self.commands_websocket.get(request, self.cmd_stub)(self,json_data)
 
@@ -534,19 +853,54 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
             logging.debug("Responding %s", respjson)
 
             return respjson
+        except RateLimitError as e:
+            return json.dumps({
+                "id": json_data["id"],
+                "status": "error",
+                "error": str(e),
+                "code": "rate_limited",
+                "key": e.key,
+                "retryAfter": e.retry_after
+            })
         except ValueError as e:
             logging.error("Value Error in command: %s", request, exc_info=e)
             return json.dumps({"id": json_data["id"], "status": "error", "error": str(e) })
 
+    def parse_speaker_bot_websocket(self, message: str, conn_id: str) -> str:
+        """
+        Parses and runs a websocket request on the current thread.
+
+        Returns the response as a string.
+        """
+        json_data = self.parse_request(message)
+        if isinstance(json_data, str):
+            return json_data
+        return self.run_request(json_data, conn_id)
 
-    def handle_websocket(self, websocket: ServerConnection):
+    async def handle_request(self, message: str, conn_id: str) -> str:
+        """
+        Parses and runs a websocket request, on the thread pool unless it is
+        one of loop_requests.
+
+        Returns the response as a string.
+        """
+        json_data = self.parse_request(message)
+        if isinstance(json_data, str):
+            return json_data
+        if json_data["request"] in self.loop_requests or self.executor is None:
+            return self.run_request(json_data, conn_id)
+        # Events fired by the request (e.g. textqueued) are handed to the loop
+        # before the result is, so they still go out before the response.
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.run_request, json_data, conn_id)
+
+    async def handle_websocket(self, websocket: ServerConnection):
         """
         Handler for a WebSocket connection.
         """
 
         if self.shutting_down:
             # Deny any new connections.
-            websocket.close(CloseCode.GOING_AWAY)
+            await websocket.close(CloseCode.GOING_AWAY)
             return
 
         # Create an ID for self.active_connections, e.g. 127.0.0.1:45748
@@ -554,29 +908,39 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
         logging.debug("New Websocket connection: %s", conn_id)
 
         # Add it to the active connection info.
-        with self.lock:
-            if conn_id in self.active_connections:
-                logging.warning("Warning: Duplicate connection!!!")
-
-            self.active_connections[conn_id] = ConnectionInfo(websocket, {})
-
-        # Start parsing the messages until the WebSocket closes.
-        for message in websocket:
-            if not isinstance(message, str):
-                logging.warning("Received bytes instead of str, trying to decode")
-                try:
-                    message = str(message, encoding="utf-8")
-                except UnicodeDecodeError:
-                    logging.error("Unicode decode error on bytes object")
-                    websocket.send('{"error":"malformed command"}')
-                    continue
+        if conn_id in self.active_connections:
+            logging.warning("Warning: Duplicate connection!!!")
 
-            logging.info("Received WebSocket: %s", message)
-            websocket.send(self.parse_speaker_bot_websocket(str(message), conn_id))
+        conn_data = ConnectionInfo(websocket)
+        self.active_connections[conn_id] = conn_data
+        writer = asyncio.ensure_future(conn_data.write_loop())
 
-        # Delete the connection
-        with self.lock:
-            if conn_id in self.active_connections:
+        try:
+            # Start parsing the messages until the WebSocket closes.
+            async for message in websocket:
+                if not isinstance(message, str):
+                    logging.warning("Received bytes instead of str, trying to decode")
+                    try:
+                        message = str(message, encoding="utf-8")
+                    except UnicodeDecodeError:
+                        logging.error("Unicode decode error on bytes object")
+                        conn_data.send('{"error":"malformed command"}')
+                        continue
+
+                logging.info("Received WebSocket: %s", message)
+                await conn_data.wait_for_responses()
+                conn_data.send(await self.handle_request(str(message), conn_id))
+        except ConnectionClosed as e:
+            logging.debug("WebSocket connection %s closed: %s", conn_id, e)
+        finally:
+            conn_data.closing = True
+            writer.cancel()
+            if conn_data.dropped_events > 0:
+                logging.warning("Dropped %i events for %s", conn_data.dropped_events, conn_id)
+
+            # Delete the connection
+            if self.active_connections.get(conn_id) is conn_data:
+                self.index_subscriptions(conn_id, conn_data.subscription_keys(), set())
                 del self.active_connections[conn_id]
 
 
@@ -589,87 +953,100 @@ class WSServer(Thread, SpeekabooHandler, event.Observer):
         self.observe('WebsocketEvent', self.handle_event)
         self.addr = ws_addr
         self.port = ws_port
-        self.server = None
-        self.lock = Lock()
+        self.server: Server|None = None
+        self.loop: asyncio.AbstractEventLoop|None = None
+        self.executor: ThreadPoolExecutor|None = None
         self.shutting_down = False
 
         self.active_connections: dict[str, ConnectionInfo] = {}
+        self.subscribers: dict[tuple[str, str], set[str]] = {}
 
+    async def serve(self):
+        """
+        Runs the server until stop() closes it.
+        """
+        try:
+            async with serve(self.handle_websocket, self.addr, self.port, close_timeout=CLOSE_TIMEOUT) as self.server:
+                if self.shutting_down:
+                    # stop() was called while we were starting up
+                    return
+                event.info(f"Running WebSocket server at ws://{self.addr}:{self.port}.")
+                await self.server.serve_forever()
+        except OSError as err:
+            self.log_server_error(err, "ws", self.addr, self.port)
+        finally:
+            self.server = None
 
     def run(self):
         """
         Thread entry point for WSServer
         """
         if config.config["ws_server_enabled"]:
+            self.loop = asyncio.new_event_loop()
+            self.executor = ThreadPoolExecutor(WS_REQUEST_THREADS, thread_name_prefix="Websocket Request")
             try:
-                with serve(self.handle_websocket, self.addr, self.port) as self.server:
-                    event.info(f"Running WebSocket server at ws://{self.addr}:{self.port}.")
-                    self.server.serve_forever()
-            except OSError as err:
-                self.log_server_error(err, "ws", self.addr, self.port)
+                self.loop.run_until_complete(self.serve())
+            finally:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+                self.loop.close()
 
-                self.server = None
+    def close_server(self):
+        """
+        Closes all connections and stops listening. Must run on the event loop.
+        """
+        self.shutting_down = True
+        if self.server is not None:
+            if len(self.active_connections) > 0:
+                logging.debug("Waiting for connections to close...")
+                for conn_data in self.active_connections.values():
+                    asyncio.ensure_future(conn_data.disconnect(CloseCode.GOING_AWAY))
+            self.server.close()
 
     def stop(self):
         """
         Stops the WebSocket server.
         """
         logging.debug("Shutting down WSServer...")
-        if self.server is not None:
-            self.shutting_down = True
-            with self.lock:
-                if len(self.active_connections) > 0:
-                    logging.debug("Waiting for connections to close...")
-                    # Close all active connections
-                    for conn in self.active_connections.values():
-                        conn.websocket.close(CloseCode.GOING_AWAY)
-
-                self.active_connections.clear()
-
-            self.server.shutdown()
-
-            self.shutting_down = False
-            self.server = None
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self.close_server)
+            except RuntimeError:
+                # Already closed
+                pass
 
         config.join_or_die(self)
+        self.active_connections.clear()
+        self.subscribers.clear()
+        self.shutting_down = False
 
     def is_running(self) -> bool:
         return self.server is not None
 
-def parse_speaker_bot_udp(thread, message: str):
+def parse_speaker_bot_udp(thread, json_data: dict, addr: str|None = None):
     """
-    Parses a UDP request. 
+    Handles a UDP request. Decoding and parsing are done by udp_ingest.py.
     """
-    if len(message) > 10000:
-        logging.error("Ignoring overly long message of %d bytes", len(message))
-        return
-
-    json_data: dict = json.loads(message)
     request = json_data.get("command", "")
-    SpeekabooHandler.commands_udp.get(request, SpeekabooHandler.cmd_stub)(thread, json_data)
-
-udp_thread = None
+    try:
+        if request == "speak":
+            thread.cmd_speak(json_data, source=f"udp:{addr}" if addr else None)
+        elif request == "speakbatch":
+            thread.cmd_speakbatch(json_data, source=f"udp:{addr}" if addr else None)
+        else:
+            SpeekabooHandler.commands_udp.get(request, SpeekabooHandler.cmd_stub)(thread, json_data)
+    except ValueError as e:
+        logging.error("Error in UDP command %s: %s", request, e)
 
 class UDPServer(Thread, SpeekabooHandler):
 
     """
     UDP Server thread handling Speaker.bot requests.
-    """
-    class UDPHandler(socketserver.BaseRequestHandler):
-        """
-        socketserver request handler class
-        """
-        def setup(self):
-            pass
-
-        def handle(self):
-            """
-            Handles a UDP connection.
-            """
-            self.data: bytes = self.request[0].strip()
-            logging.debug("Received UDP data: %s", self.data.decode("utf-8"))
-            parse_speaker_bot_udp(udp_thread, self.data.decode("utf-8"))
 
+    This thread only receives datagrams, they are parsed and handled on
+    another thread. See udp_ingest.py.
+    """
 
     def __init__(self, udp_addr: str = config.config["udp_server_addr"], udp_port: int = config.config["udp_server_port"]):
         """
@@ -678,22 +1055,23 @@ class UDPServer(Thread, SpeekabooHandler):
         super().__init__(name="UDP Server Thread")
         self.addr = udp_addr
         self.port = udp_port
-        self.server = None
+        self.server: UDPIngest|None = None
 
     def run(self):
         """
         UDPServer thread entry point
         """
         if config.config["udp_server_enabled"]:
+            server = UDPIngest(self.addr, self.port, lambda json_data, addr: parse_speaker_bot_udp(self, json_data, addr))
             try:
-                with socketserver.UDPServer((self.addr, self.port), UDPServer.UDPHandler) as self.server: # type: ignore
-                    event.info(f"Running UDP server at udp://{self.addr}:{self.port}.")
-                    self.server.serve_forever()
-
+                server.bind()
             except OSError as err:
                 self.log_server_error(err, "udp", self.addr, self.port)
+                return
 
-                self.server = None
+            self.server = server
+            event.info(f"Running UDP server at udp://{self.addr}:{self.port}.")
+            server.serve_forever()
 
     def stop(self):
         """
@@ -701,7 +1079,7 @@ class UDPServer(Thread, SpeekabooHandler):
         """
         logging.debug("Shutting down UDPServer...")
         if self.server is not None:
-            self.server.shutdown()
+            self.server.close()
             self.server = None
 
         config.join_or_die(self)
@@ -709,6 +1087,11 @@ class UDPServer(Thread, SpeekabooHandler):
     def is_running(self) -> bool:
         return self.server is not None
 
+    def stats(self) -> dict:
+        if self.server is None:
+            return {}
+        return self.server.stats()
+
 # Global instances
 udp_thread = UDPServer()
 ws_thread = WSServer()
@@ -0,0 +1,164 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Load shedding for the speech queues.
+
+During raids the queue can grow faster than it can be spoken, and Speekaboo
+ends up minutes behind chat. When enabled, this drops messages to try to keep
+the estimated time to play everything in the queue under shed_target_delay.
+
+Strategies (run in the order listed in shed_strategies):
+ - max_age:           Drops messages that have been queued longer than shed_max_age seconds.
+                      This one always applies, even when under the target delay.
+ - collapse_similar:  Keeps only the oldest of messages with the same text (ignoring case and punctuation).
+ - drop_low_priority: Drops messages from the lowest priority lane first.
+ - drop_oldest:       Drops the oldest messages first.
+
+Messages with a priority of shed_protected_priority or higher are never dropped.
+"""
+
+import re
+import time
+import logging
+from threading import Lock
+
+import config
+from lanes import LaneQueue
+
+_lock = Lock()
+_nonword = re.compile(r"\W+")
+
+def estimate_seconds(message) -> float:
+    """
+    Estimates how long a queued message will take to play.
+    """
+    if message.duration:
+        return message.duration / 1000.0
+
+    # Not synthesized yet, use the prediction from predictor.py
+    return message.estimated_duration / 1000.0
+
+def backlog_seconds(queues: list[LaneQueue]) -> float:
+    """
+    Estimates how long it will take to play everything in the queues.
+
+    The queues need to be created with estimate_seconds as their cost function.
+    """
+    return sum(queue.total for queue in queues)
+
+def similarity_key(message) -> str:
+    return _nonword.sub(" ", message.message.casefold()).strip()
+
+def can_drop(message) -> bool:
+    return message.priority > config.config["shed_protected_priority"]
+
+def _dropped(message, reason: str):
+    logging.info("Dropping message %s: %s", message.id, reason)
+    message.tts_event("error", reason)
+
+def max_age(queues: list[LaneQueue]):
+    """
+    Drops messages that have been queued longer than shed_max_age seconds.
+
+    The oldest messages are at the front of each lane, so this only has to look
+    at the ones that are actually too old.
+    """
+    age = config.config["shed_max_age"]
+    if age <= 0:
+        return
+    now = time.monotonic()
+    for queue in queues:
+        for message in queue.remove_front(lambda m: now - m.queued_at > age, can_drop):
+            _dropped(message, "Skipped: message too old")
+
+class _Shedder:
+    """
+    Runs the strategies that only apply when over shed_target_delay. This
+    looks at every queued message, but the backlog is kept around the target
+    while shedding, so there aren't many of them.
+    """
+    def __init__(self, queues: list[LaneQueue]):
+        self.queues = queues
+        # Keyed by id() so dropping is cheap
+        self.messages = {id(message): message for queue in queues for message in queue}
+
+    def over_target(self) -> bool:
+        return over_target(self.queues)
+
+    def drop(self, message, reason: str):
+        for queue in self.queues:
+            if queue.remove(message):
+                del self.messages[id(message)]
+                _dropped(message, reason)
+                return
+
+    def collapse_similar(self):
+        seen = set()
+        for message in sorted(self.messages.values(), key=lambda m: m.queued_at):
+            if not self.over_target():
+                return
+            key = (message.voice, similarity_key(message))
+            if key in seen and can_drop(message):
+                self.drop(message, "Skipped: similar message already queued")
+            seen.add(key)
+
+    def drop_low_priority(self):
+        for message in sorted(self.messages.values(), key=lambda m: (-m.priority, m.queued_at)):
+            if not self.over_target():
+                return
+            if can_drop(message):
+                self.drop(message, "Skipped: queue is too long for low priority messages")
+
+    def drop_oldest(self):
+        for message in sorted(self.messages.values(), key=lambda m: m.queued_at):
+            if not self.over_target():
+                return
+            if can_drop(message):
+                self.drop(message, "Skipped: queue is too long")
+
+def over_target(queues: list[LaneQueue]) -> bool:
+    target = config.config["shed_target_delay"]
+    return target > 0 and backlog_seconds(queues) > target
+
+def shed(queues: list[LaneQueue]):
+    """
+    Applies the configured strategies to the queues.
+
+    This is called on every add, so it does as little as possible while the
+    backlog is under the target.
+    """
+    if not config.config["shed_enabled"]:
+        return
+
+    with _lock:
+        shedder = None
+        for strategy in config.config["shed_strategies"]:
+            if strategy == "max_age":
+                max_age(queues)
+                continue
+            if strategy not in ("collapse_similar", "drop_low_priority", "drop_oldest"):
+                logging.warning("Unknown shedding strategy %s", strategy)
+                continue
+            if not over_target(queues):
+                continue
+            if shedder is None:
+                shedder = _Shedder(queues)
+            getattr(shedder, strategy)()
@@ -0,0 +1,201 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Output sinks that can be used in place of a miniaudio.PlaybackDevice.
+
+These are meant for machines without any sound hardware (servers, CI, etc).
+Like a real device, they pull audio from the callback generator at the
+playback rate, so the playing/finished events have the same timing.
+"""
+
+import sys
+import time
+import wave
+import logging
+import threading
+from typing import Generator, BinaryIO
+
+class NullSink:
+    """
+    Discards all audio, but still consumes it in real time.
+    """
+    def __init__(self, sample_rate: int = 22050, realtime: bool = True, period_msec: int = 20):
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.period_msec = period_msec
+        self.thread: threading.Thread|None = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+
+    def start(self, callback_generator: Generator):
+        """
+        Starts consuming audio from an already started generator, like PlaybackDevice.start().
+        """
+        self.stop()
+        # Each run gets its own stop flag, so a thread that is still winding down
+        # can't be confused with the new one.
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(callback_generator, self.stop_event),
+            name="Audio Sink Thread",
+            daemon=True
+        )
+        self.thread.start()
+
+    def run(self, callback_generator: Generator, stop_event: threading.Event):
+        frames = max(1, self.sample_rate * self.period_msec // 1000)
+        deadline = time.monotonic()
+        while not stop_event.is_set():
+            try:
+                data = callback_generator.send(frames)
+            except StopIteration:
+                break
+
+            self.write(data)
+
+            if self.realtime:
+                # 16-bit mono
+                deadline += len(data) / 2 / self.sample_rate
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    stop_event.wait(delay)
+
+    def write(self, data: bytes):
+        """
+        Outputs a chunk of signed 16-bit mono audio.
+        """
+
+    def stop(self):
+        """
+        Stops consuming audio. This doesn't wait for the thread, since it may be
+        blocked on the end callback.
+        """
+        self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(1)
+        self.thread = None
+
+
+class FileSink(NullSink):
+    """
+    Writes all audio to a file. Files ending in .wav are written as a WAV file,
+    everything else is written as raw signed 16-bit mono PCM.
+    """
+    def __init__(self, path: str, sample_rate: int = 22050, realtime: bool = True, period_msec: int = 20):
+        super().__init__(sample_rate, realtime, period_msec)
+        self.path = path
+        self.file: BinaryIO|None = None
+        self.wav_file: wave.Wave_write|None = None
+        self.broken = False
+        self.closed = False
+
+    def open(self):
+        """
+        Opens the output file. This is done on the first write, since opening a named
+        pipe blocks until there is a reader.
+        """
+        self.file = open(self.path, "wb")
+        if self.path.lower().endswith(".wav"):
+            self.wav_file = wave.open(self.file, "wb")
+            self.wav_file.setnchannels(1)
+            self.wav_file.setsampwidth(2)
+            self.wav_file.setframerate(self.sample_rate)
+
+    def write(self, data: bytes):
+        with self.lock:
+            # Don't reopen the file if the writer outlived close()
+            if self.broken or self.closed:
+                return
+            try:
+                if self.file is None:
+                    self.open()
+                if self.wav_file is not None:
+                    self.wav_file.writeframesraw(data)
+                elif self.file is not None:
+                    self.file.write(data)
+                    self.file.flush()
+            except OSError as e:
+                # e.g. the reader of a pipe went away. Keep consuming audio so the queue keeps moving.
+                logging.error("Error writing audio to %s", self.path, exc_info=e)
+                self.broken = True
+
+    def close_file(self):
+        """
+        Closes the output file. Called with the lock held.
+        """
+        if self.wav_file is not None:
+            self.wav_file.close()
+        if self.file is not None:
+            self.file.close()
+
+    def close(self):
+        # Stop the writer thread first, so it can't write to (or reopen) the file
+        # while it is being closed.
+        super().close()
+        with self.lock:
+            self.closed = True
+            try:
+                self.close_file()
+            except OSError as e:
+                logging.error("Error closing %s", self.path, exc_info=e)
+            self.wav_file = None
+            self.file = None
+
+
+class PipeSink(FileSink):
+    """
+    Writes raw signed 16-bit mono PCM to a named pipe, or to stdout if the path is "-".
+    """
+    def open(self):
+        if self.path == "-":
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(self.path, "wb", buffering=0)
+
+    def close_file(self):
+        # Don't close stdout
+        if self.file is not sys.stdout.buffer:
+            super().close_file()
+
+
+def create_sink(kind: str, path: str = "", sample_rate: int = 22050, realtime: bool = True) -> NullSink:
+    """
+    Creates an output sink from the output_sink config option.
+    """
+    match kind:
+        case "null":
+            return NullSink(sample_rate, realtime)
+        case "file":
+            if not path:
+                raise ValueError("No output file was provided")
+            return FileSink(path, sample_rate, realtime)
+        case "pipe":
+            return PipeSink(path or "-", sample_rate, realtime)
+
+    raise ValueError(f"Unknown output sink {kind}")
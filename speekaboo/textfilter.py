@@ -0,0 +1,114 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+Cleans up chat text before it is queued.
+
+URLs, emote spam, repeated characters and zalgo text don't mean much when read
+out loud, but they turn into huge phoneme sequences that take a long time to
+synthesize (and the word limit doesn't catch them). This shortens them with a
+single precompiled regex, so the text is only scanned once:
+ - URLs are replaced with text_filter_url_token.
+ - More than text_filter_max_combining combining marks on a character are removed.
+ - The same word (e.g. an emote) repeated more than text_filter_max_emote_run times
+   in a row, or a run of more than that many emoji, is cut down.
+ - A character other than a digit repeated more than text_filter_max_repeat
+   times in a row is cut down.
+"""
+
+import re
+from threading import Lock
+
+import config
+
+# Combining diacritical marks, the usual zalgo material
+_COMBINING = "\u0300-\u036f\u0483-\u0489\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f"
+# Emoji and pictographs. Skin tone modifiers and joiners are part of the emoji they follow.
+_EMOJI = "\U0001f000-\U0001faff\u2600-\u27bf\u2b00-\u2bff"
+_EMOJI_EXTRA = "\u200d\ufe0f\U0001f3fb-\U0001f3ff"
+
+_lock = Lock()
+_compiled: tuple[tuple, re.Pattern]|None = None
+
+def _settings() -> tuple:
+    return (
+        config.config["text_filter_max_repeat"],
+        config.config["text_filter_max_combining"],
+        config.config["text_filter_max_emote_run"]
+    )
+
+def _compile(max_repeat: int, max_combining: int, max_emote_run: int) -> re.Pattern:
+    # URLs don't end in punctuation, so "see https://example.com, it's cool" keeps the comma
+    patterns = [r"(?P<url>\b(?:https?://|www\.)\S*[^\s.,!?;:)])"]
+    if max_combining >= 0:
+        patterns.append(f"(?P<marks>[{_COMBINING}]{{{max_combining + 1},}})")
+    if max_emote_run > 0:
+        patterns.append(fr"(?P<words>\b(?P<word>\w+)(?:\s+(?P=word)\b){{{max_emote_run},}})")
+        patterns.append(f"(?P<emoji>(?:[{_EMOJI}][{_EMOJI_EXTRA}]*\\s*){{{max_emote_run + 1},}})")
+    if max_repeat > 0:
+        # Digits are left alone, "10000 bits" shouldn't turn into "1000 bits"
+        patterns.append(fr"(?P<repeat>(?P<char>[^\d])(?P=char){{{max_repeat},}})")
+    return re.compile("|".join(patterns), re.DOTALL)
+
+def _pattern() -> re.Pattern:
+    """
+    Returns the compiled filter, recompiling it if the settings changed.
+    """
+    global _compiled # pylint:disable=global-statement
+    settings = _settings()
+    with _lock:
+        if _compiled is None or _compiled[0] != settings:
+            _compiled = (settings, _compile(*settings))
+        return _compiled[1]
+
+def _replace(match: re.Match) -> str:
+    max_repeat, max_combining, max_emote_run = _settings()
+    kind = match.lastgroup
+    if match.group("url") is not None:
+        return config.config["text_filter_url_token"]
+    if kind == "marks":
+        return match.group()[:max_combining]
+    if kind == "words":
+        word = match.group("word")
+        return " ".join([word] * max_emote_run)
+    if kind == "emoji":
+        emoji = re.findall(f"[{_EMOJI}][{_EMOJI_EXTRA}]*", match.group())
+        return "".join(emoji[:max_emote_run]) + " "
+    return match.group("char") * max_repeat
+
+def normalize(text: str) -> tuple[str, int]:
+    """
+    Filters the text if text_filter_enabled is set.
+
+    Returns the filtered text and how many characters were removed.
+    """
+    if not config.config["text_filter_enabled"]:
+        return text, 0
+    return filter_text(text)
+
+def filter_text(text: str) -> tuple[str, int]:
+    """
+    Filters the text whether or not text_filter_enabled is set.
+
+    Returns the filtered text and how many characters were removed.
+    """
+    filtered = " ".join(_pattern().sub(_replace, text).split())
+    return filtered, max(0, len(text) - len(filtered))
@@ -26,11 +26,10 @@ from pathlib import Path
 from collections import deque
 import datetime
 from datetime import timezone
-from threading import Lock, Thread, Condition
-from time import sleep
+from threading import Lock, RLock, Thread, Condition
+import time
 import uuid
 import json
-import math
 
 import numpy as np
 import onnxruntime as ort
@@ -42,8 +41,16 @@ from miniaudio import convert_frames, SampleFormat
 
 import config
 import event
+from lanes import LaneQueue, clamp_priority
+import shedding
+from predictor import predictor
+import dedup
+import adaptive_rate
+import textfilter
+from censor import censor as censor_engine
 
 from voice_manager import vm
+from aliases import CompiledAlias
 
 @dataclass
 class MessageInfo:
@@ -51,14 +58,29 @@ class MessageInfo:
     timestamp: str              # Timestamp
     voice: str                  # Voice to use
     skip: bool                  # Whether to skip this entry
-    censor: bool                # Whether to censor bad words for future use
+    censor: bool                # Whether the request asked for bad words to be censored (see censor.py)
     sender: dict                # for future additions
     id: str                     # Unique UUID
     parsed_data: bytearray|None # Parsed TTS data
     duration: float             # 
+    priority: int = 0           # Priority lane (0 = highest)
+    queued_at: float = 0.0      # time.monotonic() when the message was queued
+    estimated_duration: float = 0.0       # Predicted duration in milliseconds
+    estimated_synthesis_time: float = 0.0 # Predicted synthesis time in milliseconds
+    repeat_count: int = 1       # Number of duplicates merged into this message
+    sample_rate: int = 0        # Sample rate of parsed_data
+    play_at: float = 0.0        # time.monotonic() when the message may start playing (see queue_delay)
+    length_factor: float = 1.0  # length_scale multiplier picked by adaptive_rate.py
+    filtered_chars: int = 0     # Number of characters removed by textfilter.py
+    alias: CompiledAlias|None = None # The voice alias as it was when the message was queued
+    deduplicated: bool = False  # Whether the message is in dedup.index
+    started: bool = False       # Whether the message started playing
     def __str__(self):
         return json.dumps(self)
 
+    def is_playable(self) -> bool:
+        return time.monotonic() >= self.play_at
+
     def tts_event(self, event_type: str, speekaboo_exception: str|None = None):
         """
         Sends a WebsocketEvent with the MessageInfo filled in.
@@ -68,47 +90,196 @@ class MessageInfo:
             "timestamp": self.timestamp,
             "text": self.message,
             "duration": self.duration or 0.0,
-            "engineName": "Speekaboo Piper",
-            "voiceName": config.config["voices"][self.voice]["model_name"],
-            "pitch":0.0,
-            "volume": 1.0,
-            "rate": 0.0
+            **(self.alias.payload if self.alias is not None else _missing_alias_payload),
+            "rate": adaptive_rate.rate(self.length_factor)
         }
         if speekaboo_exception is not None:
             payload["speekaboo_exception"] = speekaboo_exception
 
+        if event_type == "textqueued":
+            payload["estimatedDuration"] = self.estimated_duration
+            payload["estimatedSynthesisTime"] = self.estimated_synthesis_time
+            if self.filtered_chars > 0:
+                payload["filteredCharacters"] = self.filtered_chars
+
+        if self.repeat_count > 1:
+            payload["repeatCount"] = self.repeat_count
+
+        if event_type == "playing":
+            self.started = True
+
+        if event_type in ("finished", "error", "deleted") and self.deduplicated:
+            dedup.index.finished(self, event_type == "finished")
+
         event.ws_event(
             "texttospeech",
             event_type,
             payload
         )
 
-_parsing_queue: queue.Queue[MessageInfo] = queue.Queue()
+_parsing_queue = LaneQueue(cost=shedding.estimate_seconds)
+
+_missing_alias_payload = {"engineName": "Speekaboo Piper", "voiceName": "", "pitch": 0.0, "volume": 1.0}
+
+def get_priority(alias: CompiledAlias|None, priority: int|None = None) -> int:
+    """
+    Gets the priority for a message, from the request, the alias, or the default.
+    """
+    if priority is None:
+        priority = alias.priority if alias is not None else config.config["default_priority"]
+    return clamp_priority(priority)
+
+def estimate(message: str, voice: str):
+    """
+    Predicts the cost of a message for an alias. See predictor.py.
+    """
+    return estimate_alias(message, vm.aliases.get(voice))
+
+def estimate_alias(message: str, alias: CompiledAlias|None):
+    """
+    Like estimate, but with an already resolved alias.
+    """
+    if alias is None:
+        return predictor.estimate("", message)
+    return predictor.estimate(alias.model_name, message, alias.length_scale)
 
-def add(message: str, voice: str, timestamp: datetime.datetime = datetime.datetime.now(), censor: bool = False):
-    message = message.strip()
+def queue_eta() -> dict:
+    """
+    Estimates how long it will take until a newly queued message starts playing, in seconds.
+    Playback and synthesis run in parallel, so whichever one is further behind wins.
+    """
+    from audio import audio
+
+    pending = list(_parsing_queue)
+    playing = audio.remaining_seconds()
+    playback = playing + shedding.backlog_seconds([audio.queue, _parsing_queue])
+    synthesis = sum(message.estimated_synthesis_time for message in pending) / 1000.0
+    return {
+        "eta": round(max(playback, synthesis, config.config["queue_delay"]), 2),
+        "playback": round(playback, 2),
+        "synthesis": round(synthesis, 2),
+        "pending": len(pending),
+        "ready": audio.num_items()
+    }
+
+# Held while queueing, so add_batch() can't be interleaved with other messages
+_add_lock = RLock()
+
+def add(message: str, voice: str, timestamp: datetime.datetime = datetime.datetime.now(), censor: bool = False,
+        priority: int|None = None, sender: str|None = None):
+    # Clean up URLs and spam before anything else looks at the text
+    message, filtered_chars = textfilter.normalize(message.strip())
     if len(message) == 0 or not config.enabled:
         return
 
+    if censor:
+        message, _count = censor_engine.censor(message)
+
     msg_id = uuid.uuid4()
+    # Resolve the alias once, so everything below sees the same one even if the table is swapped
+    alias = vm.aliases.get(voice)
+    cost = estimate_alias(message, alias)
+    now = time.monotonic()
     msgtoadd = MessageInfo(
         message = message,
         timestamp = timestamp.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"),
         voice = voice,
         skip = False,
         censor = censor,
-        sender = {},
+        sender = {"name": sender} if sender else {},
         id = str(msg_id),
         parsed_data=None,
-        duration=0.0
+        duration=0.0,
+        priority=get_priority(alias, priority),
+        queued_at=now,
+        # Synthesis starts right away, but playback waits for the moderation window.
+        play_at=now + max(0.0, config.config["queue_delay"]),
+        estimated_duration=round(cost.duration * 1000, 2),
+        estimated_synthesis_time=round(cost.synthesis_time * 1000, 2),
+        filtered_chars=filtered_chars,
+        alias=alias
     )
 
-    _parsing_queue.put(msgtoadd)
-
-    msgtoadd.tts_event("textqueued")
+    with _add_lock:
+        # Copy-paste spam, see dedup.py
+        action = config.config["dedup_action"]
+        if action in ("drop", "merge"):
+            duplicate, found = dedup.index.find(voice, message)
+            if found is not None and action == "drop":
+                logging.info("Dropping duplicate message for %s", voice)
+                return None
+            # Too late to merge into a message that is already playing, so that
+            # one is queued again
+            if found == "pending" and not duplicate.started:
+                duplicate.repeat_count += 1
+                return duplicate.id
+
+        if action != "off":
+            dedup.index.add(msgtoadd)
+            msgtoadd.deduplicated = True
+
+        _parsing_queue.put(msgtoadd, msgtoadd.priority)
+
+        msgtoadd.tts_event("textqueued")
+
+    shed()
  
     return str(msg_id)
-    
+
+def add_batch(items: list[dict]) -> list[str|None]:
+    """
+    Queues several messages at once, in order. Each item has the arguments of
+    add(). No other message can be queued in between them.
+
+    Returns the speech ids, with None for messages that ended up empty or were
+    dropped as duplicates.
+    """
+    with _add_lock:
+        return [add(**item) for item in items]
+
+def cancel(speech_id: str) -> bool:
+    """
+    Cancels a message that hasn't started playing yet, e.g. during the queue_delay
+    moderation window. If it is being synthesized, that is stopped too.
+
+    Returns False if the message wasn't found.
+    """
+    from audio import audio
+
+    for q in (_parsing_queue, audio.queue):
+        message = q.find(lambda queued: queued.id == speech_id)
+        if message is not None and q.remove(message):
+            message.tts_event("deleted")
+            return True
+
+    current = tts_thread.current
+    if current is not None and current.id == speech_id:
+        # parse_tts or the audio thread will send the deleted event
+        current.skip = True
+        tts_thread.stop_parsing()
+        return True
+    return False
+
+def shed():
+    """
+    Drops messages if the queues are too far behind. See shedding.py.
+    """
+    from audio import audio
+    shedding.shed([_parsing_queue, audio.queue])
+
+def phoneme_budget(model_name: str, length_scale: float) -> int:
+    """
+    Gets the maximum number of phonemes for a message from max_total_phonemes and
+    max_speech_seconds, or 0 for no limit.
+    """
+    budget = config.config["max_total_phonemes"]
+    max_seconds = config.config["max_speech_seconds"]
+    if max_seconds > 0:
+        seconds_per_phoneme = predictor.estimate(model_name, "", length_scale, phonemes=1).duration
+        by_seconds = max(1, int(max_seconds / seconds_per_phoneme))
+        budget = min(budget, by_seconds) if budget > 0 else by_seconds
+    return budget
+
 def set_onnx_limit(size: int):
     """ Set a limit for ONNX because if unchecked, ONNX _will_ use all your RAM """
     ort_arena_config = ort.OrtArenaCfg(size, -1, -1, -1)
@@ -152,61 +323,85 @@ class TTSThread(Thread):
         self.queue = queue.Queue()
         self.running = False
         self.interrupt = False
+        self.current: MessageInfo|None = None
 
     def parse_tts(self, message: MessageInfo):
 
         from audio import audio
 
         try:
-            if message.voice not in config.config["voices"]:
+            alias = message.alias
+            if alias is None:
                 raise ValueError(f"Invalid voice {message.voice}")
 
-            voice_info = config.config["voices"][message.voice]
-
-            if voice_info.get("model_name", "") == "":
+            if alias.model_name == "":
                 raise ValueError(f"Voice alias {message.voice} doesn't have a name assigned!")
 
-            voice_path = vm.get_voice_path(voice_info["model_name"])
+            voice_path = alias.model_path
             if voice_path is None:
-                raise ValueError(f"Cannot find voice path for {voice_info['model_name']}")
+                raise ValueError(f"Cannot find voice path for {alias.model_name}")
+
+            # Reuse the audio of an identical message instead of synthesizing it again
+            if config.config["dedup_action"] == "reuse":
+                original, _found = dedup.index.find(message.voice, message.message)
+                if original is not None and original is not message and original.parsed_data is not None \
+                        and original.sample_rate == audio.get_sample_rate():
+                    message.duration = original.duration
+                    message.sample_rate = original.sample_rate
+                    message.length_factor = original.length_factor
+                    message.tts_event("engineprocessed")
+                    return original.parsed_data
 
             voice = get_voice(voice_path)
 
             raw_pcms = []
 
-            volume = voice_info["volume"]
+            # Speak faster if the queue is falling behind
+            backlog = shedding.backlog_seconds([_parsing_queue, audio.queue]) + audio.remaining_seconds()
+            message.length_factor = adaptive_rate.length_factor(backlog)
+            length_scale = alias.length_scale * message.length_factor
 
-            num_words = len(message.message.split())
+            # Cheap check before phonemizing anything, the phonemes are checked again below
+            max_words = config.config["max_words"]
+            truncate = config.config["length_limit_action"] == "truncate"
+            if not truncate and max_words > 0 and len(message.message.split()) > max_words:
+                raise OverflowError("Text is longer than word limit")
 
-            if config.config["max_words"] > 0 and num_words > config.config["max_words"]:
+            start_time = time.perf_counter()
+            sentence_phonemes, truncated = voice.limit_phonemes(
+                voice.phonemize_sentences(message.message),
+                max_words,
+                phoneme_budget(alias.model_name, length_scale),
+                truncate=truncate
+            )
+            if sentence_phonemes is None:
                 raise OverflowError("Text is longer than word limit")
 
+            num_phonemes = sum(len(phonemes) for phonemes, _pause in sentence_phonemes)
+
             self.interrupt = False
-            for sentence in voice.synthesize_stream_raw(message.message,
-                    speaker_id=voice_info.get("speaker_id", 0),
-                    length_scale=voice_info.get("length_scale", 1.0),
-                    noise_scale=voice_info.get("noise_scale", 0.667),
-                    noise_w=voice_info.get("noise_w", 0.8),
-                    max_words=config.config["max_words"]
+            for sentence in voice.synthesize_phonemes_raw(sentence_phonemes,
+                    speaker_id=alias.speaker_id,
+                    length_scale=length_scale,
+                    noise_scale=alias.noise_scale,
+                    noise_w=alias.noise_w,
+                    trim_threshold=config.config["trim_silence_threshold"] if config.config["trim_silence"] else None,
+                    trim_padding=config.config["trim_silence_padding"]
                     ):
                 
                 if not self.running:
                     return
-                if self.interrupt:
+                if self.interrupt or message.skip:
                     raise InterruptedError("Manually stopped")
                 # Adjust the volume
-                if abs(volume - 1.0) > 0.01: # volume != 1.0
+                if abs(alias.volume - 1.0) > 0.01: # volume != 1.0
 
                     # Convert back to Signed16 (annoyingly, Piper converts from float to int16 beforehand)
                     le16 = np.dtype(np.int16).newbyteorder('<')
                     buf = np.frombuffer(sentence, le16)
 
-                    # Normalize the volume for a more natural curve
-                    # https://stackoverflow.com/a/1165188
-                    # 32 seems to feel good.
-                    normalized_vol = max(0.001, min((math.pow(32.0, volume) - 1) / (32.0 - 1), 1.0))
-                    # Multiply by the normalized volume and convert back to LE16
-                    buf = audio_float_to_int16(buf, min(32767.0 * normalized_vol, 32767.0)) # piper/util.py
+                    # Multiply by the normalized volume (see aliases.py) and convert back to LE16
+                    buf = audio_float_to_int16(buf, min(32767.0 * alias.gain, 32767.0)) # piper/util.py
                     # Convert to bytes
                     sentence = buf.tobytes()
 
@@ -226,6 +421,12 @@ class TTSThread(Thread):
 
             # Get the duration in milliseconds
             message.duration = round(len(converted) / 2 / audio.get_sample_rate() * 1000, 2)
+            message.sample_rate = audio.get_sample_rate()
+
+            # Refine the predictions for this voice. Truncated messages would throw off the phonemes per character.
+            if not truncated:
+                predictor.observe(alias.model_name, message.message, num_phonemes, length_scale,
+                                  message.duration / 1000, time.perf_counter() - start_time)
 
             # Emit an event to signal that we processed it
             message.tts_event("engineprocessed")
@@ -235,7 +436,10 @@ class TTSThread(Thread):
             message.tts_event("error", "Message too long")
             return None
         except InterruptedError:
-            message.tts_event("error", "Parsing cancelled")
+            if message.skip:
+                message.tts_event("deleted")
+            else:
+                message.tts_event("error", "Parsing cancelled")
             return None
         except Exception as e: # pylint:disable=broad-exception-caught
             logging.error("Exception in parse_tts:", exc_info=e)
@@ -262,17 +466,18 @@ class TTSThread(Thread):
         set_onnx_limit(config.config.get("onnx_memory_limit", 1024) * 1024 * 1024)
 
         while self.running:
-            while self.running and _parsing_queue.qsize() == 0:
-                sleep(0.5)
-            if self.running:
-                message = _parsing_queue.get()
-
+            shed()
+            message = _parsing_queue.get(timeout=0.5)
+            if self.running and message is not None:
+                self.current = message
                 message.parsed_data = self.parse_tts(message)
-                
-                _parsing_queue.task_done()
-                if message.parsed_data is None:
-                    continue
-                audio.push(message)
+
+                if message.parsed_data is not None:
+                    if message.skip:
+                        message.tts_event("deleted")
+                    else:
+                        audio.push(message)
+                self.current = None
 
         logging.debug("Done running TTS thread")
 
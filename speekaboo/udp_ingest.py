@@ -0,0 +1,213 @@
+# Copyright (C) 2025-2026 easyaspi314
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+UDP ingestion for the Speaker.bot UDP API.
+
+The receive thread only pulls datagrams off the socket, up to BATCH_SIZE at a
+time, and puts them in a bounded queue. A separate thread decodes, parses and
+validates them and hands them to the command handler. If the handler falls
+behind, new datagrams are dropped once udp_queue_size of them are waiting, so
+the socket buffer never backs up into the kernel dropping packets silently.
+
+Dropped, malformed and failed datagrams are counted, see stats().
+benchmarks/udp_flood.py measures how many datagrams per second get through.
+"""
+
+import json
+import socket
+import select
+import logging
+from collections import deque
+from threading import Thread, Condition
+from typing import Callable
+
+import config
+
+# Datagrams read from the socket per wakeup
+BATCH_SIZE = 64
+# Anything longer than this is rejected before decoding
+MAX_MESSAGE_SIZE = 10000
+# Ask for a bigger socket buffer to ride out bursts
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+class UDPIngest:
+    """
+    Receives JSON datagrams and passes them to handler(json_data, addr) on a
+    worker thread.
+    """
+    def __init__(self, addr: str, port: int, handler: Callable[[dict, str], None]):
+        self.addr = addr
+        self.port = port
+        self.handler = handler
+        self.sock: socket.socket|None = None
+        self.running = False
+        self.condition = Condition()
+        self.pending: deque[tuple[bytes, str]] = deque()
+        self.worker: Thread|None = None
+
+        self.received = 0
+        self.dropped = 0
+        self.malformed = 0
+        self.handled = 0    # Handled successfully
+        self.failed = 0     # The handler raised an exception
+
+    def bind(self):
+        """
+        Opens the socket. Raises OSError if the address can't be used.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        except OSError:
+            pass
+        try:
+            sock.bind((self.addr, self.port))
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.port = sock.getsockname()[1]
+        self.sock = sock
+
+    def serve_forever(self):
+        """
+        Receives datagrams until close() is called. bind() must be called first.
+        """
+        assert self.sock is not None
+        self.running = True
+        # Only publish the worker once it's started, so close() can always join it
+        worker = Thread(target=self.parse_loop, name="UDP Parse Thread", daemon=True)
+        worker.start()
+        self.worker = worker
+
+        sock = self.sock
+        while self.running:
+            try:
+                ready, _, _ = select.select([sock], [], [], 0.5)
+            except (OSError, ValueError):
+                # Closed by close()
+                break
+            if not ready:
+                continue
+
+            batch = []
+            for _ in range(BATCH_SIZE):
+                try:
+                    data, addr = sock.recvfrom(65535)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:
+                    # e.g. ICMP port unreachable on Windows
+                    logging.debug("UDP receive error: %s", e)
+                    break
+                batch.append((data, addr[0]))
+
+            if batch:
+                self.enqueue(batch)
+
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def enqueue(self, batch: list[tuple[bytes, str]]):
+        with self.condition:
+            self.received += len(batch)
+            room = max(0, config.config["udp_queue_size"] - len(self.pending))
+            if room < len(batch):
+                if self.dropped == 0:
+                    logging.warning("UDP queue full, dropping datagrams")
+                self.dropped += len(batch) - room
+                batch = batch[:room]
+            self.pending.extend(batch)
+            self.condition.notify()
+
+    def parse(self, data: bytes) -> dict|str:
+        """
+        Decodes and parses a datagram. Returns the reason if it is malformed.
+        """
+        if len(data) > MAX_MESSAGE_SIZE:
+            return f"message too long ({len(data)} bytes)"
+        try:
+            json_data = json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return "invalid JSON"
+        if not isinstance(json_data, dict):
+            return "not a JSON object"
+        return json_data
+
+    def parse_loop(self):
+        """
+        Worker thread entry point
+        """
+        while True:
+            with self.condition:
+                while not self.pending and self.running:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                # Take everything that is waiting at once
+                batch = self.pending
+                self.pending = deque()
+
+            # Logging every datagram is slow enough to matter in a flood, so
+            # only do it in debug mode.
+            for data, addr in batch:
+                json_data = self.parse(data)
+                if isinstance(json_data, str):
+                    if self.malformed == 0 or config.debug:
+                        logging.error("Ignoring malformed UDP message from %s: %s", addr, json_data)
+                    self.malformed += 1
+                    continue
+                if config.debug:
+                    logging.debug("Received UDP data from %s: %s", addr, json_data)
+                try:
+                    self.handler(json_data, addr)
+                except Exception as e: # pylint:disable=broad-exception-caught
+                    logging.error("Error handling UDP message", exc_info=e)
+                    self.failed += 1
+                else:
+                    self.handled += 1
+
+    def close(self):
+        """
+        Stops receiving. Datagrams that were already queued are still handled.
+        """
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        with self.condition:
+            self.condition.notify_all()
+        if self.worker is not None:
+            self.worker.join(5)
+            self.worker = None
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "received": self.received,
+                "dropped": self.dropped,
+                "malformed": self.malformed,
+                "handled": self.handled,
+                "failed": self.failed,
+                "depth": len(self.pending)
+            }
@@ -21,79 +21,191 @@
 """
 Manages installed Piper voices.
 
+Downloads run on a small thread pool (max_concurrent_downloads) and report
+their progress with download_progress events. Large files are fetched in
+download_connections byte ranges at once.
+
 TODO:
  - Allow adding custom voices
- - Do the downloads myself so we can have progress bars and such
- - Put on its own thread
 """
 
+import os
 import time
+from dataclasses import dataclass
 from pathlib import Path
 import logging
 import threading
 import uuid
 import json
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from piper import download as PiperDownloader
+from piper.config import PiperConfig
 
 import event
 import config
+from aliases import AliasTable
+
+@dataclass(frozen=True)
+class InstalledVoice:
+    name: str
+    model_path: Path
+    config_path: Path
+    size: int       # Size of the model and config in bytes
+    manual: bool    # Whether it's from additional_voices
+
+class InstalledCatalog:
+    """
+    Index of the installed voice models.
+
+    The data folder is scanned once, and only scanned again when its mtime changes
+    (adding or removing files updates it) or the additional voices change. That
+    is checked at most once every CHECK_INTERVAL seconds, so looking up a voice
+    is usually just a dict lookup.
+    """
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self.voices: dict[str, InstalledVoice] = {}
+        self.manual: dict[str, InstalledVoice] = {}
+        self.signature: tuple|None = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _signature(self) -> tuple:
+        try:
+            mtime = os.stat(config.data_folder).st_mtime_ns if config.data_folder is not None else None
+        except OSError:
+            mtime = None
+        return (mtime, tuple(sorted(config.config["additional_voices"].items())))
+
+    @staticmethod
+    def _entry(name: str, model_path: Path, config_path: Path, manual: bool) -> InstalledVoice|None:
+        try:
+            size = model_path.stat().st_size + config_path.stat().st_size
+        except OSError:
+            return None
+        return InstalledVoice(name, model_path, config_path, size, manual)
+
+    def _scan(self):
+        voices = {}
+        if config.data_folder is not None:
+            try:
+                with os.scandir(config.data_folder) as entries:
+                    files = {entry.name for entry in entries if entry.is_file()}
+            except OSError as e:
+                logging.error("Error scanning %s: %s", config.data_folder, e)
+                files = set()
+
+            for file in files:
+                if file.endswith(".onnx") and file + ".json" in files:
+                    name = file[:-len(".onnx")]
+                    entry = self._entry(name, config.data_folder / file, config.data_folder / (file + ".json"), False)
+                    if entry is not None:
+                        voices[name] = entry
+
+        manual = {}
+        for name, file in config.config["additional_voices"].items():
+            entry = self._entry(name, Path(file), Path(file + ".json"), True)
+            if entry is not None:
+                manual[name] = entry
+
+        self.voices = voices
+        self.manual = manual
+
+    def refresh(self, force: bool = False):
+        """
+        Scans again if anything changed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.checked_at < self.CHECK_INTERVAL:
+                return
+            self.checked_at = now
+            signature = self._signature()
+            if force or signature != self.signature:
+                self.signature = signature
+                self._scan()
+
+    def invalidate(self):
+        """
+        Forces a scan on the next lookup.
+        """
+        with self.lock:
+            self.signature = None
+            self.checked_at = 0.0
+
+    def get(self, name: str) -> InstalledVoice|None:
+        """
+        Finds an installed voice. Additional voices come first.
+        """
+        self.refresh()
+        return self.manual.get(name) or self.voices.get(name)
+
+    def get_downloaded(self, name: str) -> InstalledVoice|None:
+        self.refresh()
+        return self.voices.get(name)
+
+    def all(self) -> list[InstalledVoice]:
+        self.refresh()
+        return [*self.voices.values(), *self.manual.values()]
+
 class VoiceManager:
     def __init__(self):
         if config.data_folder is None:
             raise FileNotFoundError("No data folder found!")
 
-        self.voices = PiperDownloader.get_voices(config.data_folder, False)
+        self.catalog = PiperDownloader.get_voice_catalog(config.data_folder, False)
+        self.voices = self.catalog.voices
         self.language = config.config["voice_language"]
-        self.threads: dict[str, threading.Thread] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, config.config["max_concurrent_downloads"]),
+            thread_name_prefix="Download Thread"
+        )
+        self.downloads: dict[str, Future] = {}
+        self.installed = InstalledCatalog()
+        self.aliases = AliasTable(self.get_voice_path)
+        self.aliases.rebuild()
 
 
     # wait for cleanup
     def wait_for_downloads(self):
-        notified = False
-        for thread in self.threads.values():
-            if thread.is_alive():
-                if not notified:
-                    notified = True
-                    logging.info("Waiting for downloads to complete...")
-                thread.join()
-        self.threads.clear()
+        if any(not future.done() for future in self.downloads.values()):
+            logging.info("Waiting for downloads to complete...")
+        self.executor.shutdown(wait=True)
+        self.downloads.clear()
+
+    @staticmethod
+    def url_format() -> str:
+        """
+        URL format for voice files, from voice_mirror_url.
+        """
+        return config.config["voice_mirror_url"].rstrip("/") + "/{file}"
 
     def get_downloadable_voices(self):
         return self.voices
+
+    def get_voice_catalog(self) -> PiperDownloader.VoiceCatalog:
+        return self.catalog
         
     def get_voice_path(self, voice: str):
-        
-        if voice in config.config["additional_voices"]:
-            file = config.config["additional_voices"][voice]
-            if Path(file).exists() and Path(file + ".json").exists():
-                return Path(file)
-        
-        if config.data_folder is None:
-            return None
-
-        try:
-            path = PiperDownloader.find_voice(voice, [config.data_folder])
-            return path[0]
-        except (IOError, ValueError):
-            return None
+        entry = self.installed.get(voice)
+        return entry.model_path if entry is not None else None
     
     def update_voice_list_thread(self):
         try:
-            self.voices = PiperDownloader.get_voices(config.data_folder, True)
-            event.voices_changed(None, False)
-        except IOError:
-            pass
+            catalog = PiperDownloader.get_voice_catalog(config.data_folder, True, self.url_format())
+            if catalog is not self.catalog:
+                self.catalog = catalog
+                self.voices = self.catalog.voices
+                event.voices_changed(None, False)
+        except (IOError, ValueError) as e:
+            logging.error("Failed to download voice list: %s", e)
 
     def update_voice_list(self):
-        try:
-            self.threads["VOICE_LIST"] = threading.Thread(
-                target=self.update_voice_list_thread,
-                name="Download Thread [voice list]"
-            )
-            self.threads["VOICE_LIST"].start()
-        except IOError:
-            logging.error("Failed to download voice list")
+        if "VOICE_LIST" in self.downloads and not self.downloads["VOICE_LIST"].done():
+            return
+        self.downloads["VOICE_LIST"] = self.executor.submit(self.update_voice_list_thread)
 
 
 
@@ -101,31 +213,36 @@ class VoiceManager:
         return self.get_voice_path(voice) is not None
     
     def get_voice_size(self, voice: str) -> int:
-        size = 0
-        for i in self.voices[voice]["files"]:
-            size += self.voices[voice]["files"][i]["size_bytes"]
-
-        return size
+        return self.catalog.sizes[voice]
 
     def print_all_voices(self):
         for voice in self.voices:
             print(voice)
 
     def print_all_voices_lang(self, lang: str):
-        for voice in self.voices:
-            if self.voices[voice]["language"]["code"] == lang:
-                try:
-                    PiperDownloader.find_voice(voice, [config.data_folder])
-                    print("Installed: ", end="")
-                except ValueError:
-                    pass
-                print(voice)
+        for voice in self.catalog.by_language.get(lang, []):
+            if self.installed.get_downloaded(voice) is not None:
+                print("Installed: ", end="")
+            print(voice)
 
     def download_thread(self, voice: str):
         result = False
+        last_percent: dict[str, int] = {}
+
+        def progress(file: str, done: int, total: int):
+            # Only send an event when the percentage changes
+            percent = done * 100 // total if total > 0 else 0
+            if last_percent.get(file) != percent:
+                last_percent[file] = percent
+                event.download_progress(voice, file, done, total)
+
         try:
-            PiperDownloader.ensure_voice_exists(voice, [config.data_folder], config.data_folder, self.voices)
+            PiperDownloader.ensure_voice_exists(voice, [config.data_folder], config.data_folder, self.catalog,
+                                                url_format=self.url_format(), progress=progress,
+                                                force_verify=config.config["force_verify_voices"],
+                                                connections=config.config["download_connections"])
             result = True
+            self.installed.invalidate()
             event.voices_changed(voice, True)
             logging.info("Done downloading %s with result %s", voice, result)
         except Exception as e: # pylint: disable=broad-except
@@ -135,69 +252,48 @@ class VoiceManager:
 
     def install_voice(self, voice: str) -> None:
         """
-        Installs a voice on a separate thread
+        Installs a voice on the download thread pool
         """
         if self.is_voice_installed(voice):
             return
 
-        if voice in self.threads and self.threads[voice].is_alive():
+        if voice in self.downloads and not self.downloads[voice].done():
             # be patient!!
             return
 
-        self.threads[voice] = threading.Thread(
-            target=self.download_thread,
-            args=[voice],
-            name=f"Download Thread [{voice}]"
-        )
-        self.threads[voice].start()
+        self.downloads[voice] = self.executor.submit(self.download_thread, voice)
     
     def get_all_installed_voices(self):
-        if config.data_folder is None:
-            return
+        for entry in self.installed.all():
+            yield (entry.name, entry.model_path)
 
-        for file in config.data_folder.rglob("*.onnx"):
-            name = Path(file).stem
-            if self.is_voice_installed(name):
-                yield (name, file)
-
-        for voice in config.config["additional_voices"]:
-            file = config.config["additional_voices"][voice]
-            if Path(file).exists() and Path(file + ".json").exists():
-                
-                yield (voice, Path(file))
-
-    def get_voice_config(self, voice: str) -> dict | None:
-        filename = None
-        if voice in config.config["additional_voices"]:
-            file = config.config["additional_voices"][voice]
-            if Path(file).exists() and Path(file + ".json").exists():
-                filename = file + ".json"
-
-        if filename is None:
-            try:
-                _onnx_path, config_path = PiperDownloader.find_voice(voice, [config.data_folder])
-                filename = config_path
-            except ValueError:
-                return None
+    def get_voice_config(self, voice: str) -> PiperConfig | None:
+        """
+        Gets the config of an installed voice. This is cached, see PiperConfig.from_file.
+        """
+        entry = self.installed.get(voice)
+        if entry is None:
+            return None
+        filename = entry.config_path
         try:
-            with open(filename, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return PiperConfig.from_file(filename)
         except IOError as e:
             logging.error("IO Error opening %s.", filename, exc_info=e)
             return None
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, KeyError, ValueError) as e:
             logging.error("JSON Error opening %s", filename, exc_info=e)
             return None
 
 
     def uninstall_voice(self, voice: str):
-        if config.data_folder is None:
+        entry = self.installed.get_downloaded(voice)
+        if entry is None:
             return
 
         try:
-            onnx_path, config_path = PiperDownloader.find_voice(voice, [config.data_folder])
-            Path(onnx_path).unlink()
-            Path(config_path).unlink()
+            entry.model_path.unlink()
+            entry.config_path.unlink()
+            self.installed.invalidate()
             event.voices_changed(voice, False)
         except IOError as e:
             logging.info("error", exc_info=e)
@@ -207,6 +303,7 @@ class VoiceManager:
         if Path(voice_path).exists() and Path(voice_path + ".json").exists():
             voice = Path(voice_path).stem
             config.config["additional_voices"][voice] = voice_path
+            self.installed.invalidate()
             event.voices_changed(voice, True)
 
         else:
@@ -215,6 +312,7 @@ class VoiceManager:
     def deregister_voice(self, voice: str):
         if voice in config.config["additional_voices"]:
             del config.config["additional_voices"][voice]
+            self.installed.invalidate()
             event.voices_changed(voice, False)
 
     def get_used_aliases(self, voice: str) -> list[str]:
@@ -226,7 +324,7 @@ class VoiceManager:
     
     def update_alias(self, name: str, voice: str = "", speaker: int|None = None, noise_scale: float|None = None,
                      length_scale: float|None = None, noise_w: float|None = None, sentence_pause: float|None = None, pitch: float|None = None,
-                     volume: float|None = None):
+                     volume: float|None = None, priority: int|None = None):
 
         if not name in config.config["voices"]:
             if voice is None:
@@ -241,6 +339,7 @@ class VoiceManager:
                 "sentence_pause": sentence_pause if sentence_pause is not None else 0.2, 
                 "pitch": pitch if pitch is not None else 1.0,
                 "volume": volume if volume is not None else 1.0,
+                "priority": priority if priority is not None else config.config["default_priority"],
                 "uuid": str(uuid.uuid4())
             }
         else:
@@ -269,4 +368,23 @@ class VoiceManager:
             if pitch is not None:
                 config.config["voices"][name]["pitch"] = pitch
 
+            if priority is not None:
+                config.config["voices"][name]["priority"] = priority
+
+        self.aliases.rebuild()
+
+    def remove_alias(self, name: str):
+        """
+        Removes an alias. Messages that are already queued keep using it.
+        """
+        if name in config.config["voices"]:
+            del config.config["voices"][name]
+            self.aliases.rebuild()
+
+    def rename_alias(self, name: str, new_name: str):
+        if new_name in config.config["voices"]:
+            raise ValueError(f"Voice alias {new_name} already exists")
+        config.config["voices"][new_name] = config.config["voices"].pop(name)
+        self.aliases.rebuild()
+
 vm = VoiceManager()
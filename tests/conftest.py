@@ -0,0 +1,18 @@
+"""
+Shared setup for the tests.
+
+The modules in speekaboo/ import each other by their plain names, so the
+package folder goes on sys.path. The config and data folders are pointed at a
+temporary folder so the tests don't touch the real ones.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp(prefix="speekaboo-tests-")
+os.environ["XDG_CONFIG_HOME"] = os.path.join(_tmp, "config")
+os.environ["XDG_DATA_HOME"] = os.path.join(_tmp, "data")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "speekaboo"))
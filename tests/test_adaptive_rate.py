@@ -0,0 +1,27 @@
+import pytest
+
+import config
+from adaptive_rate import length_factor, rate
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setitem(config.config, "adaptive_rate_enabled", True)
+    monkeypatch.setitem(config.config, "adaptive_rate_start", 10.0)
+    monkeypatch.setitem(config.config, "adaptive_rate_full", 30.0)
+    monkeypatch.setitem(config.config, "adaptive_rate_min_scale", 0.6)
+
+@pytest.mark.parametrize("backlog,factor", [(0.0, 1.0), (10.0, 1.0), (20.0, 0.8), (30.0, 0.6), (1000.0, 0.6)])
+def test_length_factor(backlog, factor):
+    assert length_factor(backlog) == pytest.approx(factor)
+
+def test_disabled(monkeypatch):
+    monkeypatch.setitem(config.config, "adaptive_rate_enabled", False)
+    assert length_factor(1000.0) == 1.0
+
+def test_min_scale_is_clamped(monkeypatch):
+    monkeypatch.setitem(config.config, "adaptive_rate_min_scale", 0.0)
+    assert length_factor(1000.0) == pytest.approx(0.1)
+
+def test_rate():
+    assert rate(1.0) == 0.0
+    assert rate(0.8) == 0.25
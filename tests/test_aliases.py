@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+
+import config
+from aliases import AliasTable
+from voice_manager import vm
+
+@pytest.fixture
+def voices(monkeypatch):
+    voices = {
+        "EventVoice": {"model_name": "en_US-lessac-medium", "length_scale": 1.5, "priority": 2},
+        "Broken": {"model_name": "en_US-lessac-medium", "length_scale": "fast"},
+    }
+    monkeypatch.setitem(config.config, "voices", voices)
+    yield voices
+    # Put vm.aliases back to the real config
+    monkeypatch.undo()
+    vm.aliases.rebuild()
+
+def resolve(model_name: str) -> Path:
+    return Path("/voices") / f"{model_name}.onnx"
+
+def test_compile(voices):
+    table = AliasTable(resolve)
+    table.rebuild()
+    alias = table.get("EventVoice")
+    assert alias.model_path == Path("/voices/en_US-lessac-medium.onnx")
+    assert alias.length_scale == 1.5
+    assert alias.priority == 2
+    # Invalid aliases are left out instead of breaking the whole table
+    assert table.get("Broken") is None
+    with pytest.raises(AttributeError):
+        alias.length_scale = 1.0
+
+def test_swap_keeps_old_snapshots(voices):
+    table = AliasTable(resolve)
+    table.rebuild()
+    before = table.get("EventVoice")
+
+    voices["EventVoice"]["length_scale"] = 0.5
+    del voices["Broken"]
+    table.rebuild()
+
+    assert before.length_scale == 1.5
+    assert table.get("EventVoice").length_scale == 0.5
+
+def test_rename(voices):
+    vm.aliases.rebuild()
+    old = vm.aliases.get("EventVoice")
+    vm.rename_alias("EventVoice", "Renamed")
+    assert vm.aliases.get("EventVoice") is None
+    assert vm.aliases.get("Renamed").length_scale == 1.5
+    assert old.name == "EventVoice"
+    with pytest.raises(ValueError):
+        vm.rename_alias("Renamed", "Broken")
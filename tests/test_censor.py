@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import config
+from censor import Automaton, Censor
+
+def test_whole_words_only():
+    automaton = Automaton.build(["heck"])
+    assert automaton.find("heck, what the heck") == [(0, 4), (15, 19)]
+    assert automaton.find("checked hecking") == []
+
+def test_prefix_words():
+    automaton = Automaton.build(["heck*"])
+    assert automaton.find("hecking heck check") == [(0, 7), (8, 12)]
+
+def test_case_and_leetspeak():
+    automaton = Automaton.build(["hack"])
+    assert automaton.find("H4CK h@ck") == [(0, 4), (5, 9)]
+
+def test_overlapping_words_are_merged():
+    automaton = Automaton.build(["darn it", "it all"])
+    assert automaton.find("darn it all") == [(0, 11)]
+
+def test_json_round_trip():
+    automaton = Automaton.build(["heck*", "darn"])
+    loaded = Automaton.from_json(json.loads(json.dumps(automaton.to_json())))
+    assert loaded.find("hecking darn") == automaton.find("hecking darn")
+
+@pytest.fixture
+def wordlist(tmp_path, monkeypatch):
+    path = tmp_path / "wordlist.txt"
+    path.write_text("# comment\nheck*\n\ndarn\n", encoding="utf-8")
+    monkeypatch.setattr(config, "config_folder", tmp_path)
+    monkeypatch.setitem(config.config, "censor_wordlist", "")
+    monkeypatch.setitem(config.config, "text_replacement", "beep")
+    return path
+
+def test_censor(wordlist):
+    assert Censor().censor("Heck, darn it. # comment") == ("beep, beep it. # comment", 2)
+
+def test_censor_uses_cache(wordlist):
+    Censor().censor("heck")
+    cache_path = wordlist.parent / "censor_cache.json"
+    cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    # Make the cached automaton differ from the word list to see which one is used
+    cached |= Automaton.build(["nope"]).to_json()
+    cache_path.write_text(json.dumps(cached), encoding="utf-8")
+    assert Censor().censor("heck nope") == ("heck beep", 1)
+
+def test_censor_reloads_changed_list(wordlist, monkeypatch):
+    censor = Censor()
+    assert censor.censor("darn gosh") == ("beep gosh", 1)
+    wordlist.write_text("gosh darn it\n", encoding="utf-8")
+    # Not checked again right away
+    assert censor.censor("darn gosh") == ("beep gosh", 1)
+    monkeypatch.setattr("censor.CHECK_INTERVAL", 0.0)
+    assert censor.censor("darn gosh") == ("darn gosh", 0)
+
+def test_no_wordlist(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "config_folder", tmp_path)
+    monkeypatch.setitem(config.config, "censor_wordlist", "")
+    assert Censor().censor("heck") == ("heck", 0)
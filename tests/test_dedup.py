@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+
+import pytest
+
+import config
+from dedup import DuplicateIndex
+
+@dataclass(eq=False)
+class Message:
+    voice: str
+    message: str
+    parsed_data: bytearray|None = None
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setitem(config.config, "dedup_action", "merge")
+    monkeypatch.setitem(config.config, "dedup_window", 60.0)
+    monkeypatch.setitem(config.config, "dedup_recent_count", 2)
+
+def test_pending_ignores_case_and_whitespace():
+    index = DuplicateIndex()
+    message = Message("EventVoice", "Hello  World")
+    index.add(message)
+    assert index.find("EventVoice", "hello world") == (message, "pending")
+    assert index.find("OtherVoice", "hello world") == (None, None)
+
+def test_played_messages_are_recent_without_audio():
+    index = DuplicateIndex()
+    message = Message("EventVoice", "hi", bytearray(1000))
+    index.add(message)
+    index.finished(message, True)
+    # Still counts as a duplicate, but the audio isn't kept around
+    assert index.find("EventVoice", "hi") == (None, "recent")
+
+def test_reuse_keeps_audio(monkeypatch):
+    monkeypatch.setitem(config.config, "dedup_action", "reuse")
+    index = DuplicateIndex()
+    message = Message("EventVoice", "hi", bytearray(1000))
+    index.add(message)
+    index.finished(message, True)
+    assert index.find("EventVoice", "hi") == (message, "recent")
+
+def test_skipped_messages_are_forgotten():
+    index = DuplicateIndex()
+    message = Message("EventVoice", "hi")
+    index.add(message)
+    index.finished(message, False)
+    assert index.find("EventVoice", "hi") == (None, None)
+
+def test_recent_count_limit():
+    index = DuplicateIndex()
+    for text in ["a", "b", "c"]:
+        message = Message("EventVoice", text, bytearray(1))
+        index.add(message)
+        index.finished(message, True)
+    assert index.find("EventVoice", "a") == (None, None)
+    assert index.find("EventVoice", "c") == (None, "recent")
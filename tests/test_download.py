@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from piper import download
+from piper.download import download_file, update_voices_json
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.files: dict[str, bytes] = {}
+        self.ranges = True
+        self.gzip = False
+        self.etag = ""
+        self.requests: list[dict[str, str]] = []
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/{name}"
+
+class FileHandler(BaseHTTPRequestHandler):
+    server: FileServer
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+
+        if self.server.etag and self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match is None or not self.server.ranges:
+            self.send_response(200)
+            if self.server.etag:
+                self.send_header("ETag", self.server.etag)
+            if self.server.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+                data = gzip.compress(data)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        start = int(match[1])
+        end = int(match[2]) + 1 if match[2] else len(data)
+        if start >= len(data):
+            self.send_error(416)
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        self.wfile.write(data[start:end])
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+DATA = bytes(range(256)) * 4096 # 1 MiB
+
+def test_download(server, tmp_path):
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest())
+    assert path.read_bytes() == DATA
+    assert not (tmp_path / "voice.onnx.part").exists()
+
+def test_resume(server, tmp_path):
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    (tmp_path / "voice.onnx.part").write_bytes(DATA[:1000])
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest())
+    assert path.read_bytes() == DATA
+    assert server.requests[-1]["Range"] == "bytes=1000-"
+
+def test_resume_without_range_support(server, tmp_path):
+    server.files["voice.onnx"] = DATA
+    server.ranges = False
+    path = tmp_path / "voice.onnx"
+    (tmp_path / "voice.onnx.part").write_bytes(b"x" * 1000)
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest())
+    assert path.read_bytes() == DATA
+
+def test_complete_part_file(server, tmp_path):
+    # The server answers 416 when the .part file already has everything
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    (tmp_path / "voice.onnx.part").write_bytes(DATA)
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest())
+    assert path.read_bytes() == DATA
+
+def test_md5_mismatch(server, tmp_path):
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    with pytest.raises(IOError, match="Wrong hash"):
+        download_file(server.url("voice.onnx"), path, len(DATA), "0" * 32)
+    assert not path.exists()
+    assert not (tmp_path / "voice.onnx.part").exists()
+
+@pytest.fixture
+def ranged(monkeypatch):
+    monkeypatch.setattr(download, "_MIN_RANGED_SIZE", 1)
+    monkeypatch.setattr(download, "_CHUNK_SIZE", 64 * 1024)
+
+def test_parallel_ranges(server, tmp_path, ranged):
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    progress = []
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest(),
+                  progress=lambda done, total: progress.append((done, total)), connections=4)
+    assert path.read_bytes() == DATA
+    assert sorted(request["Range"] for request in server.requests) == [
+        "bytes=0-262143", "bytes=262144-524287", "bytes=524288-786431", "bytes=786432-1048575"
+    ]
+    assert progress[-1] == (len(DATA), len(DATA))
+    assert not (tmp_path / "voice.onnx.part.ranges").exists()
+
+def test_parallel_ranges_resume(server, tmp_path, ranged):
+    server.files["voice.onnx"] = DATA
+    path = tmp_path / "voice.onnx"
+    part = bytearray(len(DATA))
+    part[:1000] = DATA[:1000]
+    (tmp_path / "voice.onnx.part").write_bytes(part)
+    (tmp_path / "voice.onnx.part.ranges").write_text(
+        f'{{"size": {len(DATA)}, "ranges": [[0, 1000, 524288], [524288, 1048576, 1048576]]}}')
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA[:524288] + bytes(524288)).hexdigest(),
+                  connections=2)
+    # Only the unfinished part of the first range is downloaded again
+    assert [request["Range"] for request in server.requests] == ["bytes=1000-524287"]
+
+def test_parallel_ranges_without_range_support(server, tmp_path, ranged):
+    server.files["voice.onnx"] = DATA
+    server.ranges = False
+    path = tmp_path / "voice.onnx"
+    download_file(server.url("voice.onnx"), path, len(DATA), hashlib.md5(DATA).hexdigest(), connections=4)
+    assert path.read_bytes() == DATA
+
+VOICES = json.dumps({"en_US-lessac-medium": {"files": {}}}).encode()
+
+def test_update_voices_json(server, tmp_path):
+    server.files["voices.json"] = VOICES
+    server.etag = '"v1"'
+    server.gzip = True
+    path = tmp_path / "voices.json"
+
+    assert update_voices_json(server.url("voices.json"), path)
+    assert path.read_bytes() == VOICES
+    assert "If-None-Match" not in server.requests[-1]
+
+    # Not modified
+    mtime = path.stat().st_mtime_ns
+    assert not update_voices_json(server.url("voices.json"), path)
+    assert server.requests[-1]["If-None-Match"] == '"v1"'
+    assert path.stat().st_mtime_ns == mtime
+
+    # Changed
+    server.files["voices.json"] = VOICES.replace(b"lessac", b"amy")
+    server.etag = '"v2"'
+    assert update_voices_json(server.url("voices.json"), path)
+    assert b"amy" in path.read_bytes()
+
+def test_update_voices_json_without_meta(server, tmp_path):
+    # Without the .meta file, nothing is sent to compare against
+    server.files["voices.json"] = VOICES
+    server.etag = '"v1"'
+    path = tmp_path / "voices.json"
+    assert update_voices_json(server.url("voices.json"), path)
+    (tmp_path / "voices.json.meta").unlink()
+    assert not update_voices_json(server.url("voices.json"), path)
+    assert "If-None-Match" not in server.requests[-1]
+
+def test_update_voices_json_keeps_old_file_on_bad_json(server, tmp_path):
+    server.files["voices.json"] = b"{not json"
+    path = tmp_path / "voices.json"
+    path.write_bytes(VOICES)
+    with pytest.raises(ValueError):
+        update_voices_json(server.url("voices.json"), path)
+    assert path.read_bytes() == VOICES
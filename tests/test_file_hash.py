@@ -0,0 +1,20 @@
+import hashlib
+
+import pytest
+
+from piper.file_hash import ALGORITHMS, get_cached_file_hash, get_file_hash
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_every_algorithm_choice_works(tmp_path, algorithm):
+    path = tmp_path / "voice.onnx"
+    path.write_bytes(b"hello")
+    assert get_file_hash(path, algorithm=algorithm) == hashlib.new(algorithm, b"hello").hexdigest()
+
+def test_cached_hash_is_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / "voice.onnx"
+    path.write_bytes(b"hello")
+    assert get_cached_file_hash(path) == hashlib.md5(b"hello").hexdigest()
+    assert (tmp_path / ".file_hashes.json").is_file()
+
+    path.write_bytes(b"goodbye!")
+    assert get_cached_file_hash(path) == hashlib.md5(b"goodbye!").hexdigest()
@@ -0,0 +1,79 @@
+import pytest
+
+import config
+from lanes import LaneQueue
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setitem(config.config, "priority_weights", [8, 4, 2, 1])
+    monkeypatch.setitem(config.config, "priority_max_wait", 0)
+
+def drain(queue: LaneQueue) -> list:
+    items = []
+    while (item := queue.pop()) is not None:
+        items.append(item)
+    return items
+
+def test_fifo_within_a_lane():
+    queue = LaneQueue()
+    for i in range(5):
+        queue.put(i, 2)
+    assert drain(queue) == [0, 1, 2, 3, 4]
+
+def test_weighted_fairness():
+    queue = LaneQueue()
+    for i in range(40):
+        queue.put(("high", i), 0)
+        queue.put(("low", i), 3)
+    first = [item[0] for item in drain(queue)[:18]]
+    # 8 turns for lane 0 for every turn of lane 3, but lane 3 still moves
+    assert first.count("low") == 2
+    assert first.count("high") == 16
+
+def test_priority_is_clamped():
+    queue = LaneQueue()
+    queue.put("a", 99)
+    queue.put("b", -5)
+    assert [stat["depth"] for stat in queue.stats()] == [1, 0, 0, 1]
+
+def test_ready_skips_items_that_are_not_ready():
+    queue = LaneQueue()
+    queue.put("later", 0)
+    queue.put("now", 1)
+    assert queue.peek(ready=lambda item: item != "later") == "now"
+    assert queue.pop(ready=lambda item: item != "later") == "now"
+    assert queue.pop(ready=lambda item: item != "later") is None
+    assert queue.pop() == "later"
+
+def test_remove_find_and_clear():
+    queue = LaneQueue()
+    items = [object() for _ in range(3)]
+    for item in items:
+        queue.put(item, 1)
+    assert queue.find(lambda item: item is items[1]) is items[1]
+    assert queue.remove(items[1])
+    assert not queue.remove(items[1])
+    assert queue.clear() == [items[0], items[2]]
+    assert len(queue) == 0
+
+def test_running_total():
+    queue = LaneQueue(cost=float)
+    for value, lane in [(1, 0), (2, 1), (3, 1), (4, 3)]:
+        queue.put(value, lane)
+    assert queue.total == 10
+    queue.remove(3)
+    assert queue.total == 7
+    queue.pop()
+    assert queue.total == 6
+    queue.clear()
+    assert queue.total == 0
+
+def test_remove_front():
+    queue = LaneQueue(cost=float)
+    for value in [1, 2, 3, 10, 4]:
+        queue.put(value, 2)
+    # 2 is old but can't be removed, so it is kept in place
+    removed = queue.remove_front(lambda value: value < 5, lambda value: value != 2)
+    assert removed == [1, 3]
+    assert list(queue) == [2, 10, 4]
+    assert queue.total == 16
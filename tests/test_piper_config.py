@@ -0,0 +1,28 @@
+import json
+import os
+
+from piper.config import PhonemeType, PiperConfig
+
+def write_config(path, sample_rate: int):
+    path.write_text(json.dumps({
+        "audio": {"sample_rate": sample_rate},
+        "espeak": {"voice": "en-us"},
+        "inference": {"noise_scale": 0.667, "length_scale": 1, "noise_w": 0.8},
+        "num_symbols": 3,
+        "num_speakers": 1,
+        "phoneme_id_map": {"_": [0], "^": [1], "$": [2]},
+    }), encoding="utf-8")
+
+def test_from_file_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "voice.onnx.json"
+    write_config(path, 22050)
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+
+    config = PiperConfig.from_file(path)
+    assert config.sample_rate == 22050
+    assert config.phoneme_type == PhonemeType.ESPEAK
+    assert PiperConfig.from_file(str(path)) is config
+
+    write_config(path, 16000)
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert PiperConfig.from_file(path).sample_rate == 16000
@@ -0,0 +1,38 @@
+import pytest
+
+from predictor import Predictor
+
+def test_defaults():
+    estimate = Predictor().estimate("en_US-lessac-medium", "x" * 100, length_scale=2.0)
+    assert estimate.phonemes == 100
+    assert estimate.duration == pytest.approx(100 * 0.07 * 2.0)
+    assert estimate.synthesis_time == pytest.approx(100 * 0.005)
+
+def test_known_phoneme_count():
+    assert Predictor().estimate("en_US-lessac-medium", "", phonemes=10).phonemes == 10
+
+def test_first_observation_replaces_the_defaults():
+    predictor = Predictor()
+    predictor.observe("en_US-lessac-medium", "x" * 100, phonemes=150, length_scale=1.5,
+                      duration=15.0, synthesis_time=3.0)
+    estimate = predictor.estimate("en_US-lessac-medium", "x" * 10)
+    assert estimate.phonemes == 15
+    assert estimate.duration == pytest.approx(15 * 15.0 / 150 / 1.5)
+    assert estimate.synthesis_time == pytest.approx(15 * 3.0 / 150)
+
+def test_observations_are_smoothed_per_voice():
+    predictor = Predictor()
+    for _ in range(50):
+        predictor.observe("fast", "x" * 100, phonemes=100, length_scale=1.0, duration=5.0, synthesis_time=1.0)
+    predictor.observe("fast", "x" * 100, phonemes=100, length_scale=1.0, duration=50.0, synthesis_time=1.0)
+
+    seconds_per_phoneme = predictor.estimate("fast", "", phonemes=1).duration
+    # One outlier moves the estimate, but doesn't replace it
+    assert 0.05 < seconds_per_phoneme < 0.5
+    # Other voices keep the defaults
+    assert predictor.estimate("other", "", phonemes=1).duration == pytest.approx(0.07)
+
+def test_empty_observations_are_ignored():
+    predictor = Predictor()
+    predictor.observe("en_US-lessac-medium", "", phonemes=0, length_scale=1.0, duration=1.0, synthesis_time=1.0)
+    assert predictor.estimate("en_US-lessac-medium", "", phonemes=1).duration == pytest.approx(0.07)
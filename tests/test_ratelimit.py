@@ -0,0 +1,57 @@
+import pytest
+
+import config
+from ratelimit import AdmissionController, RateLimitError
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setitem(config.config, "rate_limit_enabled", True)
+    monkeypatch.setitem(config.config, "rate_limit_messages", 20.0)
+    monkeypatch.setitem(config.config, "rate_limit_message_burst", 5.0)
+    monkeypatch.setitem(config.config, "rate_limit_speech_seconds", 60.0)
+    monkeypatch.setitem(config.config, "rate_limit_speech_burst", 30.0)
+    return AdmissionController()
+
+def test_new_key_has_full_burst(admission):
+    # A new key starts with a full bucket, so a request using all of it fits.
+    admission.admit(["speech"], 30.0)
+    admission.admit(["messages"], 1.0, messages=5)
+
+def test_empty_bucket_is_rejected(admission):
+    for _ in range(5):
+        admission.admit(["a"], 1.0)
+    with pytest.raises(RateLimitError) as e:
+        admission.admit(["a"], 1.0)
+    assert e.value.key == "a"
+    assert e.value.retry_after > 0
+
+def test_rejected_request_takes_nothing(admission):
+    admission.admit(["a"], 30.0)
+    with pytest.raises(RateLimitError):
+        admission.admit(["a", "b"], 1.0)
+    # b wasn't charged for the rejected request
+    admission.admit(["b"], 30.0)
+
+def test_disabled(admission, monkeypatch):
+    monkeypatch.setitem(config.config, "rate_limit_enabled", False)
+    for _ in range(100):
+        admission.admit(["a"], 30.0)
+
+def test_oversized_request_is_charged_in_full(admission):
+    # Let through once with a full bucket...
+    admission.admit(["a"], 3000.0, messages=100)
+    # ...but the whole cost has to be paid back before the next one.
+    with pytest.raises(RateLimitError) as e:
+        admission.admit(["a"], 1.0)
+    assert e.value.retry_after > 2900
+
+def test_each_key_is_charged_separately(admission):
+    admission.admit_each({"conn": (5, 10.0), "sender:a": (4, 8.0), "sender:b": (1, 2.0)})
+    counters = admission.counters()
+    assert counters["conn"]["accepted"] == 5
+    assert counters["sender:a"]["accepted"] == 4
+    assert counters["sender:b"]["messageTokens"] == 4.0
+    # b still has room, the connection doesn't
+    admission.admit(["sender:b"], 1.0)
+    with pytest.raises(RateLimitError):
+        admission.admit(["conn"], 1.0)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+
+import pytest
+from websockets.asyncio.client import connect
+
+import config
+import event
+from server import WSServer
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setitem(config.config, "ws_server_enabled", True)
+    server = WSServer("127.0.0.1", 0)
+    server.daemon = True
+    server.start()
+    deadline = time.monotonic() + 5
+    while not server.is_running():
+        assert time.monotonic() < deadline, "server didn't start"
+        time.sleep(0.01)
+    yield server
+    server.stop()
+
+def url(server: WSServer) -> str:
+    return f"ws://127.0.0.1:{server.server.sockets[0].getsockname()[1]}"
+
+async def request(ws, request_id: str, request: str, **fields) -> dict:
+    await ws.send(json.dumps({"id": request_id, "request": request, **fields}))
+    return json.loads(await asyncio.wait_for(ws.recv(), 5))
+
+async def next_event(ws) -> tuple[str, str]:
+    message = json.loads(await asyncio.wait_for(ws.recv(), 5))
+    return message["event"]["source"], message["event"]["type"]
+
+def fire(event_type: str):
+    # Events come from the TTS and audio threads, not the event loop
+    event.ws_event("TextToSpeech", event_type, {"id": "1"})
+
+def test_subscribe_fan_out(server):
+    async def run():
+        async with connect(url(server)) as playing_only, connect(url(server)) as everything:
+            response = await request(playing_only, "1", "Subscribe", events={"TextToSpeech": ["Playing"]})
+            assert response["status"] == "ok"
+            await request(everything, "1", "Subscribe", events={"*": []})
+            assert server.subscribers[("texttospeech", "playing")] == set(server.active_connections)
+            assert len(server.subscribers[("texttospeech", "finished")]) == 1
+
+            await asyncio.to_thread(fire, "playing")
+            assert await next_event(playing_only) == ("TextToSpeech", "playing")
+            assert await next_event(everything) == ("TextToSpeech", "playing")
+
+            await asyncio.to_thread(fire, "finished")
+            assert await next_event(everything) == ("TextToSpeech", "finished")
+            # Nothing was queued for the other one, so the next thing it gets is the response
+            assert (await request(playing_only, "2", "GetEvents"))["id"] == "2"
+
+            await request(everything, "2", "Unsubscribe", events={"texttospeech": ["*"]})
+            await asyncio.to_thread(fire, "playing")
+            assert await next_event(playing_only) == ("TextToSpeech", "playing")
+            assert (await request(everything, "3", "GetEvents"))["id"] == "3"
+
+        # Closed connections are removed from the index
+        deadline = time.monotonic() + 5
+        while server.subscribers:
+            assert time.monotonic() < deadline, server.subscribers
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+def test_malformed_requests(server):
+    async def run():
+        async with connect(url(server)) as ws:
+            await ws.send("{not json")
+            assert json.loads(await ws.recv()) == {"error": "malformed command"}
+            response = await request(ws, "1", "Subscribe", events=["texttospeech"])
+            assert response == {"id": "1", "status": "error", "error": "Malformed json"}
+
+    asyncio.run(run())
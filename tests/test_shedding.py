@@ -0,0 +1,78 @@
+import time
+from dataclasses import dataclass, field
+
+import pytest
+
+import config
+import shedding
+from lanes import LaneQueue
+
+@dataclass(eq=False)
+class Message:
+    message: str
+    priority: int = 2
+    estimated_duration: float = 10000.0
+    duration: float = 0.0
+    queued_at: float = field(default_factory=time.monotonic)
+    voice: str = "EventVoice"
+    id: str = ""
+    events: list = field(default_factory=list)
+
+    def tts_event(self, event_type: str, reason: str|None = None):
+        self.events.append((event_type, reason))
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setitem(config.config, "priority_weights", [8, 4, 2, 1])
+    monkeypatch.setitem(config.config, "shed_enabled", True)
+    monkeypatch.setitem(config.config, "shed_target_delay", 30.0)
+    monkeypatch.setitem(config.config, "shed_max_age", 0)
+    monkeypatch.setitem(config.config, "shed_protected_priority", 0)
+    monkeypatch.setitem(config.config, "shed_strategies", ["max_age", "collapse_similar", "drop_low_priority", "drop_oldest"])
+
+def make_queue(*messages: Message) -> LaneQueue:
+    queue = LaneQueue(cost=shedding.estimate_seconds)
+    for message in messages:
+        queue.put(message, message.priority)
+    return queue
+
+def test_backlog_uses_duration_when_known():
+    queue = make_queue(Message("a"), Message("b", duration=2500.0))
+    assert shedding.backlog_seconds([queue]) == 12.5
+
+def test_under_target_does_nothing():
+    queue = make_queue(Message("a"), Message("a"))
+    shedding.shed([queue])
+    assert len(queue) == 2
+
+def test_collapse_similar():
+    messages = [Message("Hello!"), Message("hello"), Message("HELLO?"), Message("other")]
+    queue = make_queue(*messages)
+    shedding.shed([queue])
+    # Stops as soon as the backlog is back under the target
+    assert list(queue) == [messages[0], messages[2], messages[3]]
+    assert messages[1].events == [("error", "Skipped: similar message already queued")]
+
+def test_drop_low_priority_first(monkeypatch):
+    monkeypatch.setitem(config.config, "shed_strategies", ["drop_low_priority"])
+    messages = [Message("a", priority=1), Message("b", priority=3), Message("c", priority=2), Message("d", priority=3)]
+    queue = make_queue(*messages)
+    shedding.shed([queue])
+    assert set(queue) == {messages[0], messages[2], messages[3]}
+    assert shedding.backlog_seconds([queue]) == 30.0
+
+def test_protected_messages_are_kept(monkeypatch):
+    monkeypatch.setitem(config.config, "shed_strategies", ["drop_oldest"])
+    queue = make_queue(*[Message(str(i), priority=0) for i in range(5)])
+    shedding.shed([queue])
+    assert len(queue) == 5
+
+def test_max_age_applies_under_target(monkeypatch):
+    monkeypatch.setitem(config.config, "shed_max_age", 60)
+    old = Message("old", estimated_duration=1000.0, queued_at=time.monotonic() - 120)
+    protected = Message("protected", priority=0, estimated_duration=1000.0, queued_at=time.monotonic() - 120)
+    new = Message("new", estimated_duration=1000.0)
+    queue = make_queue(old, protected, new)
+    shedding.shed([queue])
+    assert set(queue) == {protected, new}
+    assert old.events == [("error", "Skipped: message too old")]
@@ -0,0 +1,71 @@
+import pytest
+
+import config
+import dedup
+import server
+import tts
+from ratelimit import AdmissionController, RateLimitError
+
+@pytest.fixture(autouse=True)
+def setup(monkeypatch):
+    monkeypatch.setattr(config, "enabled", True)
+    monkeypatch.setitem(config.config, "voices", {"EventVoice": {}, "OtherVoice": {}})
+    monkeypatch.setitem(config.config, "dedup_action", "off")
+    monkeypatch.setitem(config.config, "shed_enabled", False)
+    monkeypatch.setitem(config.config, "rate_limit_enabled", True)
+    monkeypatch.setitem(config.config, "rate_limit_messages", 1.0)
+    monkeypatch.setitem(config.config, "rate_limit_message_burst", 5.0)
+    monkeypatch.setitem(config.config, "rate_limit_speech_seconds", 600.0)
+    monkeypatch.setitem(config.config, "rate_limit_speech_burst", 600.0)
+    monkeypatch.setattr(server, "admission", AdmissionController())
+    monkeypatch.setattr(dedup, "index", dedup.DuplicateIndex())
+    monkeypatch.setattr(tts.event, "ws_event", lambda *args: None)
+    tts._parsing_queue.clear()
+    yield
+    tts._parsing_queue.clear()
+
+handler = server.SpeekabooHandler()
+
+def queued() -> list[tuple[str, str, int]]:
+    messages = []
+    while (message := tts._parsing_queue.pop()) is not None:
+        messages.append((message.voice, message.message, message.priority))
+    return messages
+
+def test_batch_is_queued_in_order_with_defaults():
+    result = handler.cmd_speakbatch({
+        "voice": "EventVoice",
+        "priority": 1,
+        "items": [{"message": "one"}, {"message": "two", "voice": "OtherVoice"}, {"message": "three", "priority": 1}]
+    }, source="ws:a")
+    assert len(result["speechIds"]) == 3
+    assert queued() == [("EventVoice", "one", 1), ("OtherVoice", "two", 1), ("EventVoice", "three", 1)]
+
+def test_invalid_item_queues_nothing():
+    with pytest.raises(ValueError, match="Item 1: Voice alias not found"):
+        handler.cmd_speakbatch({"items": [{"voice": "EventVoice", "message": "one"},
+                                          {"voice": "Nope", "message": "two"}]})
+    assert len(tts._parsing_queue) == 0
+
+def test_too_many_items():
+    with pytest.raises(ValueError, match="Too many items"):
+        handler.cmd_speakbatch({"voice": "EventVoice", "items": [{"message": "hi"}] * (server.MAX_BATCH_SIZE + 1)})
+
+def test_senders_are_charged_for_their_own_items():
+    handler.cmd_speakbatch({"voice": "EventVoice", "items": [
+        *[{"message": f"x{i}", "sender": "x"} for i in range(4)],
+        {"message": "y", "sender": "y"}
+    ]}, source="ws:a")
+
+    # The connection used up its burst on the batch
+    with pytest.raises(RateLimitError) as e:
+        handler.cmd_speak({"voice": "EventVoice", "message": "more"}, source="ws:a")
+    assert e.value.key == "ws:a"
+
+    # y only paid for one message, x for four
+    for _ in range(4):
+        handler.cmd_speak({"voice": "EventVoice", "message": "y", "sender": "y"}, source="ws:b")
+    handler.cmd_speak({"voice": "EventVoice", "message": "x", "sender": "x"}, source="ws:c")
+    with pytest.raises(RateLimitError) as e:
+        handler.cmd_speak({"voice": "EventVoice", "message": "x", "sender": "x"}, source="ws:c")
+    assert e.value.key == "sender:x"
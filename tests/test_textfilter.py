@@ -0,0 +1,50 @@
+import pytest
+
+import config
+import textfilter
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setitem(config.config, "text_filter_enabled", True)
+    monkeypatch.setitem(config.config, "text_filter_url_token", "link")
+    monkeypatch.setitem(config.config, "text_filter_max_repeat", 3)
+    monkeypatch.setitem(config.config, "text_filter_max_combining", 2)
+    monkeypatch.setitem(config.config, "text_filter_max_emote_run", 3)
+
+def normalize(text: str) -> str:
+    return textfilter.normalize(text)[0]
+
+def test_disabled(monkeypatch):
+    monkeypatch.setitem(config.config, "text_filter_enabled", False)
+    assert textfilter.normalize("LOOOOOL https://example.com") == ("LOOOOOL https://example.com", 0)
+
+def test_numbers_are_kept():
+    assert normalize("thanks for the 10000 bits!") == "thanks for the 10000 bits!"
+    assert normalize("1111111") == "1111111"
+
+def test_repeated_characters():
+    text, removed = textfilter.normalize("LETS GOOOOOOOO!!!!!!")
+    assert text == "LETS GOOO!!!"
+    assert removed == 8
+
+@pytest.mark.parametrize("text, expected", [
+    ("https://x.com/a, ok", "link, ok"),
+    ("see https://example.com/page.", "see link."),
+    ("(https://example.com/a?b=c)!", "(link)!"),
+    ("is www.example.org up?", "is link up?"),
+    ("http://a.b/c", "link"),
+])
+def test_urls(text, expected):
+    assert normalize(text) == expected
+
+def test_emote_runs():
+    assert normalize("Kappa Kappa Kappa Kappa Kappa hi") == "Kappa Kappa Kappa hi"
+    assert normalize("\U0001f602" * 6) == "\U0001f602" * 3
+
+def test_combining_marks():
+    assert normalize("z\u0301\u0302\u0303\u0304a") == "z\u0301\u0302a"
+
+def test_settings_change_recompiles(monkeypatch):
+    assert normalize("nooooo") == "nooo"
+    monkeypatch.setitem(config.config, "text_filter_max_repeat", 1)
+    assert normalize("nooooo") == "no"
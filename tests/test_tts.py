@@ -0,0 +1,65 @@
+import pytest
+
+import config
+import dedup
+import tts
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch):
+    monkeypatch.setattr(config, "enabled", True)
+    monkeypatch.setitem(config.config, "dedup_action", "merge")
+    monkeypatch.setitem(config.config, "shed_enabled", False)
+    monkeypatch.setattr(dedup, "index", dedup.DuplicateIndex())
+    events = []
+    monkeypatch.setattr(tts.event, "ws_event", lambda _class, event_type, payload: events.append((event_type, payload["id"])))
+    tts._parsing_queue.clear()
+    yield events
+    tts._parsing_queue.clear()
+
+def test_merge_into_queued_duplicate(queue):
+    first = tts.add("Hello there", "EventVoice")
+    assert tts.add("hello  THERE", "EventVoice") == first
+    assert len(tts._parsing_queue) == 1
+    assert tts._parsing_queue.find(lambda message: True).repeat_count == 2
+    assert queue == [("textqueued", first)]
+
+def test_duplicate_of_playing_message_is_queued_again(queue):
+    first = tts.add("Hello there", "EventVoice")
+    playing = tts._parsing_queue.find(lambda message: True)
+    playing.tts_event("playing")
+
+    second = tts.add("Hello there", "EventVoice")
+    assert second != first
+    assert playing.repeat_count == 1
+    # Later duplicates are merged into the new one
+    assert tts.add("Hello there", "EventVoice") == second
+
+def test_drop_duplicate(queue, monkeypatch):
+    monkeypatch.setitem(config.config, "dedup_action", "drop")
+    first = tts.add("Hello there", "EventVoice")
+    assert tts.add("Hello there", "EventVoice") is None
+    assert len(tts._parsing_queue) == 1
+    assert queue == [("textqueued", first)]
+
+def test_off_queues_everything(queue, monkeypatch):
+    monkeypatch.setitem(config.config, "dedup_action", "off")
+    assert tts.add("Hello there", "EventVoice") != tts.add("Hello there", "EventVoice")
+    assert len(tts._parsing_queue) == 2
+    assert not dedup.index.pending
+
+def test_queue_delay_holds_playback(queue, monkeypatch):
+    monkeypatch.setitem(config.config, "queue_delay", 30.0)
+    tts.add("Hello there", "EventVoice")
+    message = tts._parsing_queue.find(lambda message: True)
+    assert not message.is_playable()
+
+    monkeypatch.setitem(config.config, "queue_delay", 0.0)
+    tts.add("General Kenobi", "EventVoice")
+    assert tts._parsing_queue.find(lambda message: message.message == "General Kenobi").is_playable()
+
+def test_cancel_queued_message(queue):
+    speech_id = tts.add("Hello there", "EventVoice")
+    assert tts.cancel(speech_id)
+    assert len(tts._parsing_queue) == 0
+    assert queue[-1] == ("deleted", speech_id)
+    assert not tts.cancel(speech_id)
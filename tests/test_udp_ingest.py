@@ -0,0 +1,48 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import config
+from udp_ingest import UDPIngest
+
+@pytest.fixture
+def ingest():
+    received = []
+    def handler(json_data, _addr):
+        if json_data.get("fail"):
+            raise ValueError("bad command")
+        received.append(json_data)
+    ingest = UDPIngest("127.0.0.1", 0, handler)
+    ingest.bind()
+    threading.Thread(target=ingest.serve_forever, daemon=True).start()
+    yield ingest, received
+    ingest.close()
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_counts(ingest):
+    ingest, received = ingest
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for datagram in [b'{"command": "speak"}', b'{"fail": true}', b"not json", b"[1, 2]"]:
+            sock.sendto(datagram, ("127.0.0.1", ingest.port))
+    wait_for(lambda: ingest.stats()["received"] == 4 and ingest.stats()["depth"] == 0
+             and sum(ingest.stats()[key] for key in ("handled", "failed", "malformed")) == 4)
+
+    stats = ingest.stats()
+    assert (stats["handled"], stats["failed"], stats["malformed"], stats["dropped"]) == (1, 1, 2, 0)
+    assert received == [{"command": "speak"}]
+
+def test_full_queue_drops(ingest, monkeypatch):
+    ingest, _received = ingest
+    monkeypatch.setitem(config.config, "udp_queue_size", 2)
+    with ingest.condition:
+        # Hold the worker off so nothing is taken from the queue
+        ingest.enqueue([(json.dumps({"n": i}).encode(), "127.0.0.1") for i in range(5)])
+        assert ingest.stats()["dropped"] == 3
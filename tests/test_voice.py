@@ -0,0 +1,74 @@
+import pytest
+
+from piper.voice import PiperVoice
+
+def make_voice(max_phonemes: int = 200) -> PiperVoice:
+    return PiperVoice(session=None, config=None, runopts=None, max_phonemes=max_phonemes)
+
+def sentence(text: str) -> list[str]:
+    # One "phoneme" per character, so words are separated by " " like espeak's output
+    return list(text)
+
+def test_within_limits():
+    voice = make_voice()
+    sentences = [sentence("ab cd."), sentence("ef.")]
+    assert voice.limit_phonemes(sentences, max_words=3) == ([(s, True) for s in sentences], False)
+
+def test_reject_over_word_limit():
+    voice = make_voice()
+    assert voice.limit_phonemes([sentence("ab cd."), sentence("ef gh.")], max_words=3) == (None, False)
+
+def test_reject_over_phoneme_limit():
+    voice = make_voice()
+    assert voice.limit_phonemes([sentence("abcdef")], max_words=0, max_phonemes=5) == (None, False)
+
+def test_truncate_at_word_limit():
+    voice = make_voice()
+    out, truncated = voice.limit_phonemes([sentence("ab cd."), sentence("ef gh ij.")],
+                                          max_words=3, truncate=True)
+    assert truncated
+    assert out == [(sentence("ab cd."), True), (sentence("ef"), True)]
+
+def test_truncate_at_phoneme_limit_keeps_whole_words():
+    voice = make_voice()
+    out, truncated = voice.limit_phonemes([sentence("ab cd ef")], max_words=0, max_phonemes=7, truncate=True)
+    assert truncated
+    assert out == [(sentence("ab cd"), True)]
+
+def test_truncate_with_nothing_left():
+    voice = make_voice()
+    assert voice.limit_phonemes([sentence("abcdef")], max_words=0, max_phonemes=3, truncate=True) == (None, False)
+
+def test_long_sentences_are_split_at_commas():
+    voice = make_voice(max_phonemes=10)
+    out, truncated = voice.limit_phonemes([sentence("abcdef, ghijkl, mnopqr")], max_words=0)
+    assert not truncated
+    # The fragments don't pause, only the empty end of the sentence does
+    assert out == [(sentence("abcdef"), False), (sentence("ghijkl"), False), (sentence("mnopqr"), False), ([], True)]
+
+def test_stops_phonemizing_at_the_limit(monkeypatch):
+    voice = make_voice()
+    phonemized = []
+    def phonemize(text):
+        phonemized.append(text)
+        return [sentence(text)]
+    monkeypatch.setattr(voice, "phonemize", phonemize)
+
+    text = "One two. Three four! Five six? Seven eight."
+    assert voice.limit_phonemes(voice.phonemize_sentences(text), max_words=3) == (None, False)
+    assert phonemized == ["One two.", "Three four!"]
+
+class FakeConfig:
+    sample_rate = 1000
+    phoneme_id_map = {}
+
+def test_only_whole_sentences_are_trimmed(monkeypatch):
+    voice = PiperVoice(session=None, config=FakeConfig(), runopts=None, max_phonemes=200)
+    quiet_then_loud = bytes(200) + b"\xff\x7f" * 100 + bytes(200)
+    monkeypatch.setattr(voice, "phonemes_to_ids", lambda phonemes: [])
+    monkeypatch.setattr(voice, "synthesize_ids_to_raw", lambda ids, **kwargs: quiet_then_loud)
+
+    sentences = [(sentence("ab"), False), (sentence("cd"), False), ([], True), (sentence("ef"), True)]
+    fragment1, fragment2, whole = voice.synthesize_phonemes_raw(sentences, trim_threshold=-40.0, trim_padding=0.0)
+    assert fragment1 == fragment2 == quiet_then_loud
+    assert whole == b"\xff\x7f" * 100
@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from piper import download
+from piper.download import VoiceCatalog, get_voice_catalog
+
+def voice(key: str, language: str, sizes: list[int], aliases: list[str]|None = None) -> dict:
+    info = {
+        "key": key,
+        "language": {"code": language, "name_english": "English", "country_english": "United States"},
+        "files": {f"{key}/file{i}": {"size_bytes": size, "md5_digest": ""} for i, size in enumerate(sizes)},
+    }
+    if aliases is not None:
+        info["aliases"] = aliases
+    return info
+
+VOICES = {
+    "en_US-lessac-medium": voice("en_US-lessac-medium", "en_US", [100, 5], ["en-us-lessac-medium"]),
+    "en_US-amy-low": voice("en_US-amy-low", "en_US", [50]),
+    "de_DE-karlsson-low": voice("de_DE-karlsson-low", "de_DE", [10], ["de-karlsson-low"]),
+}
+
+def test_alias_lookup():
+    catalog = VoiceCatalog(VOICES)
+    assert catalog.resolve("en-us-lessac-medium") == "en_US-lessac-medium"
+    assert catalog["de-karlsson-low"] is VOICES["de_DE-karlsson-low"]
+    assert "de-karlsson-low" in catalog
+    assert catalog.resolve("missing") is None
+    with pytest.raises(KeyError):
+        catalog["missing"] # pylint: disable=pointless-statement
+    # Aliases aren't listed as separate voices
+    assert list(catalog) == list(VOICES)
+    assert len(catalog) == 3
+
+def test_indexes():
+    catalog = VoiceCatalog(VOICES)
+    assert catalog.by_language == {"en_US": ["en_US-lessac-medium", "en_US-amy-low"], "de_DE": ["de_DE-karlsson-low"]}
+    assert catalog.sizes["en_US-lessac-medium"] == 105
+    assert catalog.language_name("en_US") == "English (United States)"
+
+def test_catalog_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "_catalog", None)
+    monkeypatch.setattr(download, "_catalog_key", None)
+    path = tmp_path / "voices.json"
+    path.write_text(json.dumps(VOICES), encoding="utf-8")
+
+    first = get_voice_catalog(tmp_path)
+    assert get_voice_catalog(tmp_path) is first
+
+    # Same contents with a new mtime keeps the catalog
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    assert get_voice_catalog(tmp_path) is first
+
+    path.write_text(json.dumps({"en_US-amy-low": VOICES["en_US-amy-low"]}), encoding="utf-8")
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert list(get_voice_catalog(tmp_path)) == ["en_US-amy-low"]
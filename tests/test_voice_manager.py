@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import config
+from voice_manager import InstalledCatalog
+
+def install(folder, name: str):
+    (folder / f"{name}.onnx").write_bytes(b"model")
+    (folder / f"{name}.onnx.json").write_bytes(b"{}")
+
+def touch(folder, mtime_ns: int):
+    # Directory mtimes can be too coarse to change between two quick edits
+    os.utime(folder, ns=(mtime_ns, mtime_ns))
+
+class CountingCatalog(InstalledCatalog):
+    def __init__(self):
+        super().__init__()
+        self.scans = 0
+
+    def _scan(self):
+        self.scans += 1
+        super()._scan()
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "data_folder", tmp_path)
+    monkeypatch.setitem(config.config, "additional_voices", {})
+    install(tmp_path, "en_US-lessac-medium")
+    (tmp_path / "en_US-amy-low.onnx").write_bytes(b"no config yet")
+    touch(tmp_path, 1_000_000_000)
+
+    return CountingCatalog()
+
+def test_scan(catalog, tmp_path):
+    voice = catalog.get("en_US-lessac-medium")
+    assert voice.model_path == tmp_path / "en_US-lessac-medium.onnx"
+    assert voice.size == len(b"model") + len(b"{}")
+    # Models without a config aren't installed
+    assert catalog.get("en_US-amy-low") is None
+
+def test_rescan_only_when_mtime_changes(catalog, tmp_path):
+    catalog.CHECK_INTERVAL = 0.0
+    catalog.get("en_US-lessac-medium")
+    catalog.get("en_US-lessac-medium")
+    assert catalog.scans == 1
+
+    install(tmp_path, "en_US-amy-low")
+    touch(tmp_path, 2_000_000_000)
+    assert catalog.get("en_US-amy-low") is not None
+    assert catalog.scans == 2
+
+def test_checks_at_most_every_interval(catalog, tmp_path):
+    catalog.CHECK_INTERVAL = 3600.0
+    assert catalog.get("en_US-amy-low") is None
+    install(tmp_path, "en_US-amy-low")
+    touch(tmp_path, 2_000_000_000)
+    assert catalog.get("en_US-amy-low") is None
+
+    catalog.invalidate()
+    assert catalog.get("en_US-amy-low") is not None
+
+def test_additional_voices(catalog, tmp_path, monkeypatch):
+    custom = tmp_path / "custom"
+    custom.mkdir()
+    install(custom, "lessac")
+    monkeypatch.setitem(config.config, "additional_voices", {"en_US-lessac-medium": str(custom / "lessac.onnx")})
+    catalog.invalidate()
+    # Additional voices come first, but aren't listed as downloaded
+    assert catalog.get("en_US-lessac-medium").manual
+    assert not catalog.get_downloaded("en_US-lessac-medium").manual